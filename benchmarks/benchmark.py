@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+"""
+Headless benchmarks for mercurygui.
+
+Measures the acquisition cycle of the data feed, the latency of setting
+changes, the time to set up windows, the plot frame time, the cost of
+appending new readings, of saving the temperature history, of loading
+previous log files, of querying the history and of evaluating alarm rules.
+All benchmarks run against a simulated MercuryiTC under the offscreen Qt
+platform with a temporary home directory, so that user config and log files
+are not touched. Results are written as JSON:
+
+    $ python benchmarks/benchmark.py --output results.json
+
+Compare results of two runs with ``--compare old.json``. The startup
+benchmark reports the fastest of several imports as 'min_ms', all other
+benchmarks are compared by their 'median_ms'.
+"""
+from __future__ import division, print_function, absolute_import
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import timeit
+import tempfile
+import platform
+import argparse
+
+# benchmark this checkout of mercurygui, also if it is not installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# run headless and isolate config and log files before importing mercurygui,
+# all files are created in a temporary home directory which is removed on exit
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+_HOME = tempfile.mkdtemp(prefix='mercurygui-benchmark-')
+os.environ['HOME'] = _HOME
+os.environ['USERPROFILE'] = _HOME
+atexit.register(shutil.rmtree, _HOME, ignore_errors=True)
+
+import numpy as np  # noqa: E402
+
+
+def stats(times):
+    """Returns summary statistics of a list of durations in sec, in ms."""
+    times = np.asarray(times) * 1000
+    return {
+        'n': int(times.size),
+        'min_ms': float(times.min()),
+        'median_ms': float(np.median(times)),
+        'mean_ms': float(times.mean()),
+        'p95_ms': float(np.percentile(times, 95)),
+        'max_ms': float(times.max()),
+    }
+
+
+def repeat(func, n):
+    """Calls `func` `n` times and returns the duration of each call."""
+    times = []
+    for _ in range(n):
+        t0 = timeit.default_timer()
+        func()
+        times.append(timeit.default_timer() - t0)
+    return times
+
+
+def fill_history(history, n, t_end=None, period=1.0):
+    """Fills `history` with `n` samples of simulated readings."""
+    t_end = time.time() if t_end is None else t_end
+    t = t_end - period * (n - 1) + period * np.arange(n)
+    temp = 150 + 100 * np.sin(t / 3600) + np.random.normal(0, 0.01, n)
+    heater = np.clip(0.3 + 0.2 * np.sin(t / 600), 0, 1)
+    gasflow = np.clip(0.1 + 0.05 * np.cos(t / 900), 0, 1)
+    for row in zip(t, temp, heater, gasflow):
+        history.append(*row)
+
+
+# =============================================================================
+# Benchmarks
+# =============================================================================
+
+def bench_feed_cycle(n=200, latencies=(0.0, 0.001, 0.005)):
+    """Latency of DataCollectionWorker.get_readings against the simulator."""
+    from mercurygui.feed import DataCollectionWorker
+    from mercurygui.collector import select_modules
+    from mercurygui.simulator import SimulatedMercuryITC
+
+    results = {}
+    for latency in latencies:
+        mercury = SimulatedMercuryITC(latency=latency, seed=0)
+        worker = DataCollectionWorker(1, mercury, select_modules(mercury.modules))
+        worker.get_readings()  # fill caches
+
+        def cycle():
+            # read all fields, regardless of their polling period
+            worker.request_update()
+            worker.get_readings()
+
+        results['latency_%sms' % (latency * 1000)] = stats(repeat(cycle, n))
+    return results
+
+
+def bench_rules(n=10000, counts=(1, 10, 100)):
+    """
+    Cost per sample of evaluating alarm rules with a threshold and a windowed
+    rate condition each, as done by the worker after every poll cycle.
+    """
+    from mercurygui.rules import RuleEngine
+    from mercurygui.collector import SETTINGS
+
+    results = {}
+    for count in counts:
+        engine = RuleEngine([{
+            'name': 'Rule %s' % i,
+            'when': [{'key': 'HeaterPercent', 'op': '>', 'value': 80, 'hysteresis': 5},
+                     {'key': 'Temp', 'rate': '<', 'value': 0, 'window': 60}],
+            'for': 300, 'actions': ['heater_off', 'notify']} for i in range(count)], SETTINGS)
+        samples = iter(range(n))
+
+        def evaluate():
+            i = next(samples)
+            readings = {'Temp': 150 - 0.01 * i, 'HeaterPercent': 90.0, 'HeaterAuto': 'ON',
+                        'Timestamps': {'Temp': float(i), 'HeaterPercent': float(i)}}
+            engine.evaluate(readings, float(i))
+            engine.enforced(readings)
+
+        results['rules_%s' % count] = stats(repeat(evaluate, n))
+    return results
+
+
+def bench_command_latency(n=50, latency=0.005, refresh=0.1):
+    """
+    Time from submitting a setting until it is written, while polling with
+    `latency` per round trip, for normal and safety priority.
+    """
+    import threading
+    from mercurygui.collector import DataCollector, select_modules, SAFETY, WRITE
+    from mercurygui.simulator import SimulatedMercuryITC
+
+    mercury = SimulatedMercuryITC(latency=latency, seed=0)
+    worker = DataCollector(refresh, mercury, select_modules(mercury.modules))
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+
+    results = {}
+    for name, priority in (('write', WRITE), ('safety', SAFETY)):
+        done = threading.Event()
+        times = []
+        for i in range(n):
+            done.clear()
+            t0 = timeit.default_timer()
+            worker.submit('TempSetpoint', 10 + i, priority, lambda r, e: done.set())
+            done.wait()
+            times.append(timeit.default_timer() - t0)
+            # submit at different phases of the poll cycle
+            time.sleep(refresh * 0.37)
+        results['%s_latency_%sms' % (name, latency * 1000)] = stats(times)
+
+    worker.stop()
+    thread.join()
+    return results
+
+
+def bench_startup(repeat=3):
+    """Fastest import time of the entry points in a fresh interpreter."""
+    from mercurygui import startup
+
+    results = {}
+    for r in startup.profile(repeat):
+        results[r['stage']] = {
+            'min_ms': r['time'] * 1000,
+            'budget_ms': r['budget'] * 1000,
+            'heavy': r['heavy'],
+            'violations': r['violations'],
+        }
+    return results
+
+
+def bench_ui_setup(n=20):
+    """Time to set up windows from compiled UI modules and from '.ui' files."""
+    from qtpy import QtWidgets, uic
+    from mercurygui.utils.uiloader import load_ui, UI_DIR
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv[:1])
+
+    results = {}
+    for name, cls in (('main', QtWidgets.QMainWindow), ('connection_dialog', QtWidgets.QDialog),
+                      ('module_dialog', QtWidgets.QDialog)):
+        path = os.path.join(UI_DIR, name + '.ui')
+        results['%s_compiled' % name] = stats(repeat(lambda: load_ui(name, cls()), n))
+        results['%s_runtime' % name] = stats(repeat(lambda: uic.loadUi(path, cls()), n))
+    app.processEvents()
+    return results
+
+
+def bench_plot_frame(sizes=(1000, 10000, 86400), n=50):
+    """Frame time of MercuryPlotCanvas.update_plot for a full 24 h window."""
+    from qtpy import QtWidgets
+    from mercurygui.main import MercuryPlotCanvas
+    from mercurygui.history import TemperatureHistory
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv[:1])
+
+    results = {}
+    for size in sizes:
+        canvas = MercuryPlotCanvas()
+        canvas.resize(800, 600)
+        canvas.show()
+        app.processEvents()
+
+        # samples cover slightly more than the 24 h window
+        history = TemperatureHistory(capacity=86400)
+        fill_history(history, size, period=1.01 * 86400 / size)
+
+        # first frame includes a full redraw
+        t_first = repeat(lambda: canvas.update_plot(history, -1440), 1)
+
+        def frame():
+            history.append(history.latest_time + 1, 150, 0.3, 0.1)
+            canvas.update_plot(history, -1440)
+
+        results['samples_%s' % size] = stats(repeat(frame, n))
+        results['samples_%s' % size]['first_frame_ms'] = t_first[0] * 1000
+
+        canvas.close()
+        canvas.deleteLater()
+        app.processEvents()
+
+    return results
+
+
+def bench_append(n=2000):
+    """Cost of appending a reading to the history and via update_plot_data."""
+    from qtpy import QtWidgets
+    from mercurygui.history import TemperatureHistory
+    from mercurygui.main import MercuryMonitorApp
+    from mercurygui.feed import MercuryFeed
+    from mercurygui.simulator import SimulatedMercuryITC
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv[:1])
+
+    results = {}
+
+    history = TemperatureHistory(capacity=86400)
+    fill_history(history, 86400)
+    results['history_append_full'] = stats(
+        repeat(lambda: history.append(history.latest_time + 1, 150, 0.3, 0.1), n))
+
+    mercury = SimulatedMercuryITC(seed=0)
+    feed = MercuryFeed(mercury, refresh=1)
+    gui = MercuryMonitorApp(feed)
+    gui.show()
+    app.processEvents()
+    fill_history(gui.history, 86400)
+
+    readings = {'Temp': 150.0, 'HeaterPercent': 30.0, 'FlowPercent': 10.0}
+
+    def update():
+        # as MercuryFeed._get_data, without updating the other widgets
+        feed.history.record(readings)
+        gui.update_plot_data(readings)
+
+    results['update_plot_data_full'] = stats(repeat(update, n // 10))
+
+    return results, gui
+
+
+def bench_backfill(n=5, size=86400):
+    """
+    Time to read 24 h or a 1 h slice of previous log files, uncompressed and
+    compressed, and to add them to the history.
+    """
+    from mercurygui.history import TemperatureHistory
+    from mercurygui.log_writer import SegmentLog, TextLog, text_header, archive_logs
+    from mercurygui.log_reader import iter_logs_reversed, find_logs, read_log
+
+    history = TemperatureHistory(capacity=size)
+    fill_history(history, size, t_end=time.time() - 60)
+    rows = history.last().T.copy()
+
+    results = {}
+    for ext in ('.mseg', '.txt', '.mseg.gz', '.txt.gz'):
+        directory = tempfile.mkdtemp(prefix='mercurygui-backfill-', dir=_HOME)
+        if ext.startswith('.txt'):
+            name = 'temperature_log %s.txt' % time.strftime('%Y-%m-%d_%H-%M-%S',
+                                                            time.localtime(rows[0, 0]))
+            TextLog(os.path.join(directory, name), text_header(10)).write(rows)
+        else:
+            SegmentLog(directory, capacity=size // 4).write(rows)
+        if ext.endswith('.gz'):
+            archive_logs([path for _, path in find_logs(directory)])
+
+        def read():
+            return list(iter_logs_reversed(directory, rows[0, 0], time.time()))
+
+        t_slice = rows[size // 2, 0]
+
+        def read_slice():
+            return [read_log(path, t_slice, t_slice + 3600)
+                    for _, path in find_logs(directory, t_slice, t_slice + 3600)]
+
+        key = ext.strip('.').replace('.', '_')
+        results['read_%s_%s' % (key, size)] = stats(repeat(read, n))
+        results['read_%s_slice_1h' % key] = stats(repeat(read_slice, n))
+
+    columns = history.last().copy()
+    results['history_extend_%s' % size] = stats(
+        repeat(lambda: (history.clear(), history.extend(columns)), n))
+    return results
+
+
+def bench_query(n=5, days=30):
+    """
+    Time to query a month of log files at 1 min resolution from their rollups
+    and from the readings themselves, and 24 h from memory.
+    """
+    from mercurygui.history import FeedHistory
+    from mercurygui.log_writer import SegmentLog, archive_logs
+    from mercurygui.log_reader import find_logs
+
+    t_end = time.time() - 60
+    directory = tempfile.mkdtemp(prefix='mercurygui-query-', dir=_HOME)
+    log = SegmentLog(directory, capacity=86400)
+    for day in range(days):
+        history = FeedHistory(capacity=86400)
+        fill_history(history, 86400, t_end=t_end - 86400 * (days - day - 1))
+        log.write(history.last().T.copy())
+    archive_logs([path for _, path in find_logs(directory)], compress=False)
+
+    # the feed started after the last log
+    history = FeedHistory(capacity=86400, directory=directory)
+    fill_history(history, 86400, t_end=t_end + 86400)
+    t0 = t_end - 86400 * days
+
+    def query_logs(resolution):
+        return history.query(t0, t_end, resolution=resolution)
+
+    results = {}
+    results['logs_%sd_rollup_60s' % days] = stats(repeat(lambda: query_logs(60), n))
+    results['logs_%sd_max_points_1000' % days] = stats(
+        repeat(lambda: history.query(t0, t_end, max_points=1000), n))
+    # resolution below the rollup period requires the readings
+    results['logs_%sd_raw_30s' % days] = stats(repeat(lambda: query_logs(30), n))
+    results['memory_24h'] = stats(repeat(lambda: history.query(t_end), n))
+    results['memory_24h_60s'] = stats(repeat(lambda: history.query(t_end, resolution=60), n))
+    return results
+
+
+def bench_save(gui, n=5):
+    """Time to save 24 h of history with save_temperature_data."""
+    directory = tempfile.mkdtemp(prefix='mercurygui-save-', dir=_HOME)
+    results = {}
+    for ext in ('.txt', '.mseg'):
+        paths = iter(os.path.join(directory, 'data_%s%s' % (i, ext)) for i in range(n))
+        key = 'save_%s_86400' % ext.strip('.')
+        results[key] = stats(repeat(lambda: gui.save_temperature_data(next(paths)), n))
+    return results
+
+
+# =============================================================================
+# Runner
+# =============================================================================
+
+def metadata():
+    import matplotlib
+    from qtpy import QT_VERSION, API_NAME
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'matplotlib': matplotlib.__version__,
+        'qt': '%s %s' % (API_NAME, QT_VERSION),
+    }
+
+
+def run_all():
+    np.random.seed(0)
+    results = {}
+    results['startup'] = bench_startup()
+    results['feed_cycle'] = bench_feed_cycle()
+    results['commands'] = bench_command_latency()
+    results['rules'] = bench_rules()
+    results['ui_setup'] = bench_ui_setup()
+    results['plot_frame'] = bench_plot_frame()
+    results['append'], gui = bench_append()
+    results['save'] = bench_save(gui)
+    results['backfill'] = bench_backfill()
+    results['query'] = bench_query()
+    gui.exit_()
+    return {'meta': metadata(), 'results': results}
+
+
+def compare(old, new, threshold=1.2):
+    """
+    Prints benchmarks whose median, or minimum if there is no median, got
+    slower by more than `threshold`.
+    """
+    regressions = []
+    for group, benchmarks in new['results'].items():
+        for name, result in benchmarks.items():
+            key = 'median_ms' if 'median_ms' in result else 'min_ms'
+            try:
+                old_time = old['results'][group][name][key]
+            except KeyError:
+                continue
+            ratio = result[key] / old_time if old_time else 1
+            line = '%s/%s: %.3f ms -> %.3f ms (x%.2f)' % (
+                group, name, old_time, result[key], ratio)
+            print(line)
+            if ratio > threshold:
+                regressions.append(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run mercurygui benchmarks.')
+    parser.add_argument('-o', '--output', help='write JSON results to file')
+    parser.add_argument('--compare', metavar='JSON', help='compare with previous results')
+    args = parser.parse_args()
+
+    report = run_all()
+    text = json.dumps(report, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    failed = False
+
+    violations = ['%s: %s' % (stage, v) for stage, r in report['results']['startup'].items()
+                  for v in r['violations']]
+    if violations:
+        print('Startup budget exceeded:\n' + '\n'.join(violations))
+        failed = True
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report)
+        if regressions:
+            print('Regressions:\n' + '\n'.join(regressions))
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
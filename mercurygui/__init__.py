@@ -1,3 +1,27 @@
-from mercurygui.main import MercuryMonitorApp
-from mercurygui.feed import MercuryFeed
-from mercurygui.config.main import CONF
+import sys
+import importlib
+
+__all__ = ['MercuryMonitorApp', 'MercuryFeed', 'HeadlessFeed', 'CONF']
+
+# modules of public classes, imported on first access so that headless use
+# does not import Qt or matplotlib
+_EXPORTS = {
+    'MercuryMonitorApp': 'mercurygui.main',
+    'MercuryFeed': 'mercurygui.feed',
+    'HeadlessFeed': 'mercurygui.stream',
+    'CONF': 'mercurygui.config.main',
+}
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name in _EXPORTS:
+            return getattr(importlib.import_module(_EXPORTS[name]), name)
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+    def __dir__():
+        return sorted(list(globals()) + list(_EXPORTS))
+else:
+    from mercurygui.main import MercuryMonitorApp
+    from mercurygui.feed import MercuryFeed
+    from mercurygui.stream import HeadlessFeed
+    from mercurygui.config.main import CONF
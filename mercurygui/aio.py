@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio interface to the readings of a data feed, see
+:class:`mercurygui.stream.ReadingsPublisher`. Requires Python 3.5 or later.
+
+Note: Leave this file free of Qt related imports, so that it can be used
+without a GUI.
+"""
+import asyncio
+import threading
+import collections
+
+from mercurygui.stream import FeedClosedError
+
+_CLOSED = object()
+
+
+def _running_loop():
+    """Returns the running event loop, or None if called outside of one."""
+    try:
+        get_running_loop = asyncio.get_running_loop
+    except AttributeError:  # Python < 3.7
+        loop = asyncio.get_event_loop()
+        return loop if loop.is_running() else None
+    try:
+        return get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class AsyncReadingsQueue(object):
+    """
+    Bounded queue of readings for a coroutine, which can be iterated over
+    with ``async for``. Readings are put from any thread and handed over to
+    the event loop of the queue. When full, the oldest readings are dropped.
+
+    :param int maxsize: Maximum number of queued readings.
+    :param on_close: Callback when the queue is closed.
+    :param loop: Event loop of the consumer. By default, the loop running
+        when the queue is created or else when it is first awaited.
+    """
+
+    def __init__(self, maxsize=100, on_close=None, loop=None):
+        self._loop = loop or _running_loop()
+        # guards binding to the event loop on first use
+        self._loop_lock = threading.Lock()
+        self._queue = collections.deque(maxlen=max(int(maxsize), 1))
+        self._waiter = None
+        self._on_close = on_close
+        self.closed = False
+        self.dropped = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.get()
+        except FeedClosedError:
+            raise StopAsyncIteration
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, readings):
+        """Adds readings to the queue, may be called from any thread."""
+        if self.closed:
+            return
+        with self._loop_lock:
+            if self._loop is None:
+                # nobody can be waiting before the queue is bound to a loop
+                self._put(readings)
+                return
+        try:
+            self._loop.call_soon_threadsafe(self._put, readings)
+        except RuntimeError:
+            # event loop is closed
+            self.close()
+
+    def _put(self, readings):
+        if readings is not _CLOSED and len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(readings)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def get(self):
+        """
+        Returns the oldest queued readings, waits for new readings if empty.
+
+        :raises: :class:`mercurygui.stream.FeedClosedError` if the queue is
+            closed and empty.
+        """
+        if self._loop is None:
+            with self._loop_lock:
+                self._loop = _running_loop()
+        while not self._queue:
+            self._waiter = self._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+
+        readings = self._queue[0]
+        if readings is _CLOSED:
+            raise FeedClosedError('Readings queue is closed.')
+        return self._queue.popleft()
+
+    def close(self):
+        """Stops receiving readings, queued readings can still be read."""
+        if self.closed:
+            return
+        self.closed = True
+        if self._on_close:
+            self._on_close(self)
+        with self._loop_lock:
+            if self._loop is None:
+                self._put(_CLOSED)
+                return
+        try:
+            self._loop.call_soon_threadsafe(self._put, _CLOSED)
+        except RuntimeError:
+            pass
+
+
+async def next_reading(feed, timeout=None):
+    """
+    Waits for the next readings of `feed`.
+
+    :param feed: :class:`mercurygui.stream.ReadingsPublisher` such as
+        :class:`mercurygui.feed.MercuryFeed` or
+        :class:`mercurygui.stream.HeadlessFeed`.
+    :param float timeout: Maximum time to wait in sec, forever if None.
+    :raises: :class:`asyncio.TimeoutError` on timeout.
+    """
+    queue = feed.aiter(maxsize=1)
+    try:
+        return await asyncio.wait_for(queue.get(), timeout)
+    finally:
+        queue.close()
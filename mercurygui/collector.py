@@ -0,0 +1,834 @@
+# -*- coding: utf-8 -*-
+"""
+Acquisition of readings from the MercuryiTC, shared by
+:class:`mercurygui.feed.MercuryFeed` and :class:`mercurygui.stream.HeadlessFeed`.
+
+Note: Leave this file free of Qt related imports, so that it can be used
+without a GUI.
+"""
+from __future__ import division, absolute_import
+import time
+import numbers
+import heapq
+import logging
+import threading
+import functools
+import itertools
+import collections
+
+from mercurygui.scheduler import Scheduler, Backoff, monotonic
+from mercurygui.rules import RuleEngine
+from mercurygui.utils.scpi import to_float
+
+logger = logging.getLogger(__name__)
+
+# readings of a poll cycle as (key, module, property, SCPI noun, converter),
+# property is the attribute of the mercuryitc module which reads the same
+# value, it is used as fallback
+READINGS = (
+    ('HeaterVolt', 'heater', 'volt', 'SIG:VOLT', to_float),
+    ('HeaterVoltLimit', 'heater', 'vlim', 'VLIM', to_float),
+    ('HeaterAuto', 'control', 'heater_auto', 'ENAB', str),
+    ('HeaterPercent', 'control', 'heater', 'HSET', to_float),
+    ('FlowAuto', 'control', 'flow_auto', 'FAUT', str),
+    ('FlowPercent', 'gasflow', 'perc', 'SIG:PERC', to_float),
+    ('FlowMin', 'gasflow', 'gmin', 'GMIN', to_float),
+    ('FlowSetpoint', 'control', 'flow', 'FSET', to_float),
+    ('Temp', 'temperature', 'temp', 'SIG:TEMP', to_float),
+    ('TempSetpoint', 'control', 't_setpoint', 'TSET', to_float),
+    ('TempRamp', 'control', 'ramp', 'RSET', to_float),
+    ('TempRampEnable', 'control', 'ramp_enable', 'RENA', str),
+)
+
+
+# polling periods in sec of fields which are not given in `periods`
+DEFAULT_PERIODS = {'HeaterVoltLimit': 60.0}
+
+
+def _on_off(value):
+    """Converts True, False, 'ON' or 'OFF' to 'ON' or 'OFF'."""
+    if value in (True, 'ON', 'on'):
+        return 'ON'
+    elif value in (False, 'OFF', 'off'):
+        return 'OFF'
+    raise ValueError("Only values 'ON' or 'OFF' allowed, got %r." % value)
+
+
+# settings which can be changed through the data feed as dict of key and
+# (module, property, converter)
+SETTINGS = {
+    'HeaterAuto': ('control', 'heater_auto', _on_off),
+    'HeaterPercent': ('control', 'heater', float),
+    'FlowAuto': ('control', 'flow_auto', _on_off),
+    'FlowSetpoint': ('control', 'flow', float),
+    'TempSetpoint': ('control', 't_setpoint', float),
+    'TempRamp': ('control', 'ramp', float),
+    'TempRampEnable': ('control', 'ramp_enable', _on_off),
+}
+
+
+def _convert_setting(key, value):
+    return SETTINGS[key][2](value)
+
+
+# priorities of commands, lower values are executed first and all commands
+# are executed before polling
+SAFETY = 0
+WRITE = 1
+QUERY = 2
+
+PRIORITY_NAMES = {SAFETY: 'safety', WRITE: 'write', QUERY: 'query'}
+
+
+class _Command(object):
+
+    __slots__ = ('key', 'func', 'priority', 'seq', 'submitted', 'callbacks')
+
+    def __init__(self, key, func, priority, seq, submitted, callback):
+        self.key = key
+        self.func = func
+        self.priority = priority
+        self.seq = seq
+        self.submitted = submitted
+        self.callbacks = [callback] if callback else []
+
+
+class CommandQueue(object):
+    """
+    Thread-safe queue of commands for the MercuryiTC, ordered by priority
+    and then by submission.
+
+    Commands with a key are coalesced: a command submitted while another
+    one with the same key is pending replaces the pending one. It keeps the
+    earlier place in the queue, or moves up if its priority is higher.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._pending = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def __len__(self):
+        with self._lock:
+            return sum(1 for _, seq, command in self._heap if seq == command.seq)
+
+    def put(self, func, key=None, priority=WRITE, callback=None):
+        """
+        Adds a command to the queue.
+
+        :param func: Function without arguments which executes the command.
+        :param key: Hashable key to coalesce commands by, e.g. the setting.
+        :param int priority: :data:`SAFETY`, :data:`WRITE` or :data:`QUERY`.
+        :param callback: Called with the result and the exception raised by
+            `func`, or None, after the command was executed.
+        """
+        now = monotonic()
+        with self._lock:
+            command = self._pending.get(key) if key is not None else None
+            if command is not None:
+                self.coalesced += 1
+                command.func = func
+                command.submitted = now
+                if callback:
+                    command.callbacks.append(callback)
+                if priority >= command.priority:
+                    return
+                # move up, the old heap entry is skipped by get
+                command.priority = priority
+                command.seq = next(self._seq)
+            else:
+                command = _Command(key, func, priority, next(self._seq), now, callback)
+                if key is not None:
+                    self._pending[key] = command
+            heapq.heappush(self._heap, (command.priority, command.seq, command))
+
+    def get(self):
+        """Removes and returns the next command, None if empty."""
+        with self._lock:
+            while self._heap:
+                _, seq, command = heapq.heappop(self._heap)
+                if seq != command.seq:
+                    continue
+                if command.key is not None:
+                    del self._pending[command.key]
+                return command
+            return None
+
+
+def merge_readings(state, update):
+    """
+    Merges readings emitted in delta mode into the full state of readings.
+
+    :param dict state: Full readings, updated in place.
+    :param dict update: Emitted readings, full or delta.
+    :returns: `state`
+    """
+    timestamps = state.setdefault('Timestamps', {})
+    for key, value in update.items():
+        if key == 'Timestamps':
+            timestamps.update(value)
+        elif key != 'Keyframe':
+            state[key] = value
+    return state
+
+
+def find_modules(mercury_modules):
+    """
+    Finds the temperature, gas flow and heater modules of a MercuryiTC.
+
+    :param mercury_modules: List of modules of :class:`mercuryitc.MercuryITC`.
+    :returns: Dict with keys 'temperature', 'gasflow' and 'heater' and values
+        of lists of tuples (index, nick). Temperature modules are listed
+        once per nick, control loops are skipped.
+    """
+    found = {'temperature': [], 'gasflow': [], 'heater': []}
+    temp_nicks = []
+
+    for i in range(len(mercury_modules) - 1, -1, -1):
+        address = mercury_modules[i].address
+        type_ = address.split(':')[-1]
+        nick = mercury_modules[i].nick
+        if type_ == 'AUX':
+            found['gasflow'].append((i, nick))
+        elif type_ == 'HTR':
+            found['heater'].append((i, nick))
+        elif type_ == 'TEMP':
+            if nick not in temp_nicks:
+                temp_nicks.append(nick)
+                found['temperature'].append((i, nick))
+
+    return found
+
+
+def select_modules(mercury_modules, temperature=0, gasflow=0, heater=0):
+    """
+    Selects modules for data collection without user interaction.
+
+    :param mercury_modules: List of modules of :class:`mercuryitc.MercuryITC`.
+    :param int temperature: Index into the temperature modules found by
+        :func:`find_modules`, as stored in the config.
+    :param int gasflow: Index into the gas flow modules.
+    :param int heater: Index into the heater modules.
+    :returns: Dict of module numbers as expected by :class:`DataCollector`.
+    """
+    found = find_modules(mercury_modules)
+    selection = {'temperature': temperature, 'gasflow': gasflow, 'heater': heater}
+
+    mod_numbers = {}
+    for key, modules in found.items():
+        if len(modules) == 0:
+            raise ValueError('No %s module found.' % key)
+        index = selection[key] if selection[key] < len(modules) else 0
+        mod_numbers[key] = modules[index][0]
+    return mod_numbers
+
+
+def connect_mercury(mercury, timeout=None):
+    """
+    Connects to the MercuryiTC if not connected.
+
+    :param mercury: Instance of :class:`mercuryitc.MercuryITC`.
+    :param float timeout: Maximum time in sec to open the connection, if
+        supported by the driver.
+    :returns: True if connected, False otherwise.
+    """
+    if mercury.connected:
+        return True
+    kwargs = {} if timeout is None else {'open_timeout': int(timeout * 1000)}
+    try:
+        try:
+            mercury.connect(**kwargs)
+        except TypeError:
+            # driver does not accept connection arguments
+            mercury.connect()
+    except Exception:
+        logger.debug('Could not connect to %s.', mercury.visa_address, exc_info=True)
+    return bool(mercury.connected)
+
+
+def disconnect_mercury(mercury):
+    """Closes the connection to the MercuryiTC, ignoring errors."""
+    try:
+        mercury.disconnect()
+    except Exception:
+        logger.debug('Error closing connection to %s.', mercury.visa_address, exc_info=True)
+
+
+class _DummyLock(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class DataCollector(object):
+    """
+    Periodically reads the values of :data:`READINGS` from the MercuryiTC
+    and passes them to all listeners, see :meth:`add_listener`. Call
+    :meth:`run` from a dedicated thread.
+
+    :param float refresh: Refresh interval in sec.
+    :param mercury: Instance of :class:`mercuryitc.MercuryITC`.
+    :param dict mod_numbers: Indices of the 'temperature', 'gasflow' and
+        'heater' modules in `mercury.modules`.
+    :param dict periods: Polling periods in sec of individual fields.
+    :param bool delta: Emit only changed fields.
+    :param dict deadbands: Minimum change of numeric fields in delta mode.
+    :param float keyframe_interval: Interval in sec between keyframes in
+        delta mode.
+    :param bool reconnect: Reconnect automatically when the connection is
+        lost, with exponentially growing delays between attempts.
+    :param float connect_timeout: Maximum time in sec of a connection attempt.
+    :param float max_backoff: Maximum delay in sec between attempts.
+    :param rules: Alarm and interlock rules which are evaluated after every
+        poll cycle, as list of dicts or :class:`mercurygui.rules.RuleEngine`.
+        See :mod:`mercurygui.rules`.
+    :raises: :class:`ValueError` for rules which change unknown settings.
+    """
+
+    def __init__(self, refresh, mercury, mod_numbers, periods=None,
+                 delta=False, deadbands=None, keyframe_interval=60,
+                 reconnect=True, connect_timeout=5.0, max_backoff=30.0,
+                 rules=None):
+        super(DataCollector, self).__init__()
+        self.scheduler = Scheduler(refresh)
+        self.mercury = mercury
+        self.mod_numbers = mod_numbers
+        self.periods = dict(DEFAULT_PERIODS, **(periods or {}))
+
+        self.delta = delta
+        self.deadbands = dict(deadbands or {})
+        self.keyframe_interval = keyframe_interval
+
+        # commands from other threads, executed before polling
+        self.commands = CommandQueue()
+        self._latency = dict((p, collections.deque(maxlen=100)) for p in PRIORITY_NAMES)
+
+        self.auto_reconnect = reconnect
+        self.connect_timeout = connect_timeout
+        self.backoff = Backoff(maximum=max_backoff)
+        self._reconnecting = False
+        # paused on purpose, no reconnection until reconnect is called
+        self._paused = False
+        # close the connection from the thread running run
+        self._close_requested = False
+
+        # callbacks for new readings, connection changes, reconnection
+        # attempts and alarms
+        self._listeners = []
+        self._connection_listeners = []
+        self._reconnect_listeners = []
+        self._alarm_listeners = []
+
+        if isinstance(rules, RuleEngine):
+            rules.check_settings(SETTINGS)
+        else:
+            rules = RuleEngine(rules or (), SETTINGS)
+        # report invalid values of settings now rather than when enforced
+        for rule in rules.rules:
+            for key, value in rule.settings.items():
+                _convert_setting(key, value)
+        self.rules = rules
+
+        # monotonic time when each field is next due
+        self._due = {}
+        self._due_lock = threading.Lock()
+
+        # last emitted values and time of last keyframe in delta mode
+        self._emitted = {}
+        self._last_keyframe = None
+
+        self.readings = {'Timestamps': {}}
+        self.update_modules(self.mod_numbers)
+
+        self.running = True
+        self.terminate = False
+
+    def add_listener(self, callback):
+        """
+        Registers a callback for new readings. It is called from the thread
+        running :meth:`run` with the readings dict as only argument and
+        should return quickly.
+        """
+        self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback):
+        self._listeners = [c for c in self._listeners if c != callback]
+
+    def add_connection_listener(self, callback):
+        """
+        Registers a callback which is called with False when the connection
+        is lost and with True when it is reestablished by :meth:`run`.
+        """
+        self._connection_listeners = self._connection_listeners + [callback]
+
+    def remove_connection_listener(self, callback):
+        self._connection_listeners = [c for c in self._connection_listeners if c != callback]
+
+    def add_reconnect_listener(self, callback):
+        """
+        Registers a callback which is called after every reconnection attempt
+        with the number of the attempt, whether it succeeded and the delay in
+        sec until the next attempt (None on success).
+        """
+        self._reconnect_listeners = self._reconnect_listeners + [callback]
+
+    def remove_reconnect_listener(self, callback):
+        self._reconnect_listeners = [c for c in self._reconnect_listeners if c != callback]
+
+    def add_alarm_listener(self, callback):
+        """
+        Registers a callback which is called with the name of a rule, whether
+        it is active and its message when a rule with the action 'notify'
+        triggers or clears. See :mod:`mercurygui.rules`.
+        """
+        self._alarm_listeners = self._alarm_listeners + [callback]
+
+    def remove_alarm_listener(self, callback):
+        self._alarm_listeners = [c for c in self._alarm_listeners if c != callback]
+
+    def _emit_readings(self, readings):
+        for callback in self._listeners:
+            try:
+                callback(readings)
+            except Exception:
+                logger.exception('Error in readings listener %s.', callback)
+
+    def _emit_connected(self, connected):
+        for callback in self._connection_listeners:
+            try:
+                callback(connected)
+            except Exception:
+                logger.exception('Error in connection listener %s.', callback)
+
+    def _emit_reconnect(self, attempt, connected, retry_in):
+        for callback in self._reconnect_listeners:
+            try:
+                callback(attempt, connected, retry_in)
+            except Exception:
+                logger.exception('Error in reconnect listener %s.', callback)
+
+    def _emit_alarm(self, name, active, message):
+        for callback in self._alarm_listeners:
+            try:
+                callback(name, active, message)
+            except Exception:
+                logger.exception('Error in alarm listener %s.', callback)
+
+    @property
+    def refresh(self):
+        """Refresh interval in sec."""
+        return self.scheduler.period
+
+    @refresh.setter
+    def refresh(self, value):
+        self.scheduler.period = value
+
+    def run(self):
+        while not self.terminate:
+            if self._close_requested:
+                # requested by close_connection, closed here so that no
+                # query in progress is cut off
+                self._close_requested = False
+                disconnect_mercury(self.mercury)
+
+            if self.running:
+                try:
+                    # commands go ahead of polling
+                    self._execute_commands()
+                    # sleep until next scheduled refresh, new commands
+                    # interrupt the sleep
+                    if not self.scheduler.wait():
+                        continue
+                    # proceed with full update
+                    self.get_readings()
+                except Exception:
+                    self._connection_lost()
+            elif self._reconnecting:
+                self._reconnect_attempt()
+            else:
+                # stopped after a lost connection, resume when connected
+                # from elsewhere
+                self.scheduler.sleep(max(self.refresh, 1))
+                if self.mercury.connected and not self._paused and not self.terminate:
+                    self._resume()
+
+        self._flush_commands()
+
+    def reconnect(self):
+        """
+        Reconnects to the MercuryiTC from the thread running :meth:`run`,
+        starting with an immediate attempt. Returns without waiting.
+        """
+        self._paused = False
+        if self.running:
+            return
+        self.backoff.reset()
+        self._reconnecting = True
+        self.scheduler.interrupt()
+
+    def stop(self):
+        """
+        Ends :meth:`run` without waiting for it. A query in progress is
+        completed, so that no unanswered commands are left on the
+        instrument, and :meth:`run` returns right after writing pending
+        settings. Waits between queries are interrupted.
+        """
+        self.terminate = True
+        self.running = False
+        self._reconnecting = False
+        self.scheduler.interrupt()
+
+    def pause(self):
+        """
+        Stops data collection and reconnection attempts, e.g. before
+        disconnecting on purpose. Resume with :meth:`reconnect`.
+        """
+        self._paused = True
+        self.running = False
+        self._reconnecting = False
+        self.scheduler.interrupt()
+
+    def close_connection(self):
+        """
+        Stops data collection, see :meth:`pause`, and closes the connection
+        from the thread running :meth:`run` once the query in progress has
+        completed. Returns without waiting. Resume with :meth:`reconnect`.
+        """
+        self.pause()
+        self._close_requested = True
+        self.scheduler.interrupt()
+
+    def _connection_lost(self):
+        # notify listeners and stop polling
+        self._emit_connected(False)
+        self.running = False
+        disconnect_mercury(self.mercury)
+        logger.warning('Connection to MercuryiTC lost.')
+
+        # a query which failed because of pause is not a lost connection
+        if self.auto_reconnect and not self._paused:
+            self.backoff.reset()
+            self._reconnecting = True
+
+    def _reconnect_attempt(self):
+        attempt = self.backoff.attempts + 1
+        connected = connect_mercury(self.mercury, self.connect_timeout)
+
+        if not self._reconnecting or self.terminate:
+            # cancelled by pause during the attempt
+            if connected and not self.terminate:
+                disconnect_mercury(self.mercury)
+            return
+
+        if connected:
+            self._reconnecting = False
+            logger.info('Reconnected to MercuryiTC after %s attempt(s).', attempt)
+            self._emit_reconnect(attempt, True, None)
+            self._resume()
+        else:
+            delay = self.backoff.next_delay()
+            logger.info('Reconnection attempt %s failed, retrying in %.1f sec.', attempt, delay)
+            self._emit_reconnect(attempt, False, delay)
+            self.scheduler.sleep(delay)
+
+    def _resume(self):
+        # the driver creates new module instances when connecting
+        try:
+            self.update_modules(self.mod_numbers)
+        except (IndexError, KeyError):
+            logger.warning('Selected modules not found, using defaults.')
+            self.update_modules(select_modules(self.mercury.modules))
+        self.scheduler.reset()
+        self.running = True
+        self._emit_connected(True)
+
+    def request_update(self, keys=None):
+        """
+        Reads the given fields in the next cycle, regardless of their polling
+        period. Call this after changing a setting of the MercuryiTC.
+
+        :param keys: Iterable of keys of :data:`READINGS`, all if None.
+        """
+        with self._due_lock:
+            if keys is None:
+                self._due.clear()
+                self._last_keyframe = None
+            else:
+                for key in keys:
+                    self._due.pop(key, None)
+
+    def apply_setting(self, key, value):
+        """
+        Changes a setting of the MercuryiTC from the calling thread and reads
+        it back in the next cycle. Use :meth:`submit` from other threads than
+        the one running :meth:`run`.
+
+        :param str key: Key of :data:`SETTINGS`, e.g., 'TempSetpoint'.
+        :param value: New value.
+        :raises: :class:`KeyError` for unknown settings and
+            :class:`ValueError` for invalid values.
+        """
+        module, prop, convert = SETTINGS[key]
+        self._write(key, convert(value))
+
+    def _write(self, key, value):
+        module, prop, _ = SETTINGS[key]
+        setattr(getattr(self, module), prop, value)
+        self.request_update([key])
+
+    def submit(self, key, value, priority=WRITE, callback=None):
+        """
+        Changes a setting of the MercuryiTC from the thread running
+        :meth:`run`, ahead of polling, and returns without waiting. A
+        setting which is still pending is replaced by the new value.
+
+        :param str key: Key of :data:`SETTINGS`, e.g., 'TempSetpoint'.
+        :param value: New value.
+        :param int priority: :data:`WRITE`, or :data:`SAFETY` for writes
+            which go ahead of all others.
+        :param callback: Called with None and the exception raised, or None,
+            from the thread running :meth:`run` once written.
+        :raises: :class:`KeyError` for unknown settings and
+            :class:`ValueError` for invalid values.
+        """
+        value = SETTINGS[key][2](value)
+        self.commands.put(functools.partial(self._write, key, value),
+                          ('set', key), priority, callback)
+        self.scheduler.interrupt()
+
+    def submit_call(self, func, key=None, priority=QUERY, callback=None):
+        """
+        Calls `func` from the thread running :meth:`run`, ahead of polling,
+        and returns without waiting. Use this for queries of the MercuryiTC
+        from other threads.
+
+        :param func: Function without arguments.
+        :param key: Key to coalesce pending calls by.
+        :param int priority: Priority of the call, :data:`QUERY` by default.
+        :param callback: Called with the result and the exception raised, or
+            None, from the thread running :meth:`run`.
+        """
+        self.commands.put(func, None if key is None else ('call', key), priority, callback)
+        self.scheduler.interrupt()
+
+    def command_stats(self):
+        """
+        Returns the latency from submission to completion of recent
+        commands, as dict of priority name and dict with entries 'n',
+        'mean' and 'max' in sec.
+        """
+        stats = {}
+        for priority, name in PRIORITY_NAMES.items():
+            latency = list(self._latency[priority])
+            stats[name] = {
+                'n': len(latency),
+                'mean': sum(latency) / len(latency) if latency else float('nan'),
+                'max': max(latency) if latency else float('nan'),
+            }
+        return stats
+
+    def _execute_commands(self):
+        while not self.terminate:
+            command = self.commands.get()
+            if command is None:
+                return
+            try:
+                result = command.func()
+            except (KeyError, ValueError, TypeError) as e:
+                # rejected, e.g. invalid value
+                self._finish_command(command, None, e)
+                continue
+            except Exception as e:
+                self._finish_command(command, None, e)
+                raise
+
+            latency = monotonic() - command.submitted
+            self._latency[command.priority].append(latency)
+            if command.priority == SAFETY:
+                logger.info('Safety command %s executed after %.1f ms.', command.key, latency * 1000)
+            self._finish_command(command, result, None)
+
+    def _finish_command(self, command, result, error):
+        for callback in command.callbacks:
+            try:
+                callback(result, error)
+            except Exception:
+                logger.exception('Error in command callback %s.', callback)
+
+    def _flush_commands(self):
+        # complete pending writes when stopped, so that none are lost
+        command = self.commands.get()
+        while command is not None:
+            if command.priority <= WRITE and self.mercury.connected:
+                try:
+                    self._finish_command(command, command.func(), None)
+                except Exception as e:
+                    self._finish_command(command, None, e)
+            else:
+                self._finish_command(command, None, RuntimeError('Data collection stopped.'))
+            command = self.commands.get()
+
+    def _due_fields(self):
+        """
+        Returns the entries of :data:`READINGS` which are due in this cycle
+        and schedules their next read.
+        """
+        now = monotonic()
+        due = []
+        with self._due_lock:
+            for entry in READINGS:
+                key = entry[0]
+                if now >= self._due.get(key, now):
+                    due.append(entry)
+                    # allow for half a cycle of jitter
+                    period = max(self.periods.get(key, 0), self.refresh)
+                    self._due[key] = now + period - self.refresh / 2
+        return due
+
+    def get_readings(self):
+        """
+        Reads all values of :data:`READINGS` which are due and emits the
+        readings. All queries are sent in a single batch before the responses
+        are read, so that a poll cycle costs one round trip to the MercuryiTC
+        instead of one per value.
+
+        Every field is read at its own period from :attr:`periods`, or every
+        cycle if not given. Fields which are not due keep their last value.
+        The time when each value was read is given in the entry 'Timestamps'
+        of the readings.
+        """
+        entries = self._due_fields()
+
+        try:
+            if hasattr(self.mercury, 'write') and hasattr(self.mercury, 'read'):
+                values = self._read_batch(entries)
+            else:
+                values = []
+                for entry in entries:
+                    if self.terminate:
+                        # stopped, skip the remaining queries
+                        return
+                    values.append(self._read_property(entry[1], entry[2]))
+        except Exception:
+            self.request_update([e[0] for e in entries])
+            raise
+
+        t = time.time()
+        for (key, _, _, _, _), value in zip(entries, values):
+            self.readings[key] = value
+            self.readings['Timestamps'][key] = t
+
+        if self.rules:
+            # ahead of listeners, so that safety actions are not delayed
+            self._apply_rules()
+
+        if self.delta:
+            readings = self._changed_readings()
+        else:
+            readings = dict(self.readings)
+            readings['Timestamps'] = dict(self.readings['Timestamps'])
+
+        if readings:
+            self._emit_readings(readings)
+
+    def _apply_rules(self):
+        """
+        Evaluates :attr:`rules` for the latest readings. Settings of active
+        rules are written ahead of all other commands, right after this poll
+        cycle.
+        """
+        for rule, active in self.rules.evaluate(self.readings, monotonic()):
+            if active:
+                logger.warning('Alarm %s: %s', rule.name, rule.message)
+            else:
+                logger.info('Alarm %s cleared.', rule.name)
+            if rule.notify:
+                self._emit_alarm(rule.name, active, rule.message)
+
+        # compare enforced settings with the values read back
+        for key, value in self.rules.enforced(self.readings, _convert_setting).items():
+            self.submit(key, value, SAFETY)
+
+    def _changed_readings(self):
+        """
+        Returns the readings which changed by more than their deadband since
+        they were last emitted, or all readings if a keyframe is due. Returns
+        None if there are no changes.
+        """
+        now = monotonic()
+        keyframe = (self._last_keyframe is None or
+                    now - self._last_keyframe >= self.keyframe_interval)
+
+        keys = []
+        for key, _, _, _, _ in READINGS:
+            if key not in self.readings:
+                continue
+            value = self.readings[key]
+            if keyframe or key not in self._emitted:
+                keys.append(key)
+            elif isinstance(value, numbers.Real):
+                if abs(value - self._emitted[key]) > self.deadbands.get(key, 0):
+                    keys.append(key)
+            elif value != self._emitted[key]:
+                keys.append(key)
+
+        if keyframe:
+            self._last_keyframe = now
+        elif not keys:
+            return None
+
+        readings = dict((key, self.readings[key]) for key in keys)
+        readings['Timestamps'] = dict((key, self.readings['Timestamps'][key]) for key in keys)
+        readings['Keyframe'] = keyframe
+        self._emitted.update((key, self.readings[key]) for key in keys)
+        return readings
+
+    def _read_batch(self, entries):
+        if len(entries) == 0:
+            return []
+
+        modules = [getattr(self, e[1]) for e in entries]
+        commands = ['READ:%s:%s' % (m.address, e[3]) for m, e in zip(modules, entries)]
+
+        # prevent other threads from querying in between, which would
+        # receive our responses
+        with getattr(self.mercury, '_lock', None) or _DummyLock():
+            for command in commands:
+                self.mercury.write(command)
+            responses = [self.mercury.read() for _ in commands]
+
+        # decode all responses in one pass
+        values = []
+        for m, resp, (key, module, prop, noun, convert) in zip(modules, responses, entries):
+            prefix = 'STAT:%s:%s:' % (m.address, noun)
+            try:
+                if not resp.startswith(prefix):
+                    raise ValueError(resp)
+                values.append(convert(resp[len(prefix):]))
+            except ValueError:
+                # not understood by this firmware, read the property instead
+                logger.debug('Unexpected response %r, reading %s.%s.', resp, module, prop)
+                values.append(self._read_property(module, prop))
+        return values
+
+    def _read_property(self, module, prop):
+        value = getattr(getattr(self, module), prop)
+        # signals are returned as tuples of value and unit
+        return value[0] if isinstance(value, tuple) else value
+
+    def update_modules(self, mod_numbers):
+        """
+        Updates the modules to read from.
+        """
+        self.mod_numbers = mod_numbers
+        self.gasflow = self.mercury.modules[mod_numbers['gasflow']]
+        self.heater = self.mercury.modules[mod_numbers['heater']]
+        self.temperature = self.mercury.modules[mod_numbers['temperature']]
+        self.control = self.mercury.modules[mod_numbers['temperature'] + 1]
+
+        self.request_update()
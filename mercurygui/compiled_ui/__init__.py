@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+Python modules compiled from the Qt Designer files of mercurygui at build
+time, see :mod:`mercurygui.utils.uiloader`. Do not edit, changes to the
+'.ui' files take effect without recompiling during development.
+"""
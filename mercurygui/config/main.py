@@ -9,9 +9,6 @@ MercuryGUI configuration options
 
 Note: Leave this file free of Qt related imports, so that it can be used to
 quickly load a user config file.
-
-To add:
-* More feed settings, such as refresh rate, etc?
 """
 # local imports
 from mercurygui.config.user import UserConfig
@@ -41,7 +38,51 @@ DEFAULTS = [
              {
               'temperature_module': 0,
               'gasflow_module': 0,
-              'heater_module': 0
+              'heater_module': 0,
+              'refresh': 1.0,  # refresh interval in sec
+              # polling periods in sec of fields which rarely change
+              'periods': {'HeaterAuto': 5.0, 'FlowAuto': 5.0,
+                          'FlowMin': 30.0, 'FlowSetpoint': 5.0,
+                          'TempSetpoint': 5.0, 'TempRamp': 5.0,
+                          'TempRampEnable': 5.0},
+              # emit only changed readings and a full keyframe every
+              # keyframe_interval sec
+              'delta': False,
+              'deadbands': {'HeaterVolt': 0.001, 'HeaterPercent': 0.01,
+                            'FlowPercent': 0.01, 'Temp': 0.0005},
+              'keyframe_interval': 60.0,
+              # reconnect when the connection is lost, with delays between
+              # attempts growing up to max_backoff sec
+              'reconnect': True,
+              'connect_timeout': 5.0,
+              'max_backoff': 30.0,
+              }),
+            ('Instruments',
+             {
+              # several instruments to monitor in tabs, as list of dicts with
+              # keys 'name', 'VISA_ADDRESS' and 'VISA_LIBRARY'
+              'instruments': [],
+              }),
+            ('Logging',
+             {
+              'format': 'binary',  # 'binary' or 'text'
+              # start a new log file 'hourly' or 'daily', or only on
+              # startup if 'none', and compress previous files
+              'partition': 'daily',
+              'compress': True,
+              'flush_interval': 10.0,
+              'flush_size': 600,
+              # show readings from previous log files in the plot on startup
+              'backfill': True,
+              }),
+            ('Alarms',
+             {
+              # alarm and interlock rules which are evaluated after every
+              # poll cycle, see mercurygui.rules
+              'rules': [{'name': 'Over temperature',
+                         'message': 'Over temperature!',
+                         'when': [{'key': 'Temp', 'op': '>', 'value': 310}],
+                         'actions': ['heater_off', 'notify']}],
               }),
             ]
 
@@ -67,3 +108,36 @@ except Exception:
     CONF = UserConfig(PACKAGE_NAME, defaults=DEFAULTS, load=False,
                       version=CONF_VERSION, subfolder=SUBFOLDER, backup=True,
                       raw_mode=True)
+
+
+# =============================================================================
+# Settings of individual instruments
+# =============================================================================
+def instrument_section(section, name=None):
+    """
+    Returns the name of the config section which holds the options of
+    `section` for the instrument `name`, for instance 'MercuryFeed: Cryostat
+    A'. The options of `section` itself are shared by all instruments and
+    used if `name` is None.
+    """
+    return section if name is None else '%s: %s' % (section, name)
+
+
+def get_instrument_option(section, option, name=None):
+    """
+    Returns `option` of `section` for the instrument `name`, see
+    :func:`instrument_section`. The shared value is returned if the
+    instrument has no value of its own.
+    """
+    own_section = instrument_section(section, name)
+    if name is not None and CONF.has_option(own_section, option):
+        return CONF.get(own_section, option)
+    return CONF.get(section, option)
+
+
+def set_instrument_option(section, option, value, name=None):
+    """
+    Sets `option` of `section` for the instrument `name` only, see
+    :func:`instrument_section`.
+    """
+    CONF.set(instrument_section(section, name), option, value)
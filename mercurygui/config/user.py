@@ -3,6 +3,10 @@
 This module provides user configuration file management features.
 
 It's based on the ConfigParser module (present in the standard library).
+
+Values are cached in memory once parsed. Changes are written back to the .ini
+file after a short delay, so that several changes in a row result in a single
+write, and at exit. The file is replaced atomically.
 """
 
 # Std imports
@@ -13,15 +17,29 @@ import sys
 import re
 import shutil
 import time
+import copy
 import codecs
+import atexit
+import weakref
+import tempfile
+import threading
 import configparser as cp
-from distutils.version import LooseVersion
 
 # Local imports
 from mercurygui.config.base import get_conf_path, get_home_dir
 
 PY2 = sys.version[0] == '2'
 
+# configs whose pending changes are written at exit
+_configs = weakref.WeakValueDictionary()
+
+
+@atexit.register
+def _flush_all():
+    """Write pending changes of all configs"""
+    for config in list(_configs.values()):
+        config.flush()
+
 
 def is_text_string(obj):
     """Return True if `obj` is a text string, False if it is anything else,
@@ -64,6 +82,9 @@ def check_version(actver, version, cmp_op):
 
     Distributed under the terms of the BSD License.
     """
+    # imported on first use, distutils is slow to import
+    from distutils.version import LooseVersion
+
     if isinstance(actver, tuple):
         actver = '.'.join([str(i) for i in actver])
 
@@ -142,14 +163,32 @@ class DefaultsConfig(cp.ConfigParser):
         fname = self.filename()
 
         def _write_file(fname):
-            if PY2:
-                # Python 2
-                with codecs.open(fname, 'w', encoding='utf-8') as configfile:
-                    self.write(configfile)
-            else:
-                # Python 3
-                with open(fname, 'w', encoding='utf-8') as configfile:
+            # write to a temporary file and replace the .ini file, so that it
+            # is never left half written
+            fd, tmp = tempfile.mkstemp(prefix='.%s-' % osp.basename(fname),
+                                       dir=osp.dirname(fname))
+            os.close(fd)
+            try:
+                with codecs.open(tmp, 'w', encoding='utf-8') as configfile:
                     self.write(configfile)
+                # mkstemp creates the file readable by the owner only, keep
+                # the mode of the .ini file, new files get it from the umask
+                if not osp.isfile(fname):
+                    open(fname, 'a').close()
+                shutil.copymode(fname, tmp)
+                if PY2 and os.name == 'nt':
+                    # os.rename does not replace existing files on Windows
+                    if osp.isfile(fname):
+                        os.remove(fname)
+                    os.rename(tmp, fname)
+                elif PY2:
+                    os.rename(tmp, fname)
+                else:
+                    os.replace(tmp, fname)
+            except Exception:
+                if osp.isfile(tmp):
+                    os.remove(tmp)
+                raise
 
         try:  # the "easy" way
             _write_file(fname)
@@ -201,6 +240,9 @@ class UserConfig(DefaultsConfig):
     version: version of the configuration file (X.Y.Z format)
     subfolder: configuration file will be saved in %home%/subfolder/%name%.ini
 
+    save_delay: delay in sec before changes are written to the .ini file,
+                written immediately if zero
+
     Note that 'get' and 'set' arguments number and type
     differ from the overriden methods
     """
@@ -208,7 +250,14 @@ class UserConfig(DefaultsConfig):
 
     def __init__(self, name, defaults=None, load=True, version=None,
                  subfolder=None, backup=False, raw_mode=False,
-                 remove_obsolete=False):
+                 remove_obsolete=False, save_delay=1.0):
+        # parsed values by (section, option)
+        self._cache = {}
+        self._dirty = False
+        self._save_delay = save_delay
+        self._save_timer = None
+        self._lock = threading.RLock()
+
         DefaultsConfig.__init__(self, name, subfolder)
         self.raw = 1 if raw_mode else 0
         if (version is not None and
@@ -252,6 +301,7 @@ class UserConfig(DefaultsConfig):
             if defaults is None:
                 # If no defaults are defined, set .ini file settings as default
                 self.set_as_defaults()
+        _configs[id(self)] = self
 
     def get_version(self, version='0.0.0'):
         """Return configuration (not application!) version"""
@@ -265,6 +315,7 @@ class UserConfig(DefaultsConfig):
         """
         Load config from the associated .ini file
         """
+        self._cache.clear()
         try:
             fname = self.filename()
             if osp.isfile(fname):
@@ -348,7 +399,54 @@ class UserConfig(DefaultsConfig):
                     value = options[option]
                     self._set(sec, option, value, verbose)
         if save:
-            self._save()
+            self._schedule_save()
+
+    def _set(self, section, option, value, verbose):
+        """
+        Private set method, marks the config as changed
+        """
+        with self._lock:
+            if not is_text_string(value):
+                value = repr(value)
+            if (self.has_option(section, option) and
+                    cp.ConfigParser.get(self, section, option, raw=True) == value):
+                return
+            DefaultsConfig._set(self, section, option, value, verbose)
+            self._cache.pop((section, option), None)
+            self._dirty = True
+
+    def _schedule_save(self):
+        """
+        Saves changes after `save_delay`, later changes restart the delay
+        """
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._dirty:
+                return
+            if self._save_delay:
+                self._save_timer = threading.Timer(self._save_delay, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+            else:
+                self.flush()
+
+    def flush(self):
+        """
+        Write pending changes to the .ini file now
+        """
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if self._dirty:
+                self._dirty = False
+                try:
+                    self._save()
+                except Exception:
+                    self._dirty = True
+                    raise
 
     def _check_section_option(self, section, option):
         """
@@ -384,6 +482,13 @@ class UserConfig(DefaultsConfig):
         """
         section = self._check_section_option(section, option)
 
+        try:
+            value = self._cache[(section, option)]
+        except KeyError:
+            pass
+        else:
+            return copy.deepcopy(value) if isinstance(value, (list, dict)) else value
+
         if not self.has_section(section):
             if default is NoDefault:
                 raise cp.NoSectionError(section)
@@ -426,7 +531,9 @@ class UserConfig(DefaultsConfig):
                 value = ast.literal_eval(value)
             except (SyntaxError, ValueError):
                 pass
-        return value
+
+        self._cache[(section, option)] = value
+        return copy.deepcopy(value) if isinstance(value, (list, dict)) else value
 
     def set_default(self, section, option, default_value):
         """
@@ -463,12 +570,18 @@ class UserConfig(DefaultsConfig):
             value = repr(value)
         self._set(section, option, value, verbose)
         if save:
-            self._save()
+            self._schedule_save()
 
     def remove_section(self, section):
-        cp.ConfigParser.remove_section(self, section)
-        self._save()
+        with self._lock:
+            cp.ConfigParser.remove_section(self, section)
+            self._cache.clear()
+            self._dirty = True
+        self._schedule_save()
 
     def remove_option(self, section, option):
-        cp.ConfigParser.remove_option(self, section, option)
-        self._save()
+        with self._lock:
+            cp.ConfigParser.remove_option(self, section, option)
+            self._cache.pop((section, option), None)
+            self._dirty = True
+        self._schedule_save()
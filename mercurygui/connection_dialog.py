@@ -8,26 +8,32 @@ Created on Wed Oct 31 16:23:13 2018
 
 from __future__ import division, print_function, absolute_import
 import os.path as osp
-import pkg_resources as pkgr
-import visa
-import pyvisa
 import time
-from qtpy import QtCore, QtWidgets, uic
+from qtpy import QtCore, QtWidgets
 
 # local imports
 from mercurygui.config.main import CONF
-
-CONNECTION_UI_PATH = pkgr.resource_filename('mercurygui', 'connection_dialog.ui')
+from mercurygui.utils.uiloader import load_ui
 
 
 class ConnectionDialog(QtWidgets.QDialog):
+    """
+    Dialog to select the VISA address and library of an instrument.
+
+    :param parent: Parent widget.
+    :param instr: Instance of :class:`mercuryitc.MercuryITC`.
+    :param str name: Name of the instrument if several are monitored. Changes
+        are stored in its entry of the 'Instruments' section of the config
+        instead of the 'Connection' section.
+    """
 
-    def __init__(self, parent, instr):
+    def __init__(self, parent, instr, name=None):
         super(self.__class__, self).__init__(parent=parent)
         # load user interface layout from .ui file
-        uic.loadUi(CONNECTION_UI_PATH, self)
+        load_ui('connection_dialog', self)
 
         self.instr = instr
+        self.name = name
 
         # populate UI
         self.populate_ui_from_instr()
@@ -84,8 +90,7 @@ class ConnectionDialog(QtWidgets.QDialog):
         self.instr.visa_library = self.lineEditLibrary.text()
         self.instr.visa_address = self.comboBoxAddress.currentText()
 
-        CONF.set('Connection', 'VISA_LIBRARY', self.instr.visa_library)
-        CONF.set('Connection', 'VISA_ADDRESS', self.instr.visa_address)
+        self._save_connection()
 
         # reconnect with new address
         # close and reopen ResourceManager for visa_lib path change to take effect
@@ -96,8 +101,11 @@ class ConnectionDialog(QtWidgets.QDialog):
 
         self.instr.rm.close()
 
+        # imported on first use, it is slow to import
+        import pyvisa
+
         try:
-            self.instr.rm = visa.ResourceManager(self.instr.visa_library)
+            self.instr.rm = pyvisa.ResourceManager(self.instr.visa_library)
 
         except ValueError:
             msg = ('Could not find backend %s.\n' % self.lineEditLibrary.text() +
@@ -105,12 +113,28 @@ class ConnectionDialog(QtWidgets.QDialog):
             QtWidgets.QMessageBox.information(self, str('error'), msg)
 
             self.instr.visa_library = ''
-            self.instr.rm = visa.ResourceManager()
+            self.instr.rm = pyvisa.ResourceManager()
 
             self.populate_ui_from_instr()
 
         self.instr.connect()
 
+    def _save_connection(self):
+        if self.name is None:
+            CONF.set('Connection', 'VISA_LIBRARY', self.instr.visa_library)
+            CONF.set('Connection', 'VISA_ADDRESS', self.instr.visa_address)
+            return
+
+        # instruments which are not in the config, e.g. simulated ones, are
+        # not stored
+        instruments = CONF.get('Instruments', 'instruments')
+        for item in instruments:
+            if item.get('name') == self.name:
+                item['VISA_LIBRARY'] = self.instr.visa_library
+                item['VISA_ADDRESS'] = self.instr.visa_address
+                CONF.set('Instruments', 'instruments', instruments)
+                return
+
     @QtCore.Slot()
     def _on_help_clicked(self):
         """Show dialog box with help."""
@@ -131,6 +155,8 @@ class ConnectionDialog(QtWidgets.QDialog):
         <p><b>PyVisa detected the following setup:</b></p>
         """ % (self.checkBoxAutoVisa.text(), ni_visa_link, ni_visa_link)
 
+        import pyvisa.util
+
         visa_info = pyvisa.util.get_debug_info(to_screen=False)
         visa_info = '<p style="white-space: pre-wrap;">' + visa_info + '\n </p>'
 
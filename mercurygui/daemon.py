@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+"""
+Feed daemon which owns the connection to the MercuryiTC and broadcasts its
+readings to any number of local clients over a TCP or Unix socket. The
+instrument is polled by a single :class:`mercurygui.stream.HeadlessFeed`,
+independent of the number of clients. Start it with:
+
+    $ mercurygui-feed --port 7021
+
+Messages are JSON objects, each sent as a frame of a 4-byte big-endian
+length followed by the UTF-8 encoded JSON. The server sends:
+
+- ``{"type": "hello", "version": 1, "fields": [...], "settings": [...],
+  "refresh": 1.0}`` after connecting
+- ``{"type": "readings", "data": {...}}`` with the current full readings
+  after connecting and then with every new reading, in the same format as
+  :attr:`mercurygui.feed.MercuryFeed.new_readings_signal`
+- ``{"type": "reply", "id": 1, "ok": true, "data": ...}`` or ``{"type":
+  "reply", "id": 1, "ok": false, "error": "..."}`` in response to commands
+
+Clients can send the commands:
+
+- ``{"type": "set", "id": 1, "key": "TempSetpoint", "value": 10.0}`` to
+  change a setting, see :data:`mercurygui.collector.SETTINGS`
+- ``{"type": "get", "id": 2}`` to get the current full readings
+
+:class:`FeedClient` implements the client side:
+
+    >>> from mercurygui.daemon import FeedClient
+    >>> client = FeedClient(('127.0.0.1', 7021))
+    >>> client.set('TempSetpoint', 10)
+    >>> for readings in client.iter():
+    ...     print(readings['Temp'])
+
+Note: Leave this file free of Qt related imports, so that it can be used
+without a GUI.
+"""
+from __future__ import division, print_function, absolute_import
+import os
+import json
+import struct
+import socket
+import threading
+import logging
+
+try:
+    import socketserver
+except ImportError:  # Python 2
+    import SocketServer as socketserver
+
+from mercurygui.collector import READINGS, SETTINGS, merge_readings
+from mercurygui.stream import ReadingsQueue, ReadingsPublisher, FeedClosedError
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = 1
+DEFAULT_PORT = 7021
+MAX_FRAME_SIZE = 1 << 20
+# time in sec the server waits for a setting to be written, clients wait
+# longer for replies
+COMMAND_TIMEOUT = 10.0
+REPLY_TIMEOUT = COMMAND_TIMEOUT + 5.0
+
+_LENGTH = struct.Struct('>I')
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    """TCP server which can be restarted right away on the same port."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class ThreadingUnixStreamServer(socketserver.ThreadingUnixStreamServer):
+        """Unix socket server which does not wait for clients on exit."""
+
+        daemon_threads = True
+else:  # Windows
+    ThreadingUnixStreamServer = None
+
+
+# =============================================================================
+# Framing
+# =============================================================================
+
+def encode_frame(message):
+    """Encodes a message as length-prefixed JSON frame."""
+    data = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    return _LENGTH.pack(len(data)) + data
+
+
+def _read_exactly(f, n):
+    data = b''
+    while len(data) < n:
+        chunk = f.read(n - len(data))
+        if not chunk:
+            raise EOFError('Connection closed.')
+        data += chunk
+    return data
+
+
+def read_frame(f):
+    """
+    Reads a single message from the file-like object `f`.
+
+    :raises: :class:`EOFError` if the connection is closed and
+        :class:`ValueError` if the frame is invalid.
+    """
+    length, = _LENGTH.unpack(_read_exactly(f, _LENGTH.size))
+    if length > MAX_FRAME_SIZE:
+        raise ValueError('Frame of %s bytes exceeds maximum size.' % length)
+    message = json.loads(_read_exactly(f, length).decode('utf-8'))
+    if not isinstance(message, dict):
+        raise ValueError('Message is not a JSON object.')
+    return message
+
+
+# =============================================================================
+# Server
+# =============================================================================
+
+class FeedServer(object):
+    """
+    Broadcasts readings of a :class:`mercurygui.stream.HeadlessFeed` to all
+    connected clients and applies their setting changes. Every reading is
+    encoded once and queued for each client, a client which falls behind
+    loses its oldest queued readings instead of delaying others.
+
+    :param feed: :class:`mercurygui.stream.HeadlessFeed` to broadcast.
+    :param address: Tuple (host, port) to listen on with TCP or a path to
+        listen on with a Unix socket.
+    :param int max_queue: Number of readings to queue per client.
+    :param float command_timeout: Maximum time in sec to wait for a setting
+        to be written.
+    :raises: :class:`ValueError` for a Unix socket if not supported by the
+        platform.
+    """
+
+    def __init__(self, feed, address=('127.0.0.1', DEFAULT_PORT), max_queue=100,
+                 command_timeout=COMMAND_TIMEOUT):
+        if not isinstance(address, tuple) and ThreadingUnixStreamServer is None:
+            raise ValueError('Unix sockets are not supported on this platform.')
+
+        self.feed = feed
+        self.address = address
+        self.max_queue = max_queue
+        self.command_timeout = command_timeout
+
+        self._clients = []
+        self._clients_lock = threading.Lock()
+
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server._serve_client(self)
+
+        if isinstance(address, tuple):
+            self._server = ThreadingTCPServer(address, Handler)
+        else:
+            if os.path.exists(address):
+                os.remove(address)
+            self._server = ThreadingUnixStreamServer(address, Handler)
+        self._thread = None
+
+        self.feed.worker.add_listener(self._broadcast)
+
+    def __repr__(self):
+        return '<%s(%s)>' % (type(self).__name__, self.server_address)
+
+    @property
+    def server_address(self):
+        return self._server.server_address
+
+    @property
+    def client_count(self):
+        return len(self._clients)
+
+    def start(self):
+        """Starts serving in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='FeedServer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        """Disconnects all clients and stops serving."""
+        self.feed.worker.remove_listener(self._broadcast)
+        if self._thread:
+            self._server.shutdown()
+        self._server.server_close()
+
+        with self._clients_lock:
+            clients = list(self._clients)
+        for queue in clients:
+            queue.close()
+
+        if not isinstance(self.address, tuple) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def _broadcast(self, readings):
+        frame = encode_frame({'type': 'readings', 'data': readings})
+        with self._clients_lock:
+            for queue in self._clients:
+                queue.put(frame)
+
+    def _serve_client(self, handler):
+        sock = handler.request
+        send_lock = threading.Lock()
+        queue = ReadingsQueue(self.max_queue)
+
+        hello = {'type': 'hello', 'version': PROTOCOL_VERSION,
+                 'fields': [entry[0] for entry in READINGS],
+                 'settings': sorted(SETTINGS), 'refresh': self.feed.worker.refresh}
+        queue.put(encode_frame(hello))
+        with self._clients_lock:
+            # the full state is sent first, followed by new readings
+            readings = self.feed.snapshot()
+            if len(readings) > 1:
+                queue.put(encode_frame({'type': 'readings', 'data': readings}))
+            self._clients.append(queue)
+
+        logger.info('Client %s connected.', handler.client_address)
+
+        def send():
+            try:
+                for frame in queue:
+                    with send_lock:
+                        sock.sendall(frame)
+            except (socket.error, IOError):
+                pass
+            finally:
+                queue.close()
+                # unblock the reading thread
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except (socket.error, IOError):
+                    pass
+
+        sender = threading.Thread(target=send, name='FeedServer-send')
+        sender.daemon = True
+        sender.start()
+
+        try:
+            while not queue.closed:
+                message = read_frame(handler.rfile)
+                reply = self._handle_command(message)
+                with send_lock:
+                    sock.sendall(encode_frame(reply))
+        except (EOFError, ValueError, socket.error, IOError):
+            pass
+        finally:
+            with self._clients_lock:
+                self._clients.remove(queue)
+            queue.close()
+            sender.join()
+            logger.info('Client %s disconnected.', handler.client_address)
+
+    def _handle_command(self, message):
+        reply = {'type': 'reply', 'id': message.get('id')}
+        try:
+            type_ = message.get('type')
+            if type_ == 'set':
+                self._set(message['key'], message['value'])
+                logger.info('Set %s to %s.', message['key'], message['value'])
+                reply['ok'] = True
+            elif type_ == 'get':
+                reply['data'] = self.feed.snapshot()
+                reply['ok'] = True
+            else:
+                raise ValueError('Unknown command %r.' % type_)
+        except KeyError as e:
+            reply['ok'] = False
+            reply['error'] = 'Unknown key %s.' % e
+        except Exception as e:
+            reply['ok'] = False
+            reply['error'] = str(e)
+        return reply
+
+    def _set(self, key, value):
+        # written by the acquisition thread, wait for the result
+        done = threading.Event()
+        errors = []
+
+        def callback(result, error):
+            errors.append(error)
+            done.set()
+
+        self.feed.submit(key, value, callback=callback)
+        if not done.wait(self.command_timeout):
+            raise IOError('Timeout setting %s.' % key)
+        if errors[0] is not None:
+            raise errors[0]
+
+
+# =============================================================================
+# Client
+# =============================================================================
+
+class FeedClient(ReadingsPublisher):
+    """
+    Client of a feed daemon. New readings can be consumed with :meth:`iter`,
+    :meth:`aiter` and :meth:`next_reading`, the latest full readings are
+    available from :attr:`readings`.
+
+    :param address: Tuple (host, port) of a TCP server or path of a Unix
+        socket.
+    :param float timeout: Timeout for connecting and for replies in sec. It
+        should exceed the command timeout of the server, so that settings
+        which take long to be written are not reported as failed.
+    :raises: :class:`ValueError` for a Unix socket if not supported by the
+        platform.
+    """
+
+    def __init__(self, address=('127.0.0.1', DEFAULT_PORT), timeout=REPLY_TIMEOUT):
+        super(FeedClient, self).__init__()
+        self.address = address
+        self.timeout = timeout
+
+        self.info = {}
+        self.readings = {}
+        self.closed = False
+
+        self._replies = {}
+        self._next_id = 0
+        self._cond = threading.Condition()
+        self._send_lock = threading.Lock()
+
+        if isinstance(address, tuple):
+            family = socket.AF_INET
+        elif hasattr(socket, 'AF_UNIX'):
+            family = socket.AF_UNIX
+        else:
+            raise ValueError('Unix sockets are not supported on this platform.')
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(address)
+        self._sock.settimeout(None)
+        self._rfile = self._sock.makefile('rb')
+
+        self._thread = threading.Thread(target=self._receive, name='FeedClient')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __repr__(self):
+        return '<%s(%s)>' % (type(self).__name__, self.address)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def set(self, key, value):
+        """
+        Changes a setting of the MercuryiTC, see
+        :data:`mercurygui.collector.SETTINGS`.
+
+        :raises: :class:`ValueError` if the daemon rejects the command.
+        """
+        self._request({'type': 'set', 'key': key, 'value': value})
+
+    def get(self):
+        """Returns the current full readings from the daemon."""
+        return self._request({'type': 'get'})['data']
+
+    def close(self):
+        """Disconnects from the daemon and ends all iterators."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except (socket.error, IOError):
+            pass
+        self._thread.join()
+        self._sock.close()
+
+    def _request(self, message):
+        with self._cond:
+            self._next_id += 1
+            message['id'] = request_id = self._next_id
+
+        with self._send_lock:
+            self._sock.sendall(encode_frame(message))
+
+        with self._cond:
+            while request_id not in self._replies:
+                if self.closed:
+                    raise FeedClosedError('Connection to feed daemon closed.')
+                if not self._cond.wait(self.timeout) and request_id not in self._replies:
+                    raise IOError('No reply from feed daemon.')
+            reply = self._replies.pop(request_id)
+
+        if not reply.get('ok'):
+            raise ValueError(reply.get('error'))
+        return reply
+
+    def _receive(self):
+        try:
+            while True:
+                message = read_frame(self._rfile)
+                type_ = message.get('type')
+                if type_ == 'readings':
+                    merge_readings(self.readings, message['data'])
+                    self._publish(message['data'])
+                elif type_ == 'reply':
+                    with self._cond:
+                        self._replies[message.get('id')] = message
+                        self._cond.notify_all()
+                elif type_ == 'hello':
+                    self.info = message
+        except (EOFError, ValueError, socket.error, IOError):
+            pass
+        finally:
+            with self._cond:
+                self.closed = True
+                self._cond.notify_all()
+            self._close_consumers()
+
+
+# =============================================================================
+# Entry point
+# =============================================================================
+
+def run():
+
+    import argparse
+    import signal
+    from mercurygui.config.main import CONF
+    from mercurygui.stream import HeadlessFeed
+
+    parser = argparse.ArgumentParser(
+        description='Broadcast readings of the MercuryiTC to local clients.')
+    parser.add_argument('--host', default='127.0.0.1', help='host to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='TCP port to listen on')
+    parser.add_argument('--unix', metavar='PATH', help='listen on a Unix socket instead')
+    parser.add_argument('--refresh', type=float, metavar='SEC',
+                        default=CONF.get('MercuryFeed', 'refresh'),
+                        help='refresh interval of readings')
+    parser.add_argument('--simulate', action='store_true',
+                        help='run against a simulated MercuryiTC')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    if args.unix and ThreadingUnixStreamServer is None:
+        parser.error('Unix sockets are not supported on this platform.')
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+
+    if args.simulate:
+        from mercurygui.simulator import SimulatedMercuryITC
+        mercury = SimulatedMercuryITC()
+    else:
+        from mercuryitc import MercuryITC
+        mercury = MercuryITC(CONF.get('Connection', 'VISA_ADDRESS'),
+                             CONF.get('Connection', 'VISA_LIBRARY'))
+
+    feed = HeadlessFeed(mercury, refresh=args.refresh,
+                        periods=CONF.get('MercuryFeed', 'periods'),
+                        delta=CONF.get('MercuryFeed', 'delta'),
+                        deadbands=CONF.get('MercuryFeed', 'deadbands'),
+                        keyframe_interval=CONF.get('MercuryFeed', 'keyframe_interval'),
+                        reconnect=CONF.get('MercuryFeed', 'reconnect'),
+                        connect_timeout=CONF.get('MercuryFeed', 'connect_timeout'),
+                        max_backoff=CONF.get('MercuryFeed', 'max_backoff'),
+                        rules=CONF.get('Alarms', 'rules'))
+
+    address = args.unix or (args.host, args.port)
+    server = FeedServer(feed, address)
+    print('Serving readings of %s at %s' % (mercury.visa_address, server.server_address))
+
+    def shutdown(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, shutdown)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        feed.close()
+
+
+if __name__ == '__main__':
+    run()
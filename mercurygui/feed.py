@@ -10,17 +10,24 @@ Attribution-NonCommercial-NoDerivs 2.0 UK: England & Wales License.
 
 """
 from __future__ import division, absolute_import
-from qtpy import QtCore, QtWidgets, uic
+from qtpy import QtCore
 import sys
-import os
+import math
+import functools
+import threading
+import collections
 import logging
 
-from mercurygui.config.main import CONF
+from mercurygui.config.main import CONF, get_instrument_option
+from mercurygui.collector import (DataCollector, merge_readings, select_modules,
+                                  connect_mercury, WRITE, SETTINGS)
+from mercurygui.rules import RuleEngine
+from mercurygui.stream import ReadingsPublisher
 
 logger = logging.getLogger(__name__)
 
 
-class MercuryFeed(QtCore.QObject):
+class MercuryFeed(ReadingsPublisher, QtCore.QObject):
     """
     Provides a data feed from the MercuryiTC with the most important readings
     of the gas flow, heater, temperature sensor and control loop modules. This
@@ -32,6 +39,7 @@ class MercuryFeed(QtCore.QObject):
 
     - Heater data:
         'HeaterVolt'       # current heater voltage in V (float)
+        'HeaterVoltLimit'  # heater voltage limit in V (float)
         'HeaterAuto'       # automatic or manual control of heater (bool)
         'HeaterPercent'    # heater percentage of maximum (float)
 
@@ -63,19 +71,97 @@ class MercuryFeed(QtCore.QObject):
     :func:`print_temperature` will then be executed with the emitted readings
     dictionary as argument every time a new signal is emitted.
 
+    Readings can also be consumed without a running Qt event loop with the
+    blocking iterator :meth:`iter` or with asyncio through :meth:`aiter` and
+    :meth:`next_reading`, see :mod:`mercurygui.stream`.
+
     :class:`MercuryFeed` will also handle maintaining the connection for you:: it will
     periodically try to find the MercuryiTC if not connected, and emit warnings
     when it looses an established connection.
+
+    Connection attempts never block the calling thread. When an established
+    connection is lost, the worker thread reconnects with exponentially
+    growing, randomised delays of up to `max_backoff` sec between attempts.
+    Every attempt is reported by :attr:`reconnect_signal` with the attempt
+    number, whether it succeeded and the delay until the next attempt.
+
+    Readings are taken every `refresh` sec on a fixed schedule, periods down
+    to a few ms are supported. The achieved sample rate, jitter and missed
+    deadlines are available from :attr:`timing`.
+
+    Fields which rarely change can be polled less often by giving their
+    period in `periods`, for instance ``{'TempRamp': 10}``. In between, their
+    last value is emitted. The time stamp of when each value was read is
+    given in the entry 'Timestamps' of the readings, as dict of field name
+    and time in sec since the epoch.
+
+    In delta mode, only fields which changed by more than their deadband
+    since they were last emitted are included in the readings, and nothing
+    is emitted if there are no changes. All fields are emitted in a keyframe
+    every `keyframe_interval` sec and after (re)connecting. Delta readings
+    have an entry 'Keyframe' which is True for keyframes. The full state is
+    kept in :attr:`readings`, use :func:`merge_readings` to rebuild it from
+    the emitted readings elsewhere.
+
+    The temperature, heater and gas flow are recorded in :attr:`history`, see
+    :class:`mercurygui.history.FeedHistory`. At least 24 h are kept in memory
+    and, if `log_directory` is given, earlier readings can be queried from
+    the log files:
+
+        >>> columns = feed.history.query(t0, t1, fields=('time', 'temp'))
+
+    :param mercury: Instance of :class:`mercuryitc.MercuryITC`.
+    :param float refresh: Refresh interval in sec.
+    :param dict periods: Polling periods in sec of individual fields. Fields
+        which are not given are polled every `refresh` sec.
+    :param bool delta: Emit only changed fields.
+    :param dict deadbands: Minimum change of numeric fields to be emitted in
+        delta mode. Any change is emitted for fields which are not given.
+    :param float keyframe_interval: Interval in sec between keyframes in
+        delta mode.
+    :param bool reconnect: Reconnect automatically when the connection is lost.
+    :param float connect_timeout: Maximum time in sec of a connection attempt.
+    :param float max_backoff: Maximum delay in sec between reconnection
+        attempts.
+    :param str log_directory: Directory of the log files of this instrument.
+    :param list rules: Alarm and interlock rules which are evaluated in the
+        worker thread after every poll cycle, see :mod:`mercurygui.rules`.
+        Rules with the action 'notify' are reported by :attr:`alarm_signal`
+        with the rule name, whether it is active and its message.
+    :param str name: Name of the instrument if several are monitored. The
+        selected modules are stored in the config for this instrument only.
+    :raises: :class:`ValueError` for invalid rules.
     """
 
     new_readings_signal = QtCore.Signal(dict)
     notify_signal = QtCore.Signal(str)
     connected_signal = QtCore.Signal(bool)
+    reconnect_signal = QtCore.Signal(int, bool, object)
+    alarm_signal = QtCore.Signal(str, bool, str)
+
+    _connect_done_signal = QtCore.Signal(bool)
 
-    def __init__(self, mercury, refresh=1):
+    def __init__(self, mercury, refresh=1, periods=None, delta=False,
+                 deadbands=None, keyframe_interval=60, reconnect=True,
+                 connect_timeout=5.0, max_backoff=30.0, log_directory=None,
+                 rules=None, name=None):
         super(self.__class__, self).__init__()
+        from mercurygui.history import FeedHistory
 
+        self.name = name
         self.refresh = refresh
+        self.periods = periods
+        self.delta = delta
+        self.deadbands = deadbands
+        self.keyframe_interval = keyframe_interval
+        self.reconnect = reconnect
+        self.connect_timeout = connect_timeout
+        self.max_backoff = max_backoff
+        # compiled here, so that invalid rules are reported right away
+        self.rules = RuleEngine(rules or (), SETTINGS)
+        self.readings = {}
+        # keep at least 24 h in memory
+        self.history = FeedHistory(int(math.ceil(86400 / min(refresh, 1))), log_directory)
         self.mercury = mercury
         self.visa_address = mercury.visa_address
         self.visa_library = mercury.visa_library
@@ -83,6 +169,10 @@ class MercuryFeed(QtCore.QObject):
 
         self.thread = None
         self.worker = None
+        self.dialog = None
+
+        self._connecting = False
+        self._connect_done_signal.connect(self._on_connect_done)
 
         if self.mercury.connected:
             self.start_worker()
@@ -91,30 +181,57 @@ class MercuryFeed(QtCore.QObject):
     # BASE FUNCTIONALITY CODE
 
     def disconnect(self):
-        # stop worker thread
-        if self.worker:
-            self.worker.running = False
-
-        # disconnect mercury
+        """
+        Stops data collection and reconnection attempts and disconnects.
+        Resume with :meth:`connect`.
+        """
         self.connected_signal.emit(False)
-        self.mercury.disconnect()
+        if self.worker:
+            # the worker closes the connection after its current query
+            self.worker.close_connection()
+        else:
+            self.mercury.disconnect()
 
     def connect(self):
-        # connect to mercury
-        if not self.mercury.connected:
-            self.mercury.connect()
-
-        if self.mercury.connected:
-            # start / resume worker
+        """
+        Connects to the MercuryiTC in the background and starts or resumes
+        data collection. Returns immediately, :attr:`connected_signal` is
+        emitted once connected.
+        """
+        if self.worker:
+            # the worker reconnects and resumes
+            self.worker.reconnect()
+        elif not self._connecting:
+            self._connecting = True
+            thread = threading.Thread(target=self._connect_in_background,
+                                      name='MercuryFeed-connect')
+            thread.daemon = True
+            thread.start()
+
+    def _connect_in_background(self):
+        connected = connect_mercury(self.mercury, self.connect_timeout)
+        # handled in the thread of the feed
+        self._connect_done_signal.emit(connected)
+
+    @QtCore.Slot(bool)
+    def _on_connect_done(self, connected):
+        self._connecting = False
+        if connected:
             self.start_worker()
             self.connected_signal.emit(True)
+        else:
+            self.notify_signal.emit('Could not connect to MercuryiTC at %s.' % self.visa_address)
 
     def exit_(self):
         if self.worker:
-            self.worker.running = False
-            self.worker.terminate = True
-            self.thread.terminate()
+            # let the worker complete its current query and return
+            self.worker.stop()
+            self.thread.quit()
             self.thread.wait()
+            self.worker = None
+            self.thread = None
+
+        self._close_consumers()
 
         if self.mercury.connected:
             self.mercury.disconnect()
@@ -130,175 +247,264 @@ class MercuryFeed(QtCore.QObject):
         if self.worker and self.thread:
             self.worker.running = True
         else:
-            self.dialog = SensorDialog(self.mercury.modules)
-            self.dialog.accepted.connect(self.update_modules)
+            # modules selected in the config, see open_module_dialog
+            mod_numbers = select_modules(
+                self.mercury.modules,
+                get_instrument_option('MercuryFeed', 'temperature_module', self.name),
+                get_instrument_option('MercuryFeed', 'gasflow_module', self.name),
+                get_instrument_option('MercuryFeed', 'heater_module', self.name))
 
             # start data collection thread
             self.thread = QtCore.QThread()
             self.worker = DataCollectionWorker(self.refresh, self.mercury,
-                                               self.dialog.modNumbers)
+                                               mod_numbers,
+                                               self.periods, self.delta,
+                                               self.deadbands,
+                                               self.keyframe_interval,
+                                               self.reconnect,
+                                               self.connect_timeout,
+                                               self.max_backoff,
+                                               self.rules)
             self.worker.moveToThread(self.thread)
             self.worker.readings_signal.connect(self._get_data)
-            self.worker.connected_signal.connect(self.connected_signal.emit)
+            self.worker.add_listener(self._publish)
+            self.worker.connected_signal.connect(self._on_worker_connected)
+            self.worker.reconnect_signal.connect(self.reconnect_signal.emit)
+            self.worker.alarm_signal.connect(self.alarm_signal.emit)
             self.thread.started.connect(self.worker.run)
-            self.update_modules(self.dialog.modNumbers)
+            self._bind_modules(mod_numbers)
             self.thread.start()
 
+    def open_module_dialog(self):
+        """
+        Opens a dialog to select the temperature, gas flow and heater modules.
+        The dialog is created when first opened.
+        """
+        if self.dialog is None:
+            from mercurygui.sensor_dialog import SensorDialog
+
+            self.dialog = SensorDialog(self.mercury.modules, self.name)
+            self.dialog.accepted.connect(self.update_modules)
+        self.dialog.open()
+
     def update_modules(self, mod_numbers):
         """
         Updates module list after the new modules have been selected in dialog.
         """
+        self._bind_modules(mod_numbers)
+
+        # send new modules to thread if running
+        if self.worker:
+            self.worker.update_modules(mod_numbers)
+
+    def _bind_modules(self, mod_numbers):
         self.gasflow = self.mercury.modules[mod_numbers['gasflow']]
         self.heater = self.mercury.modules[mod_numbers['heater']]
         self.temperature = self.mercury.modules[mod_numbers['temperature']]
         self.control = self.mercury.modules[mod_numbers['temperature'] + 1]
 
-        # send new modules to thread if running
-        self.worker.update_modules(mod_numbers)
+    @QtCore.Slot(bool)
+    def _on_worker_connected(self, connected):
+        if connected:
+            # the driver creates new module instances when connecting
+            self._bind_modules(self.worker.mod_numbers)
+        self.connected_signal.emit(connected)
+
+    def request_update(self, keys=None):
+        """
+        Reads the given fields in the next cycle, see
+        :meth:`DataCollectionWorker.request_update`.
+        """
+        if self.worker:
+            self.worker.request_update(keys)
+
+    def submit(self, key, value, priority=WRITE):
+        """
+        Changes a setting of the MercuryiTC from the worker thread, ahead of
+        polling, and returns without waiting. Failed writes are reported by
+        :attr:`notify_signal`. See :meth:`DataCollectionWorker.submit`.
+
+        :param str key: Key of :data:`mercurygui.collector.SETTINGS`.
+        :param value: New value.
+        :param int priority: :data:`mercurygui.collector.WRITE`, or
+            :data:`mercurygui.collector.SAFETY` to go ahead of all others.
+        """
+        if self.worker is None:
+            self.notify_signal.emit('Could not set %s to %s: not connected.' % (key, value))
+            return
+        self.worker.submit(key, value, priority, functools.partial(self._on_written, key, value))
+
+    def _on_written(self, key, value, result, error):
+        if error is not None:
+            # emitted from the worker thread
+            self.notify_signal.emit('Could not set %s to %s: %s' % (key, value, error))
+
+    @property
+    def command_latency(self):
+        """
+        Latency of recent commands by priority, see
+        :meth:`DataCollectionWorker.command_stats`.
+        """
+        if self.worker:
+            return self.worker.command_stats()
+
+    @property
+    def timing(self):
+        """
+        Timing statistics of the data collection, see
+        :meth:`mercurygui.scheduler.Scheduler.stats`.
+        """
+        if self.worker:
+            return self.worker.scheduler.stats()
 
     def _get_data(self, readings_from_thread):
-        self.readings = readings_from_thread
-        self.new_readings_signal.emit(self.readings)
+        merge_readings(self.readings, readings_from_thread)
+        self.history.record(readings_from_thread, self.readings)
+        self.new_readings_signal.emit(readings_from_thread)
 
     def __repr__(self):
         return '<%s(%s)>' % (type(self).__name__, self.visa_address)
 
 
-class SensorDialog(QtWidgets.QDialog):
+class _TaggedConsumer(object):
+    """Forwards readings of one feed to a :class:`MercuryFeedManager`."""
+
+    def __init__(self, name, manager):
+        self.name = name
+        self.manager = manager
+
+    def put(self, readings):
+        readings = dict(readings)
+        readings['Instrument'] = self.name
+        self.manager._publish(readings)
+
+    def close(self):
+        pass
+
+
+class MercuryFeedManager(ReadingsPublisher, QtCore.QObject):
     """
-    Provides a user dialog to select the modules for the feed.
+    Manages data feeds of several MercuryiTC controllers in one process.
+    Every instrument is polled by its own :class:`MercuryFeed` and worker
+    thread, so that instruments are read concurrently and a slow link does
+    not delay the others.
+
+    Readings of all instruments are emitted by :attr:`new_readings_signal`
+    with the instrument name as first argument. The iterators returned by
+    :meth:`iter` and :meth:`aiter` receive the readings of all instruments,
+    tagged with the instrument name in the entry 'Instrument'.
+
+        >>> manager = MercuryFeedManager([('Cryostat A', m1), ('Cryostat B', m2)])
+        >>> manager['Cryostat A'].readings['Temp']
+
+    :param instruments: List of tuples of name and
+        :class:`mercuryitc.MercuryITC` instance.
+    :param kwargs: Arguments for each :class:`MercuryFeed`.
     """
 
-    accepted = QtCore.Signal(object)
+    new_readings_signal = QtCore.Signal(str, dict)
+    connected_signal = QtCore.Signal(str, bool)
+    reconnect_signal = QtCore.Signal(str, int, bool, object)
+    alarm_signal = QtCore.Signal(str, str, bool, str)
 
-    def __init__(self, mercury_modules):
+    def __init__(self, instruments=(), **kwargs):
         super(self.__class__, self).__init__()
-        uic.loadUi(os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                'module_dialog.ui'), self)
-
-        num = len(mercury_modules)
-        temp_modules_nick = []
-        self.temp_modules = []
-        gas_modules_nick = []
-        self.gas_modules = []
-        heat_modules_nick = []
-        self.heat_modules = []
-
-        self.modNumbers = {}
-
-        for i in range(num-1, -1, -1):
-            address = mercury_modules[i].address
-            type_ = address.split(':')[-1]
-            nick = mercury_modules[i].nick
-            if type_ == 'AUX':
-                gas_modules_nick.append(nick)
-                self.gas_modules.append(i)
-            elif type_ == 'HTR':
-                heat_modules_nick.append(nick)
-                self.heat_modules.append(i)
-            elif type_ == 'TEMP':
-                if nick not in temp_modules_nick:
-                    temp_modules_nick.append(nick)
-                    self.temp_modules.append(i)
-
-        self.comboBox.addItems(temp_modules_nick)
-        self.comboBox_2.addItems(gas_modules_nick)
-        self.comboBox_3.addItems(heat_modules_nick)
-
-        # get default modules
-        self.comboBox.setCurrentIndex(CONF.get('MercuryFeed', 'temperature_module'))
-        self.comboBox_2.setCurrentIndex(CONF.get('MercuryFeed', 'gasflow_module'))
-        self.comboBox_3.setCurrentIndex(CONF.get('MercuryFeed', 'heater_module'))
-
-        self.modNumbers['temperature'] = self.temp_modules[self.comboBox.currentIndex()]
-        self.modNumbers['gasflow'] = self.gas_modules[self.comboBox_2.currentIndex()]
-        self.modNumbers['heater'] = self.heat_modules[self.comboBox_3.currentIndex()]
-
-        self.buttonBox.accepted.connect(self._on_accept)
-
-    def _on_accept(self):
-        self.modNumbers['temperature'] = self.temp_modules[self.comboBox.currentIndex()]
-        self.modNumbers['gasflow'] = self.gas_modules[self.comboBox_2.currentIndex()]
-        self.modNumbers['heater'] = self.heat_modules[self.comboBox_3.currentIndex()]
-
-        # update default modules
-        CONF.set('MercuryFeed', 'temperature_module', self.comboBox.currentIndex())
-        CONF.set('MercuryFeed', 'gasflow_module', self.comboBox_2.currentIndex())
-        CONF.set('MercuryFeed', 'heater_module', self.comboBox_3.currentIndex())
-
-        self.accepted.emit(self.modNumbers)
-
-
-class DataCollectionWorker(QtCore.QObject):
+        self.feed_kwargs = kwargs
+        self.feeds = collections.OrderedDict()
 
-    readings_signal = QtCore.Signal(object)
-    connected_signal = QtCore.Signal(bool)
+        for name, mercury in instruments:
+            self.add(name, mercury)
 
-    def __init__(self, refresh, mercury, mod_numbers):
-        QtCore.QObject.__init__(self)
-        self.refresh = refresh
-        self.mercury = mercury
-        self.mod_numbers = mod_numbers
+    def __getitem__(self, name):
+        return self.feeds[name]
 
-        self.readings = {}
-        self.update_modules(self.mod_numbers)
-
-        self.running = True
-        self.terminate = False
-
-    def run(self):
-        while not self.terminate:
-            if self.running:
-                try:
-                    # proceed with full update
-                    self.get_readings()
-                    # sleep until next scheduled refresh
-                    QtCore.QThread.sleep(int(self.refresh))
-                except Exception:
-                    # emit signal if connection is lost
-                    self.connected_signal.emit(False)
-                    # stop worker thread
-                    self.running = False
-                    self.mercury.connected = False
-                    logger.warning('Connection to MercuryiTC lost.')
-            elif not self.running:
-                QtCore.QThread.msleep(int(self.refresh*1000))
-                if self.mercury.connected:
-                    self.running = True
-
-    def get_readings(self):
-        # read heater data
-        self.readings['HeaterVolt'] = self.heater.volt[0]
-        self.readings['HeaterAuto'] = self.control.heater_auto
-        self.readings['HeaterPercent'] = self.control.heater
-
-        # read gas flow data
-        self.readings['FlowAuto'] = self.control.flow_auto
-        self.readings['FlowPercent'] = self.gasflow.perc[0]
-        self.readings['FlowMin'] = self.gasflow.gmin
-        self.readings['FlowSetpoint'] = self.control.flow
-
-        # read temperature data
-        self.readings['Temp'] = self.temperature.temp[0]
-        self.readings['TempSetpoint'] = self.control.t_setpoint
-        self.readings['TempRamp'] = self.control.ramp
-        self.readings['TempRampEnable'] = self.control.ramp_enable
-
-        self.readings_signal.emit(self.readings)
+    def __iter__(self):
+        return iter(self.feeds)
 
-    def update_modules(self, mod_numbers):
+    def __len__(self):
+        return len(self.feeds)
+
+    def __repr__(self):
+        return '<%s(%s)>' % (type(self).__name__, ', '.join(self.feeds))
+
+    def add(self, name, mercury):
         """
-        Updates module list after the new modules have been selected in dialog.
+        Creates and starts a feed for another instrument.
+
+        :param str name: Unique name of the instrument.
+        :param mercury: Instance of :class:`mercuryitc.MercuryITC`.
+        :returns: The new :class:`MercuryFeed`.
         """
-        self.gasflow = self.mercury.modules[mod_numbers['gasflow']]
-        self.heater = self.mercury.modules[mod_numbers['heater']]
-        self.temperature = self.mercury.modules[mod_numbers['temperature']]
-        self.control = self.mercury.modules[mod_numbers['temperature'] + 1]
+        if name in self.feeds:
+            raise ValueError('Instrument %r already exists.' % name)
+
+        feed = MercuryFeed(mercury, name=name, **self.feed_kwargs)
+        feed.new_readings_signal.connect(functools.partial(self.new_readings_signal.emit, name))
+        feed.connected_signal.connect(functools.partial(self.connected_signal.emit, name))
+        feed.reconnect_signal.connect(functools.partial(self.reconnect_signal.emit, name))
+        feed.alarm_signal.connect(functools.partial(self.alarm_signal.emit, name))
+        feed._add_consumer(_TaggedConsumer(name, self))
+
+        self.feeds[name] = feed
+        return feed
+
+    def remove(self, name):
+        """Stops and removes the feed of an instrument."""
+        self.feeds.pop(name).exit_()
+
+    @property
+    def readings(self):
+        """Latest full readings as dict of instrument name and readings."""
+        return dict((name, feed.readings) for name, feed in self.feeds.items())
+
+    @property
+    def timing(self):
+        """Timing statistics as dict of instrument name and statistics."""
+        return dict((name, feed.timing) for name, feed in self.feeds.items())
+
+    def exit_(self):
+        # stop all workers first, so that they shut down concurrently
+        for feed in self.feeds.values():
+            if feed.worker:
+                feed.worker.stop()
+        for name in list(self.feeds):
+            self.remove(name)
+        self._close_consumers()
+        self.deleteLater()
+
+
+class DataCollectionWorker(DataCollector, QtCore.QObject):
+    """
+    :class:`mercurygui.collector.DataCollector` which also emits new readings,
+    connection changes and alarms as Qt signals.
+    """
+
+    readings_signal = QtCore.Signal(object)
+    connected_signal = QtCore.Signal(bool)
+    reconnect_signal = QtCore.Signal(int, bool, object)
+    alarm_signal = QtCore.Signal(str, bool, str)
+
+    def _emit_readings(self, readings):
+        self.readings_signal.emit(readings)
+        DataCollector._emit_readings(self, readings)
+
+    def _emit_connected(self, connected):
+        self.connected_signal.emit(connected)
+        DataCollector._emit_connected(self, connected)
+
+    def _emit_reconnect(self, attempt, connected, retry_in):
+        self.reconnect_signal.emit(attempt, connected, retry_in)
+        DataCollector._emit_reconnect(self, attempt, connected, retry_in)
+
+    def _emit_alarm(self, name, active, message):
+        self.alarm_signal.emit(name, active, message)
+        DataCollector._emit_alarm(self, name, active, message)
 
 
 # if we're running the file directly and not importing it
 if __name__ == '__main__':
 
+    from qtpy import QtWidgets
     from mercuryitc import MercuryITC
 
     # check if event loop is already running (e.g. in IPython),
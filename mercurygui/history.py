@@ -0,0 +1,639 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory history of the readings which are plotted and logged by
+:class:`mercurygui.main.MercuryMonitorApp`.
+
+The history of a data feed, :class:`FeedHistory`, can be queried for any time
+range, also before the start of the program, from the log files:
+
+    >>> columns = feed.history.query(t0, t1, fields=('time', 'temp'), resolution=60)
+
+Note: Leave this file free of Qt related imports, so that it can be used
+without a GUI.
+"""
+from __future__ import division, absolute_import
+import time
+import threading
+import numpy as np
+
+from mercurygui import log_reader
+
+
+class RingBuffer(object):
+    """
+    Fixed-capacity circular buffer for rows of float values.
+
+    Every column is written twice, at its position in the ring and at the same
+    position offset by the capacity. Any run of the most recent columns is
+    therefore contiguous in memory and can be returned as a view without
+    copying. Appending is O(1), independent of the number of entries stored.
+    """
+
+    def __init__(self, rows, capacity):
+        self.capacity = int(capacity)
+        self._data = np.zeros((rows, 2 * self.capacity))
+        self._head = 0  # position of the next entry in the ring
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, values):
+        i = self._head
+        self._data[:, i] = values
+        self._data[:, i + self.capacity] = values
+
+        self._head = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def extend(self, values):
+        """
+        Appends the columns of `values`, an array of shape ``(rows, n)``.
+        Only the last `capacity` columns are kept.
+        """
+        values = np.asarray(values)
+        n = values.shape[1]
+        if n == 0:
+            return
+        if n > self.capacity:
+            self._head = (self._head + n - self.capacity) % self.capacity
+            values = values[:, -self.capacity:]
+            n = self.capacity
+
+        # write in at most two contiguous runs, wrapping around the ring
+        i = self._head
+        k = min(n, self.capacity - i)
+        for start, part in ((i, values[:, :k]), (0, values[:, k:])):
+            end = start + part.shape[1]
+            self._data[:, start:end] = part
+            self._data[:, start + self.capacity:end + self.capacity] = part
+
+        self._head = (self._head + n) % self.capacity
+        self._size = min(self._size + n, self.capacity)
+
+    def prepend(self, values):
+        """
+        Inserts the columns of `values`, an array of shape ``(rows, n)``,
+        before the oldest entry. Only the last columns which fit into the
+        free space are kept.
+
+        :returns: Number of columns inserted.
+        """
+        values = np.asarray(values)
+        n = min(values.shape[1], self.capacity - self._size)
+        if n <= 0:
+            return 0
+        values = values[:, values.shape[1] - n:]
+
+        # write in at most two contiguous runs, wrapping around the ring
+        i = (self._head - self._size - n) % self.capacity
+        k = min(n, self.capacity - i)
+        for start, part in ((i, values[:, :k]), (0, values[:, k:])):
+            end = start + part.shape[1]
+            self._data[:, start:end] = part
+            self._data[:, start + self.capacity:end + self.capacity] = part
+
+        self._size += n
+        return n
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
+
+    def last(self, n=None):
+        """
+        Returns a view of the last `n` entries (all entries if `n` is None) as
+        an array of shape ``(rows, n)``. The view is only valid until the next
+        append.
+        """
+        n = self._size if n is None else max(min(int(n), self._size), 0)
+        end = (self._head - 1) % self.capacity + 1 + self.capacity
+        return self._data[:, end - n:end]
+
+
+class TemperatureHistory(object):
+    """
+    Fixed-capacity history of time, temperature, heater and gas flow readings.
+
+    All channels share one preallocated :class:`RingBuffer`. In addition, a
+    level-of-detail pyramid is maintained incrementally as samples arrive:
+    level `k` stores the minimum, maximum and mean of each channel over
+    buckets of ``factor**k`` consecutive samples. :meth:`decimated_window`
+    selects the finest level which fits into the requested number of
+    points, so that rendering cost does not depend on the length of the time
+    window and short excursions are never dropped.
+
+    Samples are expected to arrive in chronological order.
+    """
+
+    FIELDS = ('time', 'temp', 'heater', 'gasflow')
+
+    # layout of the rows of each level of the pyramid, channels are in the
+    # order of FIELDS[1:]
+    _N = len(FIELDS) - 1
+    _MIN = slice(1, 1 + _N)
+    _MAX = slice(1 + _N, 1 + 2*_N)
+    _MEAN = slice(1 + 2*_N, 1 + 3*_N)
+    _COUNT = 1 + 3*_N  # only used by pending buckets, holds sum until full
+
+    def __init__(self, capacity=86400, factor=4, min_buckets=16):
+        self.capacity = int(capacity)
+        self.factor = int(factor)
+
+        self._raw = RingBuffer(len(self.FIELDS), self.capacity)
+
+        # bucket sizes in samples, the coarsest level keeps `min_buckets`
+        self._bucket_sizes = []
+        size = self.factor
+        while self.capacity // size >= min_buckets:
+            self._bucket_sizes.append(size)
+            size *= self.factor
+
+        self._levels = [RingBuffer(1 + 3*self._N, self.capacity // s + 2)
+                        for s in self._bucket_sizes]
+        # partially filled bucket of each level, with sums instead of means
+        self._pending = np.zeros((len(self._levels), 2 + 3*self._N))
+
+    def __len__(self):
+        return len(self._raw)
+
+    def append(self, t, temp, heater, gasflow):
+        """
+        Appends a new sample, overwriting the oldest one if the buffer is full.
+
+        :param float t: Time stamp in sec since the epoch.
+        :param float temp: Temperature in K.
+        :param float heater: Heater output as fraction of its maximum.
+        :param float gasflow: Needle valve opening as fraction of its maximum.
+        """
+        self._raw.append((t, temp, heater, gasflow))
+
+        y = (temp, heater, gasflow)
+        self._accumulate(0, t, y, y, y, 1)
+
+    def extend(self, columns):
+        """
+        Appends many samples at once, equivalent to calling :meth:`append`
+        for each sample but vectorized.
+
+        :param columns: Array of shape ``(len(FIELDS), n)`` of samples in
+            chronological order, later than the latest sample.
+        """
+        columns = np.asarray(columns, dtype=float)
+        if columns.shape[1] == 0:
+            return
+        self._raw.extend(columns)
+
+        y = columns[1:]
+        self._accumulate_many(0, columns[0], y, y, y, 1)
+
+    def _accumulate_many(self, k, t0, y_min, y_max, y_mean, count):
+        """
+        Adds samples or full buckets of level `k - 1` to level `k`, see
+        :meth:`_accumulate`. All items hold `count` samples.
+        """
+        n = len(t0)
+        if k >= len(self._levels) or n == 0:
+            return
+
+        size = self._bucket_sizes[k]
+        p = self._pending[k]
+        buckets = []
+
+        # complete the pending bucket
+        i = 0
+        if p[self._COUNT] > 0:
+            i = min(int(round((size - p[self._COUNT]) / count)), n)
+            np.minimum(p[self._MIN], y_min[:, :i].min(axis=1), out=p[self._MIN])
+            np.maximum(p[self._MAX], y_max[:, :i].max(axis=1), out=p[self._MAX])
+            p[self._MEAN] += y_mean[:, :i].sum(axis=1) * count
+            p[self._COUNT] += i * count
+            if p[self._COUNT] < size:
+                return
+            bucket = p[:self._COUNT].copy()
+            bucket[self._MEAN] /= p[self._COUNT]
+            buckets.append(bucket[:, np.newaxis])
+            p[self._COUNT] = 0
+
+        # full buckets of `size // count` items each
+        m = size // count
+        j = i + (n - i) // m * m
+        if j > i:
+            shape = (self._N, -1, m)
+            full = np.empty((self._COUNT, (j - i) // m))
+            full[0] = t0[i:j:m]
+            full[self._MIN] = y_min[:, i:j].reshape(shape).min(axis=2)
+            full[self._MAX] = y_max[:, i:j].reshape(shape).max(axis=2)
+            full[self._MEAN] = y_mean[:, i:j].reshape(shape).mean(axis=2)
+            buckets.append(full)
+
+        # start a new pending bucket with the remaining items
+        if j < n:
+            p[0] = t0[j]
+            p[self._MIN] = y_min[:, j:].min(axis=1)
+            p[self._MAX] = y_max[:, j:].max(axis=1)
+            p[self._MEAN] = y_mean[:, j:].sum(axis=1) * count
+            p[self._COUNT] = (n - j) * count
+
+        if buckets:
+            buckets = np.concatenate(buckets, axis=1)
+            self._levels[k].extend(buckets)
+            self._accumulate_many(k + 1, buckets[0], buckets[self._MIN],
+                                  buckets[self._MAX], buckets[self._MEAN], size)
+
+    def prepend(self, columns):
+        """
+        Inserts samples before the earliest sample, for instance from
+        previous log files. The cost only depends on the number of new
+        samples: their buckets are computed separately and the last bucket
+        of each level, which holds fewer samples, is inserted as is.
+
+        :param columns: Array of shape ``(len(FIELDS), n)`` of samples in
+            chronological order. Samples which are not earlier than the
+            earliest sample or which do not fit into the capacity are
+            dropped.
+        :returns: Number of samples inserted.
+        """
+        columns = np.asarray(columns, dtype=float)
+        if len(self) > 0:
+            columns = columns[:, columns[0] < self.earliest_time]
+        columns = columns[:, max(columns.shape[1] - (self.capacity - len(self)), 0):]
+        n = columns.shape[1]
+        if n == 0:
+            return 0
+        if len(self) == 0:
+            self.extend(columns)
+            return n
+
+        buckets = self._buckets(columns)
+        if any(b.shape[1] > level.capacity - len(level) for b, level in zip(buckets, self._levels)):
+            # no space left for another partial bucket, rebuild all levels
+            data = np.concatenate((columns, self._raw.last()), axis=1)
+            self.clear()
+            self.extend(data)
+            return n
+
+        self._raw.prepend(columns)
+        for b, level in zip(buckets, self._levels):
+            level.prepend(b)
+        return n
+
+    def _buckets(self, columns):
+        """
+        Returns the buckets of each level for the samples `columns` alone,
+        including a last bucket of the remaining samples.
+        """
+        scratch = TemperatureHistory.__new__(TemperatureHistory)
+        scratch._bucket_sizes = self._bucket_sizes
+        scratch._levels = [RingBuffer(1 + 3*self._N, columns.shape[1] // s + 1)
+                           for s in self._bucket_sizes]
+        scratch._pending = np.zeros_like(self._pending)
+
+        y = columns[1:]
+        scratch._accumulate_many(0, columns[0], y, y, y, 1)
+
+        buckets = []
+        for k, level in enumerate(scratch._levels):
+            b = level.last()
+            tail = scratch._pending_bucket(k)
+            if tail is not None:
+                b = np.concatenate((b, tail[:, np.newaxis]), axis=1)
+            buckets.append(b)
+        return buckets
+
+    def _accumulate(self, k, t0, y_min, y_max, y_mean, count):
+        """Adds a sample or a full bucket of level `k - 1` to level `k`."""
+        if k >= len(self._levels):
+            return
+
+        p = self._pending[k]
+        if p[self._COUNT] == 0:
+            p[0] = t0
+            p[self._MIN] = y_min
+            p[self._MAX] = y_max
+            p[self._MEAN] = 0
+        else:
+            np.minimum(p[self._MIN], y_min, out=p[self._MIN])
+            np.maximum(p[self._MAX], y_max, out=p[self._MAX])
+        p[self._MEAN] += np.multiply(y_mean, count)
+        p[self._COUNT] += count
+
+        if p[self._COUNT] >= self._bucket_sizes[k]:
+            bucket = p[:self._COUNT].copy()
+            bucket[self._MEAN] /= p[self._COUNT]
+            self._levels[k].append(bucket)
+            p[self._COUNT] = 0
+
+            self._accumulate(k + 1, bucket[0], bucket[self._MIN],
+                             bucket[self._MAX], bucket[self._MEAN],
+                             self._bucket_sizes[k])
+
+    def _pending_bucket(self, k):
+        """
+        Returns the samples since the last full bucket of level `k` combined
+        into a single bucket or None if there are no such samples.
+        """
+        pending = self._pending[:k + 1]
+        pending = pending[pending[:, self._COUNT] > 0]
+        if len(pending) == 0:
+            return None
+
+        bucket = np.empty(self._COUNT)
+        bucket[0] = pending[:, 0].min()
+        bucket[self._MIN] = pending[:, self._MIN].min(axis=0)
+        bucket[self._MAX] = pending[:, self._MAX].max(axis=0)
+        bucket[self._MEAN] = (pending[:, self._MEAN].sum(axis=0) /
+                              pending[:, self._COUNT].sum())
+        return bucket
+
+    def clear(self):
+        """Removes all samples from the history."""
+        self._raw.clear()
+        for level in self._levels:
+            level.clear()
+        self._pending[:] = 0
+
+    def last(self, n=None):
+        """
+        Returns a view of the last `n` samples (all samples if `n` is None)
+        as an array of shape ``(len(FIELDS), n)``. The view is only valid
+        until the next append.
+        """
+        return self._raw.last(n)
+
+    def window(self, duration):
+        """
+        Returns a view of all samples recorded within `duration` seconds of
+        the latest sample, see :meth:`last`.
+        """
+        data = self._raw.last()
+        if data.shape[1] == 0:
+            return data
+        t = data[0]
+        start = np.searchsorted(t, t[-1] - duration, side='left')
+        return data[:, start:]
+
+    def decimated_window(self, duration, max_points):
+        """
+        Returns the samples recorded within `duration` seconds of the latest
+        sample, reduced to at most about `2*max_points` points.
+
+        If the window holds more than `max_points` samples, the finest
+        level of detail with at most `max_points` buckets is used and each
+        bucket is returned as two points at the bucket's start time: its
+        minimum followed by its maximum. This preserves all excursions when
+        plotting one bucket per pixel.
+
+        :returns: Array of shape ``(len(FIELDS), n)``. This is a view if no
+            decimation was required.
+        """
+        data = self.window(duration)
+        n = data.shape[1]
+        max_points = max(int(max_points), 1)
+
+        if n <= max_points or len(self._levels) == 0:
+            return data
+
+        # select the finest level with at most `max_points` buckets
+        k = 0
+        while k < len(self._levels) - 1 and n / self._bucket_sizes[k] > max_points:
+            k += 1
+
+        buckets = self._levels[k].last()
+        start = np.searchsorted(buckets[0], data[0, 0], side='left')
+        buckets = buckets[:, start:]
+
+        tail = self._pending_bucket(k)
+        if tail is not None:
+            buckets = np.concatenate((buckets, tail[:, np.newaxis]), axis=1)
+
+        m = buckets.shape[1]
+        result = np.empty((len(self.FIELDS), 2*m))
+        result[0] = np.repeat(buckets[0], 2)
+        result[1:, 0::2] = buckets[self._MIN]
+        result[1:, 1::2] = buckets[self._MAX]
+
+        return result
+
+    def field(self, name, n=None):
+        """Returns a view of the last `n` samples of field `name`."""
+        return self.last(n)[self.FIELDS.index(name)]
+
+    @property
+    def earliest_time(self):
+        """Time stamp of the oldest sample or None if empty."""
+        if len(self._raw) == 0:
+            return None
+        return self._raw.last()[0, 0]
+
+    @property
+    def latest_time(self):
+        """Time stamp of the latest sample or None if empty."""
+        if len(self._raw) == 0:
+            return None
+        return self._raw.last(1)[0, 0]
+
+
+def downsample(columns, resolution, weights=None):
+    """
+    Averages readings over intervals of `resolution` sec, aligned to
+    multiples of `resolution` since the epoch.
+
+    :param columns: Array of shape ``(m, n)`` with time stamps in the first
+        row, in chronological order.
+    :param float resolution: Length of the intervals in sec.
+    :param weights: Weight of each reading, for instance the number of
+        readings it averages. All readings are weighted equally if None.
+    :returns: Tuple of an array of shape ``(m, k)`` with the start time and
+        the mean of each interval which holds readings, and the sum of
+        weights of each interval.
+    """
+    columns = np.asarray(columns, dtype=float)
+    n = columns.shape[1]
+    weights = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+    if n == 0:
+        return np.zeros((columns.shape[0], 0)), np.zeros(0)
+
+    # readings of an interval are consecutive
+    bins = np.floor(columns[0] / resolution)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bins)) + 1))
+
+    counts = np.add.reduceat(weights, starts)
+    result = np.empty((columns.shape[0], len(starts)))
+    result[0] = bins[starts] * resolution
+    result[1:] = np.add.reduceat(columns[1:] * weights, starts, axis=1) / counts
+    return result, counts
+
+
+def _read_rollup(path, t0, t1):
+    """
+    Reads a log from its rollup where possible, see
+    :func:`mercurygui.log_reader.read_rollup`. Periods which are only partly
+    between `t0` and `t1` are read from the log itself.
+
+    :returns: List of (columns, weights) in chronological order.
+    """
+    period = log_reader.ROLLUP_PERIOD
+    r0 = None if t0 is None else np.ceil(t0 / period) * period
+    r1 = None if t1 is None else np.floor(t1 / period) * period
+
+    rollup = log_reader.read_rollup(path, r0, r1)
+    if rollup is None:
+        return [(log_reader.read_log(path, t0, t1), None)]
+
+    parts = []
+    if r0 is not None and r0 > t0:
+        end = r0 if t1 is None else min(r0, t1)
+        parts.append((log_reader.read_log(path, t0, end), None))
+    parts.append(rollup)
+    if r1 is not None and r1 < t1 and (r0 is None or r1 >= r0):
+        parts.append((log_reader.read_log(path, r1, t1), None))
+    return parts
+
+
+class FeedHistory(TemperatureHistory):
+    """
+    History of the readings of a data feed, see :class:`TemperatureHistory`.
+    Samples are recorded by the feed with :meth:`record`. All methods are
+    thread-safe, apart from views returned by :meth:`last` and
+    :meth:`window`, which are only valid in the thread which records.
+
+    :meth:`query` returns readings of any time range. Readings before the
+    earliest sample in memory are read from the log files in `directory`.
+
+    :param int capacity: Number of samples kept in memory.
+    :param str directory: Directory of the log files, see
+        :mod:`mercurygui.log_reader`. If None, only samples in memory are
+        available.
+    """
+
+    # readings which are recorded, in the order of FIELDS[1:]
+    KEYS = ('Temp', 'HeaterPercent', 'FlowPercent')
+
+    def __init__(self, capacity=86400, directory=None, **kwargs):
+        self._lock = threading.RLock()
+        super(FeedHistory, self).__init__(capacity, **kwargs)
+        self.directory = directory
+
+    def append(self, t, temp, heater, gasflow):
+        with self._lock:
+            super(FeedHistory, self).append(t, temp, heater, gasflow)
+
+    def extend(self, columns):
+        with self._lock:
+            super(FeedHistory, self).extend(columns)
+
+    def clear(self):
+        with self._lock:
+            super(FeedHistory, self).clear()
+
+    def record(self, readings, full=None):
+        """
+        Appends a sample if `readings` include the temperature, heater or gas
+        flow. Readings which are missing are taken from `full`.
+
+        The sample is stamped with the latest time at which one of its
+        readings was read, from the entry 'Timestamps' of `readings`, so that
+        it matches the log files regardless of when it reaches the consumer.
+        The current time is used if there are no time stamps. Samples which
+        are not later than the latest sample are dropped.
+
+        :param dict readings: New readings of the feed.
+        :param dict full: Latest full readings of the feed.
+        :returns: The sample as tuple or None.
+        """
+        if not any(key in readings for key in self.KEYS):
+            return None
+        full = readings if full is None else full
+        stamps = readings.get('Timestamps') or {}
+        stamps = [stamps[key] for key in self.KEYS if key in readings and key in stamps]
+        t = max(stamps) if stamps else time.time()
+        try:
+            row = (t, full['Temp'], full['HeaterPercent'] / 100,
+                   full['FlowPercent'] / 100)
+        except KeyError:
+            return None
+        with self._lock:
+            latest = self.latest_time
+            if latest is not None and t <= latest:
+                # no reading was read since the latest sample
+                return None
+            self.append(*row)
+        return row
+
+    def prepend(self, columns):
+        with self._lock:
+            return super(FeedHistory, self).prepend(columns)
+
+    def query(self, t0=None, t1=None, fields=None, resolution=None, max_points=None):
+        """
+        Returns the readings recorded between `t0` (inclusive) and `t1`
+        (exclusive). Samples in memory are used where available, earlier
+        readings are read from the log files.
+
+        With `resolution` or `max_points`, readings are averaged over
+        intervals, see :func:`downsample`. For a resolution of a minute or
+        more, closed log files are read from their per-minute rollups, see
+        :func:`mercurygui.log_reader.read_rollup`, so that long time ranges
+        do not require reading every sample.
+
+        :param float t0: Start time in sec since the epoch, the earliest
+            available reading if None.
+        :param float t1: End time in sec since the epoch, the latest reading
+            if None.
+        :param fields: Names of the fields to return, see :attr:`FIELDS`. All
+            fields if None.
+        :param float resolution: Length of the averaging intervals in sec.
+        :param int max_points: Maximum number of intervals. The resolution is
+            increased as required.
+        :returns: Array of shape ``(len(fields), n)``.
+        """
+        fields = self.FIELDS if fields is None else tuple(fields)
+        for name in fields:
+            if name not in self.FIELDS:
+                raise ValueError('Unknown field %r, must be one of %s.' % (name, self.FIELDS))
+        rows = [self.FIELDS.index(name) for name in fields]
+
+        with self._lock:
+            memory_start = self.earliest_time
+            memory_end = self.latest_time
+
+        logs = []
+        if self.directory and (memory_start is None or t0 is None or t0 < memory_start):
+            if memory_start is None:
+                disk_end = t1
+            else:
+                disk_end = memory_start if t1 is None else min(t1, memory_start)
+            logs = log_reader.find_logs(self.directory, t0, disk_end)
+        else:
+            disk_end = None
+
+        if max_points:
+            start = t0 if t0 is not None else (logs[0][0] if logs else memory_start)
+            end = t1 if t1 is not None else (memory_end if memory_end is not None else time.time())
+            if start is not None and end > start:
+                # intervals are aligned, so that the range may cover one more
+                resolution = max(resolution or 0, (end - start) / max(int(max_points) - 1, 1))
+
+        # list of (columns, weights)
+        parts = []
+        for _, path in logs:
+            if resolution and resolution >= log_reader.ROLLUP_PERIOD:
+                parts.extend(_read_rollup(path, t0, disk_end))
+            else:
+                parts.append((log_reader.read_log(path, t0, disk_end), None))
+
+        with self._lock:
+            data = self.last()
+            i0 = 0 if t0 is None else np.searchsorted(data[0], t0, side='left')
+            i1 = data.shape[1] if t1 is None else np.searchsorted(data[0], t1, side='left')
+            parts.append((data[:, i0:i1].copy(), None))
+
+        if resolution:
+            weights = [np.ones(c.shape[1]) if w is None else w for c, w in parts]
+            columns, _ = downsample(np.concatenate([c for c, _ in parts], axis=1),
+                                    resolution, np.concatenate(weights))
+        else:
+            columns = np.concatenate([c for c, _ in parts], axis=1)
+
+        return columns[rows]
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+Reading of temperature log files written by
+:class:`mercurygui.log_writer.TemperatureLogWriter`.
+
+Log files are named after the time of their first row or the start of their
+partition, see :class:`mercurygui.log_writer.PartitionedLog`. Only the bytes
+which hold the requested time range are read:
+
+- Binary segments are mapped into memory, see :mod:`mercurygui.segment`.
+- Text logs are searched by bisection over byte offsets.
+- Compressed logs consist of one gzip member per block of rows. A sidecar
+  index file maps the time range of each block to its offset and length, so
+  that only the required blocks are decompressed. Decompressing the whole
+  file with gzip tools yields the original text log or, for binary
+  segments, the rows as little-endian float64 values.
+
+Closed logs also have a rollup of per-minute means in a sidecar segment, see
+:func:`read_rollup`, so that long time ranges can be read at a coarse
+resolution without reading individual readings.
+
+Note: Leave this file free of Qt related imports, so that it can be used
+without a GUI.
+"""
+from __future__ import division, absolute_import
+import os
+import re
+import json
+import gzip
+import time
+import zlib
+import logging
+import numpy as np
+
+from mercurygui import segment
+
+logger = logging.getLogger(__name__)
+
+LOG_PREFIX = 'temperature_log '
+TEXT_EXTENSION = '.txt'
+EXTENSIONS = (segment.EXTENSION, TEXT_EXTENSION)
+COMPRESSED_EXTENSION = '.gz'
+INDEX_EXTENSION = '.idx'
+TIME_FORMAT = '%Y-%m-%d_%H-%M-%S'
+
+# rollups of closed logs, with the number of readings averaged per row
+ROLLUP_PERIOD = 60
+ROLLUP_EXTENSION = '.rollup' + segment.EXTENSION
+ROLLUP_FIELDS = segment.FIELDS + ('count',)
+ROLLUP_UNITS = segment.UNITS + ('',)
+
+_NAME = re.compile(r'^(?P<time>\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})(_\d+)?$')
+
+# size of the byte range which is scanned line by line after bisection
+_SCAN_SIZE = 65536
+
+
+def split_log_name(path, prefix=LOG_PREFIX):
+    """
+    Splits the name of a log file into its start time in sec since the
+    epoch, its extension and whether it is compressed.
+
+    :returns: Tuple (start time, extension, compressed) or None if `path` is
+        not a log file.
+    """
+    name = os.path.basename(path)
+    compressed = name.endswith(COMPRESSED_EXTENSION)
+    if compressed:
+        name = name[:-len(COMPRESSED_EXTENSION)]
+    name, ext = os.path.splitext(name)
+    if ext not in EXTENSIONS or not name.startswith(prefix):
+        return None
+    match = _NAME.match(name[len(prefix):])
+    if match is None:
+        return None
+    t = time.mktime(time.strptime(match.group('time'), TIME_FORMAT))
+    return t, ext, compressed
+
+
+def log_start_time(path, prefix=LOG_PREFIX):
+    """
+    Returns the start time of a log file from its name, in sec since the
+    epoch, or None if it is not a log file.
+    """
+    parts = split_log_name(path, prefix)
+    return None if parts is None else parts[0]
+
+
+def find_logs(directory, t_start=None, t_end=None, prefix=LOG_PREFIX):
+    """
+    Finds the log files in `directory` which may hold rows between `t_start`
+    and `t_end`. Each file is assumed to end where the next one starts. If a
+    log exists both compressed and uncompressed, for instance while it is
+    being compressed, the uncompressed file is returned.
+
+    :returns: List of (start time, path) in chronological order.
+    """
+    try:
+        names = set(os.listdir(directory))
+    except OSError:
+        return []
+
+    logs = []
+    for name in names:
+        parts = split_log_name(name, prefix)
+        if parts is None:
+            continue
+        if parts[2] and name[:-len(COMPRESSED_EXTENSION)] in names:
+            continue
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            logs.append((parts[0], path))
+    logs.sort()
+
+    selected = []
+    for i, (t, path) in enumerate(logs):
+        if t_end is not None and t >= t_end:
+            break
+        if t_start is not None and i + 1 < len(logs) and logs[i + 1][0] <= t_start:
+            continue
+        selected.append((t, path))
+    return selected
+
+
+# =============================================================================
+# Text logs
+# =============================================================================
+
+def parse_text(data):
+    """
+    Parses rows of a tab-separated text log. Header lines and a partially
+    written last line are skipped.
+
+    :param bytes data: Content of the log or of a range of whole lines.
+    :returns: Array of shape ``(len(segment.FIELDS), n)``.
+    """
+    start = 0
+    while data.startswith(b'#', start):
+        start = data.find(b'\n', start) + 1 or len(data)
+    end = data.rfind(b'\n') + 1
+
+    values = np.array(data[start:end].split(), dtype=float)
+    n = len(values) // len(segment.FIELDS)
+    return values[:n * len(segment.FIELDS)].reshape(n, len(segment.FIELDS)).T
+
+
+def _line_time(line):
+    """Returns the time stamp of a complete line or None."""
+    if not line.endswith(b'\n'):
+        return None
+    try:
+        return float(line.split(None, 1)[0])
+    except (ValueError, IndexError):
+        return None
+
+
+def _text_offset(f, t, lo, hi):
+    """
+    Returns the offset of the first line in the byte range [lo, hi] of an
+    open text log with a time stamp not earlier than `t`, or `hi`. The range
+    is narrowed by bisection and then scanned line by line.
+
+    :param int lo: Offset of the start of a line.
+    :param int hi: Offset of the start of a line or the end of the data.
+    """
+    while hi - lo > _SCAN_SIZE:
+        mid = (lo + hi) // 2
+        f.seek(mid)
+        f.readline()  # skip to the start of the next line
+        pos = f.tell()
+        if pos >= hi:
+            break
+        line = f.readline()
+        t_line = _line_time(line)
+        if t_line is None or t_line >= t:
+            hi = pos
+        else:
+            lo = pos + len(line)
+
+    f.seek(lo)
+    pos = lo
+    while pos < hi:
+        line = f.readline()
+        t_line = _line_time(line)
+        if t_line is None or t_line >= t:
+            return pos
+        pos += len(line)
+    return hi
+
+
+def read_text_log(path, t_start=None, t_end=None):
+    """
+    Reads the rows of a text log with time stamps between `t_start`
+    (inclusive) and `t_end` (exclusive). Only the lines in the range are
+    read, apart from a few lines visited by bisection.
+
+    :returns: Array of shape ``(len(segment.FIELDS), n)``.
+    """
+    with open(path, 'rb') as f:
+        # skip the header
+        line = f.readline()
+        while line.startswith(b'#'):
+            line = f.readline()
+        data_start = f.tell() - len(line)
+
+        # ignore a partially written last line
+        size = os.fstat(f.fileno()).st_size
+        f.seek(max(size - 1, data_start))
+        if f.read(1) != b'\n':
+            f.seek(max(size - _SCAN_SIZE, data_start))
+            tail = f.read()
+            size -= len(tail) - tail.rfind(b'\n') - 1
+
+        i0 = data_start if t_start is None else _text_offset(f, t_start, data_start, size)
+        i1 = size if t_end is None else _text_offset(f, t_end, i0, size)
+
+        f.seek(i0)
+        return parse_text(f.read(i1 - i0))
+
+
+# =============================================================================
+# Compressed logs
+# =============================================================================
+
+def read_index(path):
+    """
+    Reads the index of a compressed log `path`.
+
+    :returns: Tuple of the header as dict and an array of blocks with columns
+        first time, last time, offset, length and number of rows.
+    :raises: :class:`IOError` if the index does not exist.
+    """
+    with open(path + INDEX_EXTENSION, 'rb') as f:
+        header = json.loads(f.readline().decode('utf-8').lstrip('#'))
+        blocks = np.array(f.read().split(), dtype=float).reshape(-1, 5)
+    return header, blocks
+
+
+def _decode_block(data, header):
+    if header['format'] == 'text':
+        return parse_text(data)
+    else:
+        rows = np.frombuffer(data, dtype=header['dtype'])
+        return rows.reshape(-1, len(header['fields'])).T
+
+
+def read_compressed_log(path, t_start=None, t_end=None):
+    """
+    Reads the rows of a compressed log with time stamps between `t_start`
+    (inclusive) and `t_end` (exclusive). If the index exists, only the
+    blocks which overlap the time range are read and decompressed.
+
+    :returns: Array of shape ``(len(segment.FIELDS), n)``.
+    """
+    try:
+        header, blocks = read_index(path)
+    except (IOError, OSError, ValueError):
+        # decompress the whole file
+        ext = os.path.splitext(path[:-len(COMPRESSED_EXTENSION)])[1]
+        header = {'format': 'text' if ext == TEXT_EXTENSION else 'rows',
+                  'fields': segment.FIELDS, 'dtype': segment.DTYPE}
+        with gzip.open(path, 'rb') as f:
+            columns = _decode_block(f.read(), header)
+    else:
+        selected = np.ones(len(blocks), dtype=bool)
+        if t_start is not None:
+            selected &= blocks[:, 1] >= t_start
+        if t_end is not None:
+            selected &= blocks[:, 0] < t_end
+
+        parts = []
+        with open(path, 'rb') as f:
+            for _, _, offset, length, _ in blocks[selected]:
+                f.seek(int(offset))
+                data = zlib.decompress(f.read(int(length)), 16 + zlib.MAX_WBITS)
+                parts.append(_decode_block(data, header))
+        if not parts:
+            return np.zeros((len(segment.FIELDS), 0))
+        columns = np.concatenate(parts, axis=1)
+
+    t = columns[0]
+    i0 = 0 if t_start is None else np.searchsorted(t, t_start, side='left')
+    i1 = len(t) if t_end is None else np.searchsorted(t, t_end, side='left')
+    return columns[:, i0:i1]
+
+
+def read_log(path, t_start=None, t_end=None):
+    """
+    Reads the rows of a binary, text or compressed log with time stamps
+    between `t_start` (inclusive) and `t_end` (exclusive).
+
+    :returns: Array of shape ``(len(segment.FIELDS), n)``.
+    """
+    if path.endswith(COMPRESSED_EXTENSION):
+        return np.array(read_compressed_log(path, t_start, t_end), dtype=float)
+    elif not path.endswith(segment.EXTENSION):
+        return read_text_log(path, t_start, t_end)
+
+    columns = segment.Segment(path).columns
+    t = columns[0]
+    i0 = 0 if t_start is None else np.searchsorted(t, t_start, side='left')
+    i1 = len(t) if t_end is None else np.searchsorted(t, t_end, side='left')
+    return np.array(columns[:, i0:i1], dtype=float)
+
+
+def rollup_path(path):
+    """Returns the path of the rollup of a log, compressed or not."""
+    if path.endswith(COMPRESSED_EXTENSION):
+        path = path[:-len(COMPRESSED_EXTENSION)]
+    return path + ROLLUP_EXTENSION
+
+
+def read_rollup(path, t_start=None, t_end=None):
+    """
+    Reads the means over :data:`ROLLUP_PERIOD` sec of a log, for periods
+    starting between `t_start` (inclusive) and `t_end` (exclusive). Periods
+    are aligned to multiples of :data:`ROLLUP_PERIOD` since the epoch.
+
+    :returns: Tuple of an array of shape ``(len(segment.FIELDS), n)`` with
+        the start time and the means of each period, and an array of the
+        number of readings per period. None if the log has no rollup.
+    """
+    try:
+        columns = segment.Segment(rollup_path(path)).columns
+    except (IOError, OSError, ValueError):
+        return None
+
+    t = columns[0]
+    i0 = 0 if t_start is None else np.searchsorted(t, t_start, side='left')
+    i1 = len(t) if t_end is None else np.searchsorted(t, t_end, side='left')
+    columns = np.array(columns[:, i0:i1], dtype=float)
+    return columns[:len(segment.FIELDS)], columns[len(segment.FIELDS)]
+
+
+def iter_logs_reversed(directory, t_start=None, t_end=None, chunk_size=14400,
+                       limit=None, prefix=LOG_PREFIX):
+    """
+    Yields the rows of all logs in `directory` between `t_start` and `t_end`
+    in chunks of at most `chunk_size` rows, newest first. Files which cannot
+    be read are skipped.
+
+    :param int limit: Maximum number of rows in total.
+    :returns: Iterator over arrays of shape ``(len(segment.FIELDS), n)``,
+        each chunk in chronological order.
+    """
+    remaining = limit
+    for _, path in reversed(find_logs(directory, t_start, t_end, prefix)):
+        try:
+            columns = read_log(path, t_start, t_end)
+        except (IOError, OSError) as e:
+            # the log may have been compressed in the meantime
+            compressed = path + COMPRESSED_EXTENSION
+            if path.endswith(COMPRESSED_EXTENSION) or not os.path.exists(compressed):
+                logger.warning('Could not read log %s: %s', path, e)
+                continue
+            columns = read_log(compressed, t_start, t_end)
+        except ValueError as e:
+            logger.warning('Could not read log %s: %s', path, e)
+            continue
+
+        if remaining is not None:
+            columns = columns[:, max(columns.shape[1] - remaining, 0):]
+            remaining -= columns.shape[1]
+
+        for end in range(columns.shape[1], 0, -chunk_size):
+            yield columns[:, max(end - chunk_size, 0):end]
+
+        if remaining is not None and remaining <= 0:
+            return
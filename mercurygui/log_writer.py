@@ -0,0 +1,595 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming writer for temperature log files.
+
+Logs can be partitioned by time with :class:`PartitionedLog`: rows of each
+hour or day are written to their own files and closed partitions are
+archived in the background, see :func:`archive_logs` and
+:mod:`mercurygui.log_reader` for the format.
+
+Note: Leave this file free of Qt related imports, so that it can be used
+without a GUI.
+"""
+from __future__ import division, absolute_import
+import os
+import json
+import math
+import time
+import zlib
+import itertools
+import threading
+import logging
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from mercurygui import segment
+from mercurygui.history import downsample
+from mercurygui.log_reader import (LOG_PREFIX, TEXT_EXTENSION, COMPRESSED_EXTENSION,
+                                   INDEX_EXTENSION, TIME_FORMAT, ROLLUP_PERIOD,
+                                   ROLLUP_FIELDS, ROLLUP_UNITS, split_log_name,
+                                   rollup_path, read_log)
+
+logger = logging.getLogger(__name__)
+
+LOCK_EXTENSION = '.lock'
+
+
+def text_header(heater_vlim):
+    """
+    Returns the header of a tab-separated temperature log file.
+
+    :param float heater_vlim: Heater voltage limit in V.
+    """
+    title = 'temperature trace, saved on ' + time.strftime('%d/%m/%Y') + '\n'
+    header = '\t'.join(['Time (sec)', 'Temperature (K)',
+                        'Heater (%% of %sV)' % heater_vlim, 'Gas flow (%)'])
+    return title + header
+
+
+class TextLog(object):
+    """
+    Tab-separated text log file.
+
+    :param str path: Path of the log file. The header is written if the file
+        does not exist yet.
+    :param str header: Header to write at the top of a new file.
+    """
+
+    def __init__(self, path, header=''):
+        self.path = path
+        self.header = header
+
+    def __repr__(self):
+        return '<%s(%s)>' % (type(self).__name__, self.path)
+
+    def write(self, rows):
+        header = '' if os.path.exists(self.path) else self.header
+        with open(self.path, 'ab') as f:
+            # noinspection PyTypeChecker
+            np.savetxt(f, np.asarray(rows), delimiter='\t', header=header)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        pass  # the file is only open while writing
+
+
+class SegmentLog(object):
+    """
+    Binary log, written as a sequence of segment files in `directory`, see
+    :mod:`mercurygui.segment`. A new segment is started when the current one
+    is full and is named after the time of its first row.
+
+    :param str directory: Directory of the segment files.
+    :param str prefix: Prefix of the segment file names.
+    :param float heater_vlim: Heater voltage limit in V.
+    :param int capacity: Number of rows per segment.
+    """
+
+    def __init__(self, directory, prefix=LOG_PREFIX, heater_vlim=None,
+                 capacity=86400):
+        self.directory = directory
+        self.prefix = prefix
+        self.heater_vlim = heater_vlim
+        self.capacity = capacity
+        self.writer = None
+        self.paths = []  # segments created so far
+
+    def __repr__(self):
+        return '<%s(%s)>' % (type(self).__name__, self.directory)
+
+    def _new_segment(self, t):
+        path = unique_log_path(self.directory, self.prefix, t, segment.EXTENSION)
+        self.paths.append(path)
+        return segment.SegmentWriter(path, self.capacity, self.heater_vlim)
+
+    def write(self, rows):
+        rows = np.asarray(rows)
+        while rows.shape[0] > 0:
+            if self.writer is None or self.writer.full:
+                self.writer = self._new_segment(rows[0, 0])
+            n = self.writer.append(rows)
+            rows = rows[n:]
+
+    def close(self):
+        pass  # segments are only open while writing
+
+
+def unique_log_path(directory, prefix, t, ext):
+    """
+    Returns the path of a new log file named after time `t`, which exists
+    neither compressed nor uncompressed.
+    """
+    name = prefix + time.strftime(TIME_FORMAT, time.localtime(t))
+    path = os.path.join(directory, name + ext)
+    i = 1
+    while os.path.exists(path) or os.path.exists(path + COMPRESSED_EXTENSION):
+        path = os.path.join(directory, '%s_%s%s' % (name, i, ext))
+        i += 1
+    return path
+
+
+def partition_bounds(t, partition):
+    """
+    Returns the start and end of the hour or day in local time which holds
+    time `t`, in sec since the epoch.
+
+    :param str partition: 'hourly' or 'daily'.
+    """
+    lt = time.localtime(t)
+    hour = lt.tm_hour if partition == 'hourly' else 0
+    start = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, hour, 0, 0, 0, 0, -1))
+    if partition == 'hourly':
+        end = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, hour + 1, 0, 0, 0, 0, -1))
+    else:
+        end = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+    return start, end
+
+
+def _gzip_member(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _text_blocks(path, block_rows):
+    """
+    Yields blocks of lines of a text log as (data, first time, last time,
+    rows). Only one block is read into memory at a time.
+    """
+    def line_time(line):
+        try:
+            return float(line.split(None, 1)[0])
+        except (ValueError, IndexError):
+            return float('nan')
+
+    with open(path, 'rb') as f:
+        # header lines are kept in the first block
+        header = []
+        line = f.readline()
+        while line.startswith(b'#'):
+            header.append(line)
+            line = f.readline()
+        rows = [line] + list(itertools.islice(f, block_rows - 1)) if line else []
+
+        while True:
+            t_first = line_time(rows[0]) if rows else float('nan')
+            t_last = line_time(rows[-1]) if rows else float('nan')
+            yield b''.join(header + rows), t_first, t_last, len(rows)
+            header = []
+            rows = list(itertools.islice(f, block_rows))
+            if not rows:
+                break
+
+
+def _segment_blocks(seg, block_rows):
+    """Yields blocks of rows of a segment as (data, first time, last time, rows)."""
+    columns = seg.columns
+    for i in range(0, columns.shape[1], block_rows):
+        block = columns[:, i:i + block_rows]
+        data = np.ascontiguousarray(block.T, dtype=segment.DTYPE).tobytes()
+        yield data, block[0, 0], block[0, -1], block.shape[1]
+
+
+def _replace(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def compress_log(path, block_rows=3600, level=6):
+    """
+    Compresses a closed text log or binary segment to `path` + '.gz' and
+    removes the original file. Every `block_rows` rows are compressed as a
+    separate gzip member, and a sidecar index `path` + '.gz.idx' maps the
+    time range of each block to its offset and length in the compressed
+    file.
+
+    :returns: Path of the compressed file.
+    """
+    target = path + COMPRESSED_EXTENSION
+    index = target + INDEX_EXTENSION
+
+    if path.endswith(TEXT_EXTENSION):
+        header = {'format': 'text', 'fields': segment.FIELDS}
+        blocks = _text_blocks(path, block_rows)
+    else:
+        seg = segment.Segment(path)
+        header = {'format': 'rows', 'fields': seg.fields, 'units': seg.units,
+                  'dtype': segment.DTYPE, 'heater_vlim': seg.heater_vlim}
+        blocks = _segment_blocks(seg, block_rows)
+        del seg
+
+    offset = 0
+    with open(target + '.part', 'wb') as f, open(index + '.part', 'wb') as f_index:
+        f_index.write(('# %s\n' % json.dumps(header)).encode('utf-8'))
+        for data, t_first, t_last, rows in blocks:
+            member = _gzip_member(data, level)
+            f.write(member)
+            f_index.write(('%r\t%r\t%d\t%d\t%d\n' % (
+                float(t_first), float(t_last), offset, len(member), rows)).encode('ascii'))
+            offset += len(member)
+        f.flush()
+        os.fsync(f.fileno())
+    # release the memory map before the segment is removed
+    del blocks
+
+    # the index must exist before the compressed file is found by readers
+    _replace(index + '.part', index)
+    _replace(target + '.part', target)
+    os.remove(path)
+    return target
+
+
+def write_rollup(path):
+    """
+    Writes the means of a closed log over :data:`ROLLUP_PERIOD` sec to a
+    sidecar segment, see :func:`mercurygui.log_reader.read_rollup`.
+
+    :returns: Path of the rollup.
+    """
+    columns, counts = downsample(read_log(path), ROLLUP_PERIOD)
+    target = rollup_path(path)
+    writer = segment.SegmentWriter(target + '.part', max(columns.shape[1], 1),
+                                   fields=ROLLUP_FIELDS, units=ROLLUP_UNITS)
+    writer.append(np.vstack((columns, counts)).T)
+    _replace(target + '.part', target)
+    return target
+
+
+def archive_logs(paths, compress=True, block_rows=3600):
+    """
+    Writes the rollups of closed logs and compresses them, see
+    :func:`write_rollup` and :func:`compress_log`. Errors are logged.
+    """
+    for path in paths:
+        try:
+            if not os.path.exists(rollup_path(path)):
+                write_rollup(path)
+            if compress and not path.endswith(COMPRESSED_EXTENSION):
+                compress_log(path, block_rows)
+            logger.debug('Archived log %s.', path)
+        except Exception:
+            logger.exception('Could not archive log %s.', path)
+
+
+class LogLock(object):
+    """
+    Exclusive lock of a log which is being written, held on a lock file next
+    to it. Other processes which write to the same directory do not archive
+    logs whose lock is held. The lock is released by the operating system if
+    the process ends.
+
+    The lock file is removed while the lock is still held, so that no other
+    process can lock it in between. A process which opened the file before
+    it was removed notices this after acquiring the lock and tries again.
+    On Windows, where open files cannot be removed, the lock file is kept.
+
+    :param str path: Path of the log.
+    """
+
+    def __init__(self, path):
+        self.path = path + LOCK_EXTENSION
+        self._file = None
+
+    def __repr__(self):
+        return '<%s(%s)>' % (type(self).__name__, self.path)
+
+    @property
+    def locked(self):
+        return self._file is not None
+
+    def acquire(self):
+        """
+        Acquires the lock without waiting.
+
+        :returns: True if acquired, False if held by another process.
+        """
+        while self._file is None:
+            f = open(self.path, 'a+')
+            try:
+                if fcntl:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            except (IOError, OSError):
+                f.close()
+                return False
+            if fcntl and not self._is_current(f):
+                # removed by the previous holder, lock the new file
+                f.close()
+                continue
+            self._file = f
+        return True
+
+    def _is_current(self, f):
+        try:
+            a, b = os.fstat(f.fileno()), os.stat(self.path)
+            return (a.st_dev, a.st_ino) == (b.st_dev, b.st_ino)
+        except OSError:
+            return False
+
+    def release(self):
+        """Removes the lock file and releases the lock."""
+        if self._file is None:
+            return
+        try:
+            if fcntl:
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+def log_in_use(path):
+    """Returns whether another process holds the :class:`LogLock` of a log."""
+    lock = LogLock(path)
+    if lock.acquire():
+        lock.release()
+        return False
+    return True
+
+
+class PartitionedLog(object):
+    """
+    Log which is partitioned by time. The rows of each hour or day are
+    written to a :class:`TextLog` or :class:`SegmentLog` of their own in
+    `directory`, named after the start of the partition. When the partition
+    changes, the files of the previous one are archived in a background
+    thread, see :func:`archive_logs`. Logs which were not archived by a
+    previous run are archived when the first rows are written, unless
+    another process still writes to them, see :class:`LogLock`.
+
+    :param str directory: Directory of the log files.
+    :param str prefix: Prefix of the log file names.
+    :param str fmt: 'binary' or 'text'.
+    :param str partition: 'hourly' or 'daily'.
+    :param float heater_vlim: Heater voltage limit in V.
+    :param bool compress: Compress closed partitions, otherwise only their
+        rollups are written.
+    :param int capacity: Number of rows per binary segment. If None, the
+        segments of a partition are sized for one row every `refresh` sec
+        until its end, so that space is not reserved for rows which are
+        never written. Further rows go to another segment.
+    :param float refresh: Interval in sec between rows.
+    """
+
+    def __init__(self, directory, prefix=LOG_PREFIX, fmt='binary',
+                 partition='daily', heater_vlim=None, compress=True, capacity=None,
+                 refresh=1.0):
+        if partition not in ('hourly', 'daily'):
+            raise ValueError("Partition must be 'hourly' or 'daily'.")
+        self.directory = directory
+        self.prefix = prefix
+        self.fmt = fmt
+        self.partition = partition
+        self.heater_vlim = heater_vlim
+        self.compress = compress
+        self.capacity = capacity
+        self.refresh = refresh
+
+        self.log = None
+        self._start = None
+        self._end = None
+        self._threads = []
+        self._locks = {}  # LogLock of each path written by this process
+
+    def __repr__(self):
+        return '<%s(%s, %s)>' % (type(self).__name__, self.directory, self.partition)
+
+    def write(self, rows):
+        rows = np.asarray(rows)
+        while rows.shape[0] > 0:
+            t = rows[0, 0]
+            if self.log is None or not self._start <= t < self._end:
+                self._rotate(t)
+            n = max(np.searchsorted(rows[:, 0], self._end, side='left'), 1)
+            self.log.write(rows[:n])
+            rows = rows[n:]
+            self._lock_paths()
+
+    def _lock_paths(self):
+        # lock new segments of the current partition
+        for path in self._paths():
+            if path not in self._locks:
+                self._locks[path] = LogLock(path)
+                self._locks[path].acquire()
+
+    def _release_locks(self, paths):
+        for path in paths:
+            lock = self._locks.pop(path, None)
+            if lock:
+                lock.release()
+
+    def _paths(self):
+        if self.log is None:
+            return []
+        elif isinstance(self.log, TextLog):
+            return [self.log.path] if os.path.exists(self.log.path) else []
+        else:
+            return list(self.log.paths)
+
+    def _rotate(self, t):
+        if self.log is None:
+            closed = self._stale_logs(t)
+        elif t >= self._end:
+            closed = self._paths()
+        else:
+            closed = []  # the clock was set back, the partition may be continued
+        self._release_locks(closed)
+
+        self._start, self._end = partition_bounds(t, self.partition)
+        if self.fmt == 'text':
+            # a previous run in the same partition is continued
+            name = self.prefix + time.strftime(TIME_FORMAT, time.localtime(self._start))
+            path = os.path.join(self.directory, name + TEXT_EXTENSION)
+            lock = LogLock(path)
+            if os.path.exists(path + COMPRESSED_EXTENSION) or not lock.acquire():
+                # archived or written by another process
+                path = unique_log_path(self.directory, self.prefix, self._start, TEXT_EXTENSION)
+                lock = LogLock(path)
+                lock.acquire()
+            self._locks[path] = lock
+            self.log = TextLog(path, text_header(self.heater_vlim))
+        else:
+            capacity = self.capacity
+            if capacity is None:
+                capacity = int(math.ceil((self._end - t) / self.refresh)) + 1
+            self.log = SegmentLog(self.directory, self.prefix, self.heater_vlim, capacity)
+
+        if closed:
+            self._archive_in_background(closed)
+
+    def _stale_logs(self, t):
+        """
+        Returns logs of partitions before time `t` which are not archived and
+        not written by another process.
+        """
+        start, _ = partition_bounds(t, self.partition)
+        stale = []
+        for name in sorted(os.listdir(self.directory)):
+            parts = split_log_name(name, self.prefix)
+            if parts is None or parts[0] >= start:
+                continue
+            path = os.path.join(self.directory, name)
+            if (self.compress and not parts[2]) or not os.path.exists(rollup_path(path)):
+                if not parts[2] and log_in_use(path):
+                    logger.debug('Log %s is written by another process.', path)
+                    continue
+                stale.append(path)
+        return stale
+
+    def _archive_in_background(self, paths):
+        self._threads = [th for th in self._threads if th.is_alive()]
+        thread = threading.Thread(target=archive_logs, args=(paths, self.compress),
+                                  name='LogArchive')
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def wait_archived(self, timeout=None):
+        """Waits until closed partitions are archived."""
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def close(self):
+        """
+        Waits for archiving in progress. The current partition is kept, to
+        be archived by the next run.
+        """
+        self._release_locks(list(self._locks))
+        self.wait_archived()
+
+
+class TemperatureLogWriter(object):
+    """
+    Appends rows of time, temperature, heater and gas flow readings to a log.
+
+    Rows are buffered in memory and written in batches from a background
+    thread, either every `flush_interval` seconds or as soon as `flush_size`
+    rows are pending, whichever comes first. Only new rows are written, the
+    log is never rewritten. At most one flush interval of data is lost if
+    the program crashes.
+
+    :param log: :class:`TextLog`, :class:`SegmentLog` or
+        :class:`PartitionedLog` to write to.
+    :param float flush_interval: Maximum time in sec that rows are buffered.
+    :param int flush_size: Maximum number of buffered rows.
+    """
+
+    def __init__(self, log, flush_interval=10, flush_size=600):
+        self.log = log
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self._pending = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run, name='TemperatureLogWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def append(self, row):
+        """
+        Queues a row of time, temperature, heater and gas flow readings for
+        writing. Does not block on file I/O.
+        """
+        with self._cond:
+            if self._closed:
+                raise ValueError('Cannot append to a closed log writer.')
+            self._pending.append(tuple(row))
+            if len(self._pending) >= self.flush_size:
+                self._cond.notify()
+
+    def flush(self):
+        """Writes all pending rows to disk, blocks until done."""
+        with self._cond:
+            rows, self._pending = self._pending, []
+        self._write(rows)
+
+    def close(self):
+        """
+        Writes all pending rows, stops the background thread and closes the
+        log.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.log.close()
+
+    def _run(self):
+        closed = False
+        while not closed:
+            with self._cond:
+                if not (self._closed or len(self._pending) >= self.flush_size):
+                    self._cond.wait(self.flush_interval)
+                rows, self._pending = self._pending, []
+                closed = self._closed
+            try:
+                self._write(rows)
+            except Exception:
+                logger.exception('Could not write to log %s.', self.log)
+
+    def _write(self, rows):
+        if len(rows) == 0:
+            return
+        with self._write_lock:
+            self.log.write(rows)
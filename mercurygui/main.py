@@ -14,15 +14,15 @@ Attribution-NonCommercial-NoDerivs 2.0 UK: England & Wales License.
 from __future__ import division, print_function, absolute_import
 import sys
 import os
-import platform
-import subprocess
-import pkg_resources as pkgr
 import time
+import threading
+import functools
 import numpy as np
 import logging
 from math import ceil, floor
-from qtpy import QtGui, QtCore, QtWidgets, uic
+from qtpy import QtGui, QtCore, QtWidgets
 import matplotlib as mpl
+import matplotlib.style
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import (FigureCanvasQTAgg
                                                 as FigureCanvas,
@@ -30,13 +30,19 @@ from matplotlib.backends.backend_qt5agg import (FigureCanvasQTAgg
                                                 NavigationToolbar)
 
 # local imports
-from mercurygui.feed import MercuryFeed
+from mercurygui.feed import MercuryFeed, MercuryFeedManager
+from mercurygui.history import FeedHistory
+from mercurygui.log_writer import (TemperatureLogWriter, TextLog, SegmentLog,
+                                   PartitionedLog, text_header)
+from mercurygui.log_reader import iter_logs_reversed
+from mercurygui import segment
 from mercurygui.connection_dialog import ConnectionDialog
+from mercurygui.utils.uiloader import load_ui
 from mercurygui.utils.led_indicator_widget import LedIndicator
-from mercurygui.config.main import CONF
+from mercurygui.config.main import CONF, get_instrument_option, set_instrument_option
 
-MPL_STYLE_PATH = pkgr.resource_filename('mercurygui', 'figure_style.mplstyle')
-MAIN_UI_PATH = pkgr.resource_filename('mercurygui', 'main.ui')
+_PACKAGE_DIR = os.path.dirname(os.path.realpath(__file__))
+MPL_STYLE_PATH = os.path.join(_PACKAGE_DIR, 'figure_style.mplstyle')
 
 logger = logging.getLogger(__name__)
 
@@ -84,17 +90,21 @@ class MercuryPlotCanvas(FigureCanvas):
         self.ax1.axis(self.xLim + self.yLim)
         self.ax2.axis(self.xLim + [-0.08, 1.08])
 
+        # data artists are animated: they are excluded from full redraws and
+        # instead blitted on top of the cached axes backgrounds
         self.line_t, = self.ax1.plot(0, 295, '-', linewidth=1.1,
-                                     color=self.GREEN)
+                                     color=self.GREEN, animated=True)
 
         self.fill1 = self.ax2.fill_between([0, ], [0, ],
                                            facecolor=self.LIGHT_BLUE,
-                                           edgecolor=self.BLUE)
+                                           edgecolor=self.BLUE, animated=True)
         self.fill2 = self.ax2.fill_between([0, ], [0, ],
                                            facecolor=self.LIGHT_RED,
-                                           edgecolor=self.RED)
+                                           edgecolor=self.RED, animated=True)
 
-        self.dpts = 1000  # maximum number of data points to plot
+        # cache backgrounds after every full redraw, e.g., on resize
+        self.backgrounds = None
+        self.mpl_connect('draw_event', self._on_draw)
 
         self.setParent(parent)
         self.setStyleSheet("background-color:transparent;")
@@ -104,25 +114,27 @@ class MercuryPlotCanvas(FigureCanvas):
 
         FigureCanvas.updateGeometry(self)
 
-    def update_plot(self, x_data, y_data_t, y_data_g, y_data_h, x_min):
+    def update_plot(self, history, x_min):
 
-        # slice to reduce number of points to `dpts`
-        step_size = max([x_data.shape[0]/self.dpts, 1])
-        step_size = int(step_size)
-        self.current_xdata = x_data[::step_size]
-        self.current_ydata_tmpr = y_data_t[::step_size]
-        self.current_ydata_gflw = y_data_g[::step_size]
-        self.current_ydata_htr = y_data_h[::step_size]
+        # get data within the selected time window, reduced to two points
+        # per pixel of the axes width
+        width = max(int(self.ax1.bbox.width), 1)
+        t_data, y_data_t, y_data_h, y_data_g = history.decimated_window(-x_min * 60, width)
 
-        # set smallest displayed data point to slider value
-        # interpolate if necessary
-        if self.current_xdata[0] < x_min:
-            self.current_xdata[0] = x_min
-            self.current_ydata_tmpr[0] = np.interp(x_min, self.current_xdata[0:1],
-                                                   self.current_ydata_tmpr[0:1])
+        # convert time to minutes and set current time to t = 0
+        if t_data.size > 0:
+            self.current_xdata = (t_data - history.latest_time) / 60
+        else:
+            self.current_xdata = t_data
+        self.current_ydata_tmpr = y_data_t
+        self.current_ydata_gflw = y_data_g
+        self.current_ydata_htr = y_data_h
 
         # update axis limits
         if not self.current_xdata.size == 0:
+            # start at the oldest sample if it lies within the time window,
+            # keeps limits constant between frames
+            x_min = max(x_min, (history.earliest_time - history.latest_time) / 60)
             x_pad_abs = max(self.x_pad * abs(x_min), 1/10000)  # add padding
             x_lim_new = [x_min - x_pad_abs, x_pad_abs]
 
@@ -131,37 +143,18 @@ class MercuryPlotCanvas(FigureCanvas):
         else:
             x_lim_new, y_lim_new = self.xLim, self.yLim
 
+        # update artists in place
         self.line_t.set_data(self.current_xdata, self.current_ydata_tmpr)
-
-        self.fill1.remove()
-        self.fill2.remove()
-
-        self.fill1 = self.ax2.fill_between(self.current_xdata,
-                                           self.current_ydata_gflw, 0,
-                                           facecolor=self.LIGHT_BLUE,
-                                           edgecolor=self.BLUE)
-        self.fill2 = self.ax2.fill_between(self.current_xdata,
-                                           self.current_ydata_htr, 0,
-                                           facecolor=self.LIGHT_RED,
-                                           edgecolor=self.RED)
-
-        if x_lim_new + y_lim_new == self.xLim + self.yLim:
-            # redraw only lines
-
-            for ax in self.figure.axes:
-                # redraw plot backgrounds (to remove old lines)
-                ax.draw_artist(ax.patch)
-                # redraw spines
-                for spine in ax.spines.values():
-                    ax.draw_artist(spine)
-
-            self.ax1.draw_artist(self.line_t)
-            self.ax2.draw_artist(self.fill1)
-            self.ax2.draw_artist(self.fill2)
-
-            self.update()
+        self.fill1.set_verts([self._fill_vertices(self.current_xdata,
+                                                  self.current_ydata_gflw)])
+        self.fill2.set_verts([self._fill_vertices(self.current_xdata,
+                                                  self.current_ydata_htr)])
+
+        if x_lim_new + y_lim_new == self.xLim + self.yLim and self.backgrounds:
+            # restore cached backgrounds and blit only the data artists
+            self._blit_artists()
         else:
-            # redraw the whole plot
+            # redraw the whole plot, this will cache new backgrounds
             self.ax1.axis(x_lim_new + y_lim_new)
             self.ax2.axis(x_lim_new + [-0.08, 1.08])
             self.draw()
@@ -170,17 +163,62 @@ class MercuryPlotCanvas(FigureCanvas):
         self.xLim = x_lim_new
         self.yLim = y_lim_new
 
+    def _on_draw(self, event):
+        """Caches the static axes backgrounds and draws the data on top."""
+        self.backgrounds = [self.copy_from_bbox(ax.bbox) for ax in self.figure.axes]
+        self._blit_artists(restore=False)
+
+    def _blit_artists(self, restore=True):
+        if restore:
+            for background in self.backgrounds:
+                self.restore_region(background)
+
+        self.ax1.draw_artist(self.line_t)
+        self.ax2.draw_artist(self.fill1)
+        self.ax2.draw_artist(self.fill2)
+
+        for ax in self.figure.axes:
+            self.blit(ax.bbox)
+
+    @staticmethod
+    def _fill_vertices(x, y):
+        """Returns the polygon vertices of the area between `y` and zero."""
+        if x.size == 0:
+            return np.zeros((0, 2))
+        verts = np.empty((x.size + 2, 2))
+        verts[0] = x[0], 0
+        verts[1:-1, 0] = x
+        verts[1:-1, 1] = y
+        verts[-1] = x[-1], 0
+        return verts
+
 
 class MercuryMonitorApp(QtWidgets.QMainWindow):
+    """
+    User interface for a single MercuryiTC.
+
+    :param feed: :class:`mercurygui.feed.MercuryFeed` of the instrument.
+    :param str name: Name of the instrument if several are monitored. It is
+        shown in the window title, log files are kept in a subfolder of the
+        same name and the window geometry and connection are stored in the
+        config for this instrument only.
+    :param parent: Parent widget, if embedded in another window.
+    """
 
-    def __init__(self, feed):
-        super(self.__class__, self).__init__()
-        uic.loadUi(MAIN_UI_PATH, self)
+    # chunks of readings from previous log files, see start_backfill
+    _backfill_signal = QtCore.Signal(object)
+
+    def __init__(self, feed, name=None, parent=None):
+        super(self.__class__, self).__init__(parent)
+        load_ui('main', self)
 
         self.feed = feed
+        self.name = name
+        if name:
+            self.setWindowTitle('%s - %s' % (self.windowTitle(), name))
 
         # create popup Widgets
-        self.connection_dialog = ConnectionDialog(self, feed.mercury)
+        self.connection_dialog = ConnectionDialog(self, feed.mercury, name)
         self.readingsWindow = None
 
         # create LED indicator
@@ -205,15 +243,12 @@ class MercuryMonitorApp(QtWidgets.QMainWindow):
         self.toolbar.hide()
         self.toolbar.pan()
 
-        # set up data vectors for plot
-        self.xdata = np.array([])
-        self.xdata_zero = np.array([])
-        self.ydata_tmpr = np.array([])
-        self.ydata_gflw = np.array([])
-        self.ydata_htr = np.array([])
+        # readings for plot are recorded by the feed
+        self.history = self.feed.history
 
         # restore previous window geometry
-        self.restore_geometry()
+        if parent is None:
+            self.restore_geometry()
         # Connect menu bar actions
         self.set_up_menubar()
         # set input validators for all fields
@@ -221,43 +256,59 @@ class MercuryMonitorApp(QtWidgets.QMainWindow):
 
         # check if mercury is connected, connect slots
         self.display_message('Looking for Mercury at %s...' % self.feed.visa_address)
+        self._gui_connected = False
         if self.feed.mercury.connected:
             self.update_gui_connection(connected=True)
 
         # start (stop) updates of GUI when mercury is connected (disconnected)
         # adjust clickable buttons upon connect / disconnect
         self.feed.connected_signal.connect(self.update_gui_connection)
+        # show reconnection attempts and failed connections
+        self.feed.reconnect_signal.connect(self.on_reconnect_attempt)
+        self.feed.notify_signal.connect(self.display_error)
 
         # get new readings when available, send as out signals
         self.feed.new_readings_signal.connect(self.fetch_readings)
         # update plot when new data arrives
         self.feed.new_readings_signal.connect(self.update_plot_data)
-        # check for overheating when new data arrives
-        self.feed.new_readings_signal.connect(self._check_overheat)
+        # show alarms, safety actions are taken by the worker thread
+        self.feed.alarm_signal.connect(self.on_alarm)
 
         # set up logging to file
         self.setup_logging()
 
+        # fill plot with readings from previous log files
+        self._backfill_stop = threading.Event()
+        self._backfill_signal.connect(self._on_backfill)
+        if CONF.get('Logging', 'backfill'):
+            self.start_backfill()
+
 # =================== BASIC UI SETUP ==========================================
 
     def restore_geometry(self):
-        x = CONF.get('Window', 'x')
-        y = CONF.get('Window', 'y')
-        w = CONF.get('Window', 'width')
-        h = CONF.get('Window', 'height')
+        x = get_instrument_option('Window', 'x', self.name)
+        y = get_instrument_option('Window', 'y', self.name)
+        w = get_instrument_option('Window', 'width', self.name)
+        h = get_instrument_option('Window', 'height', self.name)
 
         self.setGeometry(x, y, w, h)
 
     def save_geometry(self):
         geo = self.geometry()
-        CONF.set('Window', 'height', geo.height())
-        CONF.set('Window', 'width', geo.width())
-        CONF.set('Window', 'x', geo.x())
-        CONF.set('Window', 'y', geo.y())
+        set_instrument_option('Window', 'height', geo.height(), self.name)
+        set_instrument_option('Window', 'width', geo.width(), self.name)
+        set_instrument_option('Window', 'x', geo.x(), self.name)
+        set_instrument_option('Window', 'y', geo.y(), self.name)
 
     def exit_(self):
+        self._backfill_stop.set()
+        if self.readingsWindow:
+            self.readingsWindow.exit_()
         self.feed.exit_()
-        self.save_geometry()
+        if self.log_writer:
+            self.log_writer.close()
+        if self.isWindow():
+            self.save_geometry()
         self.deleteLater()
 
     def closeEvent(self, event):
@@ -271,6 +322,7 @@ class MercuryMonitorApp(QtWidgets.QMainWindow):
         self.showLogAction.triggered.connect(self.on_log_clicked)
         self.exitAction.triggered.connect(self.exit_)
         self.readingsAction.triggered.connect(self.on_readings_clicked)
+        self.modulesAction.triggered.connect(self.feed.open_module_dialog)
         self.connectAction.triggered.connect(self.feed.connect)
         self.disconnectAction.triggered.connect(self.feed.disconnect)
         self.updateAddressAction.triggered.connect(self.connection_dialog.open)
@@ -283,6 +335,10 @@ class MercuryMonitorApp(QtWidgets.QMainWindow):
 
     @QtCore.Slot(bool)
     def update_gui_connection(self, connected):
+        if connected == self._gui_connected:
+            return
+        self._gui_connected = connected
+
         if connected:
             self.display_message('Connection established.')
             self.led.setChecked(True)
@@ -328,6 +384,12 @@ class MercuryMonitorApp(QtWidgets.QMainWindow):
             # disconnect update_plot
             self.horizontalSlider.valueChanged.disconnect(self.update_plot)
 
+    @QtCore.Slot(int, bool, object)
+    def on_reconnect_attempt(self, attempt, connected, retry_in):
+        if not connected:
+            self.display_error('Connection lost. Reconnection attempt %s failed, '
+                               'retrying in %.0f sec...' % (attempt, retry_in))
+
     def set_input_validators(self):
         """ Sets validators for input fields"""
         self.t2_edit.setValidator(QtGui.QDoubleValidator())
@@ -344,72 +406,65 @@ class MercuryMonitorApp(QtWidgets.QMainWindow):
     @QtCore.Slot(object)
     def fetch_readings(self, readings):
         """
-        Parses readings for the MercuryMonitorApp and updates UI accordingly
+        Parses readings for the MercuryMonitorApp and updates UI accordingly.
+        Only widgets of fields which are present in `readings` are updated.
         """
         # heater signals
-        self.h1_label.setText('Heater, %s V:' % readings['HeaterVolt'])
-        self.h1_edit.updateValue(readings['HeaterPercent'])
+        if 'HeaterVolt' in readings:
+            self.h1_label.setText('Heater, %s V:' % readings['HeaterVolt'])
+        if 'HeaterPercent' in readings:
+            self.h1_edit.updateValue(readings['HeaterPercent'])
 
-        is_heater_auto = readings['HeaterAuto'] == 'ON'
-        self.h1_edit.setReadOnly(is_heater_auto)
-        self.h1_edit.setEnabled(not is_heater_auto)
-        self.h2_checkbox.setChecked(is_heater_auto)
+        if 'HeaterAuto' in readings:
+            is_heater_auto = readings['HeaterAuto'] == 'ON'
+            self.h1_edit.setReadOnly(is_heater_auto)
+            self.h1_edit.setEnabled(not is_heater_auto)
+            self.h2_checkbox.setChecked(is_heater_auto)
 
         # gas flow signals
-        self.gf1_edit.updateValue(readings['FlowPercent'])
-        self.gf1_label.setText('Gas flow (min = %s%%):' % readings['FlowMin'])
+        if 'FlowPercent' in readings:
+            self.gf1_edit.updateValue(readings['FlowPercent'])
+        if 'FlowMin' in readings:
+            self.gf1_label.setText('Gas flow (min = %s%%):' % readings['FlowMin'])
 
-        is_gf_auto = readings['FlowAuto'] == 'ON'
-        self.gf2_checkbox.setChecked(is_gf_auto)
-        self.gf1_edit.setEnabled(not is_gf_auto)
-        self.gf1_edit.setReadOnly(is_gf_auto)
+        if 'FlowAuto' in readings:
+            is_gf_auto = readings['FlowAuto'] == 'ON'
+            self.gf2_checkbox.setChecked(is_gf_auto)
+            self.gf1_edit.setEnabled(not is_gf_auto)
+            self.gf1_edit.setReadOnly(is_gf_auto)
 
         # temperature signals
-        self.t1_reading.setText('%s K' % round(readings['Temp'], 3))
-        self.t2_edit.updateValue(readings['TempSetpoint'])
-        self.r1_edit.updateValue(readings['TempRamp'])
+        if 'Temp' in readings:
+            self.t1_reading.setText('%s K' % round(readings['Temp'], 3))
+        if 'TempSetpoint' in readings:
+            self.t2_edit.updateValue(readings['TempSetpoint'])
+        if 'TempRamp' in readings:
+            self.r1_edit.updateValue(readings['TempRamp'])
 
-        is_ramp_enable = readings['TempRampEnable'] == 'ON'
-        self.r2_checkbox.setChecked(is_ramp_enable)
+        if 'TempRampEnable' in readings:
+            is_ramp_enable = readings['TempRampEnable'] == 'ON'
+            self.r2_checkbox.setChecked(is_ramp_enable)
 
     @QtCore.Slot(object)
     def update_plot_data(self, readings):
-        # append data for plotting
-        self.xdata = np.append(self.xdata, time.time())
-        self.ydata_tmpr = np.append(self.ydata_tmpr, readings['Temp'])
-        self.ydata_gflw = np.append(self.ydata_gflw, readings['FlowPercent'] / 100)
-        self.ydata_htr = np.append(self.ydata_htr, readings['HeaterPercent'] / 100)
-
-        # prevent data vector from exceeding 86400 entries
-        self.xdata = self.xdata[-86400:]
-        self.ydata_tmpr = self.ydata_tmpr[-86400:]
-        self.ydata_gflw = self.ydata_gflw[-86400:]
-        self.ydata_htr = self.ydata_htr[-86400:]
+        if not any(key in readings for key in FeedHistory.KEYS) or len(self.history) == 0:
+            return
 
-        # convert xData to minutes and set current time to t = 0
-        self.xdata_zero = (self.xdata - max(self.xdata)) / 60
+        # the feed has already added the readings to the history, unless
+        # none of them was read since the latest sample
+        row = tuple(self.history.last(1)[:, 0])
+        if row[0] != self._logged_time:
+            self._logged_time = row[0]
+            self.log_temperature_data(row)
 
         self.update_plot()
 
     @QtCore.Slot()
     def update_plot(self):
 
-        # select data to be plotted
-        x_slice = self.xdata_zero >= -self.horizontalSlider.value()
-        self.current_xdata = self.xdata_zero[x_slice]
-        self.current_ydata_tmpr = self.ydata_tmpr[x_slice]
-        self.current_ydata_gflw = self.ydata_gflw[x_slice]
-        self.current_ydata_htr = self.ydata_htr[x_slice]
-
-        # determine first plotted data point
-        if self.current_xdata.size == 0:
-            x_min = -self.horizontalSlider.value()
-        else:
-            x_min = max(-self.horizontalSlider.value(), self.current_xdata[0])
-
-        # update plot
-        self.canvas.update_plot(self.current_xdata, self.current_ydata_tmpr,
-                                self.current_ydata_gflw, self.current_ydata_htr, x_min)
+        # update plot with data from the last `x_min` minutes
+        x_min = -self.horizontalSlider.value()
+        self.canvas.update_plot(self.history, x_min)
 
         # update label
         self.timeLabel.setText('Show last %s min' % self.horizontalSlider.value())
@@ -419,55 +474,110 @@ class MercuryMonitorApp(QtWidgets.QMainWindow):
     def setup_logging(self):
         """
         Set up logging of temperature history to files.
-        Save temperature history to log file at '~/.CustomXepr/LOG_FILES/'
-        after every 10 min.
+        New readings are appended to log files at '~/.mercurygui/LOG_FILES/'
+        in batches, see :class:`mercurygui.log_writer.TemperatureLogWriter`.
+        By default, a new log is started every day and previous logs are
+        compressed, see :class:`mercurygui.log_writer.PartitionedLog`.
+        Logs of named instruments are kept in a subfolder per instrument.
         """
         # find user home directory
         home_path = os.path.expanduser('~')
         self.logging_path = os.path.join(home_path, '.mercurygui', 'LOG_FILES')
+        if self.name:
+            self.logging_path = os.path.join(self.logging_path, _safe_filename(self.name))
 
-        # create folder '~/.CustomXepr/LOG_FILES' if not present
+        # create folder '~/.mercurygui/LOG_FILES' if not present
         if not os.path.exists(self.logging_path):
             os.makedirs(self.logging_path)
-        # set logging file path
+        # allow queries of the history before the start of the feed
+        self.history.directory = self.logging_path
+        # set path of text log file if logs are not partitioned, a new log
+        # file is created for every new start
         self.log_file = os.path.join(self.logging_path, 'temperature_log ' +
                                      time.strftime("%Y-%m-%d_%H-%M-%S") + '.txt')
 
-        t_save = 10  # time interval to save temperature data in min
-        self.new_file = True  # create new log file for every new start
-        self.save_timer = QtCore.QTimer()
-        self.save_timer.setInterval(t_save*60*1000)
-        self.save_timer.setSingleShot(False)  # set to reoccur
-        self.save_timer.timeout.connect(self.log_temperature_data)
-        self.save_timer.start()
+        # log writer is created with the first reading
+        self.log_writer = None
+        self._logged_time = None
+
+    def start_backfill(self):
+        """
+        Loads readings from previous log files into the history, covering the
+        longest time window of the plot. Files are read in a background
+        thread and added newest first, so that the plot fills in
+        progressively.
+        """
+        t_end = self.history.earliest_time or time.time()
+        t_start = t_end - 60 * self.horizontalSlider.maximum()
+
+        thread = threading.Thread(target=self._load_backfill, name='Backfill',
+                                  args=(self.logging_path, t_start, t_end))
+        thread.daemon = True
+        thread.start()
+
+    def _load_backfill(self, directory, t_start, t_end):
+        try:
+            for columns in iter_logs_reversed(directory, t_start, t_end,
+                                              limit=self.history.capacity):
+                if self._backfill_stop.is_set():
+                    return
+                self._backfill_signal.emit(columns)
+        except Exception:
+            logger.exception('Could not load previous readings from %s.', directory)
+
+    @QtCore.Slot(object)
+    def _on_backfill(self, columns):
+        # chunks arrive newest first and must precede the history
+        if self.history.prepend(columns):
+            self.update_plot()
 
     def save_temperature_data(self, path=None):
+        """
+        Saves the temperature history as tab-separated text file or, if
+        `path` ends with '.mseg', as binary segment.
+        """
         # prompt user for file path if not given
         if path is None:
             text = 'Select path for temperature data file:'
-            path = QtWidgets.QFileDialog.getSaveFileName(caption=text)
+            file_filter = 'Text files (*.txt);;Binary segments (*%s)' % segment.EXTENSION
+            path = QtWidgets.QFileDialog.getSaveFileName(caption=text, filter=file_filter)
             path = path[0]
 
-        if not path.endswith('.txt'):
-            path += '.txt'
+        # columns of time, temperature, heater and gas flow
+        columns = self.history.last()
+        heater_vlim = self.feed.readings.get('HeaterVoltLimit')
 
-        title = 'temperature trace, saved on ' + time.strftime('%d/%m/%Y') + '\n'
-        heater_vlim = self.feed.heater.vlim
-        header = '\t'.join(['Time (sec)', 'Temperature (K)',
-                            'Heater (%% of %sV)' % heater_vlim, 'Gas flow (%)'])
-
-        data_matrix = np.concatenate((self.xdata[:, np.newaxis],
-                                      self.ydata_tmpr[:, np.newaxis],
-                                      self.ydata_htr[:, np.newaxis],
-                                      self.ydata_gflw[:, np.newaxis]), axis=1)
-
-        # noinspection PyTypeChecker
-        np.savetxt(path, data_matrix, delimiter='\t', header=title + header)
-
-    def log_temperature_data(self):
-        # save temperature data to log file
-        if self.feed.mercury.connected:
-            self.save_temperature_data(self.log_file)
+        if path.endswith(segment.EXTENSION):
+            segment.save_segment(path, columns, heater_vlim)
+        else:
+            if not path.endswith('.txt'):
+                path += '.txt'
+            segment.save_text(path, columns, text_header(heater_vlim))
+
+    def log_temperature_data(self, row):
+        # append row of temperature data to log
+        if self.log_writer is None:
+            # read by the worker, without querying the MercuryiTC from here
+            heater_vlim = self.feed.readings.get('HeaterVoltLimit')
+            fmt = CONF.get('Logging', 'format')
+            partition = CONF.get('Logging', 'partition')
+            if partition in ('hourly', 'daily'):
+                log = PartitionedLog(self.logging_path, 'temperature_log ', fmt,
+                                     partition, heater_vlim,
+                                     compress=CONF.get('Logging', 'compress'),
+                                     refresh=self.feed.refresh)
+            elif fmt == 'text':
+                log = TextLog(self.log_file, text_header(heater_vlim))
+            else:
+                log = SegmentLog(self.logging_path, 'temperature_log ', heater_vlim)
+
+            self.log_writer = TemperatureLogWriter(
+                log, flush_interval=CONF.get('Logging', 'flush_interval'),
+                flush_size=CONF.get('Logging', 'flush_size'))
+
+        # readings may still arrive after logging has been stopped on exit
+        if not self.log_writer.closed:
+            self.log_writer.append(row)
 
 # =================== CALLBACKS FOR SETTING CHANGES ===========================
 
@@ -477,67 +587,67 @@ class MercuryMonitorApp(QtWidgets.QMainWindow):
 
         if 3.5 < new_t < 300:
             self.display_message('T_setpoint = %s K' % new_t)
-            self.feed.control.t_setpoint = new_t
+            self.feed.submit('TempSetpoint', new_t)
         else:
             self.display_error('Error: Only temperature setpoints between ' +
                                '3.5 K and 300 K allowed.')
 
     @QtCore.Slot()
     def change_ramp(self):
-        self.feed.control.ramp = self.r1_edit.value()
+        self.feed.submit('TempRamp', self.r1_edit.value())
         self.display_message('Ramp = %s K/min' % self.r1_edit.value())
 
     @QtCore.Slot(bool)
     def change_ramp_auto(self, checked):
         if checked:
-            self.feed.control.ramp_enable = 'ON'
+            self.feed.submit('TempRampEnable', 'ON')
             self.display_message('Ramp is turned ON')
         else:
-            self.feed.control.ramp_enable = 'OFF'
+            self.feed.submit('TempRampEnable', 'OFF')
             self.display_message('Ramp is turned OFF')
 
     @QtCore.Slot()
     def change_flow(self):
-        self.feed.control.flow = self.gf1_edit.value()
+        self.feed.submit('FlowSetpoint', self.gf1_edit.value())
         self.display_message('Gas flow  = %s%%' % self.gf1_edit.value())
 
     @QtCore.Slot(bool)
     def change_flow_auto(self, checked):
         if checked:
-            self.feed.control.flow_auto = 'ON'
+            self.feed.submit('FlowAuto', 'ON')
             self.display_message('Gas flow is automatically controlled.')
             self.gf1_edit.setReadOnly(True)
             self.gf1_edit.setEnabled(False)
         else:
-            self.feed.control.flow_auto = 'OFF'
+            self.feed.submit('FlowAuto', 'OFF')
             self.display_message('Gas flow is manually controlled.')
             self.gf1_edit.setReadOnly(False)
             self.gf1_edit.setEnabled(True)
 
     @QtCore.Slot()
     def change_heater(self):
-        self.feed.control.heater = self.h1_edit.value()
+        self.feed.submit('HeaterPercent', self.h1_edit.value())
         self.display_message('Heater power  = %s%%' % self.h1_edit.value())
 
     @QtCore.Slot(bool)
     def change_heater_auto(self, checked):
         if checked:
-            self.feed.control.heater_auto = 'ON'
+            self.feed.submit('HeaterAuto', 'ON')
             self.display_message('Heater is automatically controlled.')
             self.h1_edit.setReadOnly(True)
             self.h1_edit.setEnabled(False)
         else:
-            self.feed.control.heater_auto = 'OFF'
+            self.feed.submit('HeaterAuto', 'OFF')
             self.display_message('Heater is manually controlled.')
             self.h1_edit.setReadOnly(False)
             self.h1_edit.setEnabled(True)
 
-    @QtCore.Slot(object)
-    def _check_overheat(self, readings):
-        if readings['Temp'] > 310:
-            self.display_error('Over temperature!')
-            self.feed.control.heater_auto = 'OFF'
-            self.feed.control.heater = 0
+    @QtCore.Slot(str, bool, str)
+    def on_alarm(self, name, active, message):
+        if active:
+            self.display_error(message)
+        else:
+            self.display_message('%s cleared.' % name)
 
 # ========================== CALLBACKS FOR MENU BAR ===========================
 
@@ -545,7 +655,7 @@ class MercuryMonitorApp(QtWidgets.QMainWindow):
     def on_readings_clicked(self):
         # create readings overview window if not present
         if self.readingsWindow is None:
-            self.readingsWindow = ReadingsOverview(self.feed.mercury)
+            self.readingsWindow = ReadingsOverview(self.feed)
         # show it
         self.readingsWindow.show()
 
@@ -554,6 +664,8 @@ class MercuryMonitorApp(QtWidgets.QMainWindow):
         """
         Opens directory with log files with current log file selected.
         """
+        import platform
+        import subprocess
 
         if platform.system() == 'Windows':
             os.startfile(self.logging_path)
@@ -563,8 +675,113 @@ class MercuryMonitorApp(QtWidgets.QMainWindow):
             subprocess.Popen(['xdg-open', self.logging_path])
 
 
+class MercuryMultiMonitorApp(QtWidgets.QMainWindow):
+    """
+    Window with one tab of :class:`MercuryMonitorApp` per instrument of a
+    :class:`mercurygui.feed.MercuryFeedManager`.
+    """
+
+    def __init__(self, manager):
+        super(self.__class__, self).__init__()
+        self.manager = manager
+        # the geometry is stored for this set of instruments
+        self.name = ', '.join(manager)
+        self.setWindowTitle('MercuryiTC Monitor')
+
+        self.tabWidget = QtWidgets.QTabWidget(self)
+        self.setCentralWidget(self.tabWidget)
+
+        self.apps = []
+        for name in self.manager:
+            app = MercuryMonitorApp(self.manager[name], name, parent=self.tabWidget)
+            # exit closes the whole window
+            app.exitAction.triggered.disconnect()
+            app.exitAction.triggered.connect(self.close)
+            self.apps.append(app)
+            self.tabWidget.addTab(app, name)
+
+        # show connection state in tab icon
+        self.manager.connected_signal.connect(self._on_connected)
+        for name in self.manager:
+            self._on_connected(name, self.manager[name].mercury.connected)
+
+        self.restore_geometry()
+
+    def restore_geometry(self):
+        self.setGeometry(get_instrument_option('Window', 'x', self.name),
+                         get_instrument_option('Window', 'y', self.name),
+                         get_instrument_option('Window', 'width', self.name),
+                         get_instrument_option('Window', 'height', self.name))
+
+    def save_geometry(self):
+        geo = self.geometry()
+        set_instrument_option('Window', 'height', geo.height(), self.name)
+        set_instrument_option('Window', 'width', geo.width(), self.name)
+        set_instrument_option('Window', 'x', geo.x(), self.name)
+        set_instrument_option('Window', 'y', geo.y(), self.name)
+
+    @QtCore.Slot(str, bool)
+    def _on_connected(self, name, connected):
+        index = list(self.manager).index(name)
+        icon = QtWidgets.QStyle.SP_DialogApplyButton if connected else QtWidgets.QStyle.SP_DialogCancelButton
+        self.tabWidget.setTabIcon(index, self.style().standardIcon(icon))
+
+    def exit_(self):
+        for app in self.apps:
+            app.exit_()
+        self.apps = []
+        self.manager.exit_()
+        self.save_geometry()
+        self.deleteLater()
+
+    def closeEvent(self, event):
+        self.exit_()
+
+
+def _safe_filename(name):
+    """Replaces characters which are not allowed in file names."""
+    return ''.join(c if c.isalnum() or c in ' ._-' else '_' for c in name)
+
+
+class QueryFetcher(QtCore.QObject):
+    """
+    Runs queries of the MercuryiTC through the command queue of the data
+    collection worker of `feed`, so that they neither block the GUI nor
+    interleave with polling. Results are emitted by :attr:`result_signal`
+    with the key of the request and the returned value, or None if the
+    query failed. Requests for a key which is still pending are coalesced,
+    so that a slow instrument does not build up a backlog.
+    """
+
+    result_signal = QtCore.Signal(object, object)
+
+    def __init__(self, feed):
+        super(self.__class__, self).__init__()
+        self.feed = feed
+
+    def fetch(self, key, func):
+        """
+        Calls `func` from the worker thread and emits its result with `key`.
+        """
+        if self.feed.worker is None:
+            self.result_signal.emit(key, None)
+        else:
+            self.feed.worker.submit_call(func, key, callback=functools.partial(self._done, key))
+
+    def _done(self, key, result, error):
+        # called from the worker thread, the signal is queued
+        if error is not None:
+            logger.debug('Query %s failed: %s', key, error)
+        self.result_signal.emit(key, result)
+
+
 # noinspection PyUnresolvedReferences
 class ReadingsTab(QtWidgets.QWidget):
+    """
+    Shows a selectable reading and the alarms of a module. The widgets are
+    created by :meth:`build` when the tab is first shown. Values are set by
+    :meth:`set_reading` and :meth:`set_alarms` and only rendered if changed.
+    """
 
     EXCEPT = ['read', 'write', 'query', 'CAL_INT', 'EXCT_TYPES',
               'TYPES', 'clear_cache']
@@ -576,7 +793,19 @@ class ReadingsTab(QtWidgets.QWidget):
         self.mercury = mercury
 
         self.name = module.nick
-        self.attr = dir(module)
+        self.built = False
+
+        # last shown text of readings and alarms
+        self._values = {}
+        self._alarm = None
+
+    def build(self):
+        """Creates the widgets of the tab, if not done yet."""
+        if self.built:
+            return
+        self.built = True
+
+        self.attr = dir(self.module)
 
         self.gridLayout = QtWidgets.QGridLayout(self)
         self.gridLayout.setContentsMargins(0, 0, 0, 0)
@@ -597,24 +826,32 @@ class ReadingsTab(QtWidgets.QWidget):
         readings = [x for x in self.attr if not (x.startswith('_') or x in self.EXCEPT)]
         self.comboBox.addItems(readings)
 
-        self.comboBox.currentIndexChanged.connect(self.get_reading)
-        self.comboBox.currentIndexChanged.connect(self.get_alarms)
+        # show the cached value until the new one arrives
+        self.comboBox.currentIndexChanged.connect(
+            lambda i: self.lineEdit.setText(self._values.get(self.current_reading(), '')))
 
-        self.get_reading()
-        self.get_alarms()
+    def current_reading(self):
+        """Returns the name of the selected reading."""
+        return self.comboBox.currentText()
 
-    def get_reading(self):
-        """ Gets readings of selected variable in combobox."""
+    def read(self, name):
+        """Queries the reading `name` of the module, blocking."""
+        return getattr(self.module, name)
 
-        reading = getattr(self.module, self.comboBox.currentText())
+    def set_reading(self, name, reading):
+        """Shows the value of reading `name`, None if unknown."""
         if isinstance(reading, tuple):
             reading = ''.join(map(str, reading))
-        reading = str(reading)
-        self.lineEdit.setText(reading)
+        text = '--' if reading is None else str(reading)
 
-    def get_alarms(self):
-        """Gets alarms of associated module."""
+        if self._values.get(name) == text:
+            return
+        self._values[name] = text
+        if self.built and name == self.current_reading():
+            self.lineEdit.setText(text)
 
+    def set_alarms(self, alarms):
+        """Shows the alarms of the module from a dict of all alarms."""
         # get alarms for all modules
         address = self.module.address.split(':')
         short_address = address[1]
@@ -622,19 +859,32 @@ class ReadingsTab(QtWidgets.QWidget):
             short_address = short_address.split('.')
             short_address = short_address[0] + '.loop1'
         try:
-            alarm = self.mercury.alarms[short_address]
-        except KeyError:
+            alarm = alarms[short_address]
+        except (KeyError, TypeError):
             alarm = '--'
 
-        self.label.setText('Alarms: %s' % alarm)
+        if alarm != self._alarm:
+            self._alarm = alarm
+            self.label.setText('Alarms: %s' % alarm)
 
 
 class ReadingsOverview(QtWidgets.QDialog):
+    """
+    Overview of all readings and alarms of the MercuryiTC. Only the selected
+    reading of the current tab and the alarms are queried, every 3 sec and
+    from the data collection thread of `feed`.
+    """
 
-    def __init__(self, mercury):
+    def __init__(self, feed):
         super(self.__class__, self).__init__()
-        self.mercury = mercury
+        self.mercury = feed.mercury
+        self._alarms = None
+
+        self.fetcher = QueryFetcher(feed)
+        self.fetcher.result_signal.connect(self._on_result)
+
         self.setupUi(self)
+        self.tabWidget.currentChanged.connect(self.get_readings)
 
         # refresh readings every 3 sec
         self.timer = QtCore.QTimer()
@@ -651,7 +901,7 @@ class ReadingsOverview(QtWidgets.QDialog):
         self.tabWidget = QtWidgets.QTabWidget(Form)
         self.tabWidget.setObjectName('tabWidget')
 
-        # create a tab with combobox and text box for each module
+        # create a tab for each module, its widgets are created when shown
         self.readings_tabs = []
 
         for module in self.mercury.modules:
@@ -664,31 +914,109 @@ class ReadingsOverview(QtWidgets.QDialog):
         self.tabWidget.setCurrentIndex(0)
         QtCore.QMetaObject.connectSlotsByName(Form)
 
+    def showEvent(self, event):
+        super(self.__class__, self).showEvent(event)
+        self.get_readings()
+
     def get_readings(self):
         """
-        Getting alarms of selected tab and update its selected reading, only
-        if QWidget is not hidden.
+        Requests alarms and the selected reading of the current tab, only if
+        QWidget is not hidden.
         """
-        if self.isVisible():
-            self.tabWidget.currentWidget().get_reading()
-            self.tabWidget.currentWidget().get_alarms()
+        if not self.isVisible() or self.tabWidget.count() == 0:
+            return
+
+        tab = self.tabWidget.currentWidget()
+        if not tab.built:
+            tab.build()
+            tab.comboBox.currentIndexChanged.connect(self.get_readings)
+        if self._alarms is not None:
+            tab.set_alarms(self._alarms)
+
+        index = self.tabWidget.currentIndex()
+        name = tab.current_reading()
+        self.fetcher.fetch((index, name), functools.partial(tab.read, name))
+        self.fetcher.fetch('alarms', lambda: self.mercury.alarms)
+
+    @QtCore.Slot(object, object)
+    def _on_result(self, key, value):
+        if key == 'alarms':
+            self._alarms = value
+            tab = self.tabWidget.currentWidget()
+            if tab is not None and tab.built:
+                tab.set_alarms(value)
+        else:
+            index, name = key
+            self.readings_tabs[index].set_reading(name, value)
+
+    def exit_(self):
+        self.timer.stop()
+        self.close()
+        self.deleteLater()
 
 
 def run():
 
-    from mercuryitc import MercuryITC
+    import argparse
     from mercurygui.config.main import CONF
 
-    mercury_address = CONF.get('Connection', 'VISA_ADDRESS')
-    visa_library = CONF.get('Connection', 'VISA_LIBRARY')
-
-    mercury = MercuryITC(mercury_address, visa_library)
-
-    app = QtWidgets.QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description='User interface for the MercuryiTC.')
+    parser.add_argument('--simulate', action='store_true',
+                        help='run against a simulated MercuryiTC')
+    parser.add_argument('--sim-latency', type=float, default=0.0, metavar='SEC',
+                        help='response delay of the simulated MercuryiTC')
+    parser.add_argument('--sim-dropout', type=float, default=0.0, metavar='RATE',
+                        help='fraction of dropped responses of the simulated MercuryiTC')
+    parser.add_argument('--sim-count', type=int, default=1, metavar='N',
+                        help='number of simulated instruments')
+    parser.add_argument('--refresh', type=float, metavar='SEC',
+                        default=CONF.get('MercuryFeed', 'refresh'),
+                        help='refresh interval of readings')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print import times and check them against the startup budget')
+    args, qt_args = parser.parse_known_args()
+
+    if args.profile_startup:
+        from mercurygui import startup
+        results = startup.profile()
+        print(startup.report(results))
+        sys.exit(1 if any(r['violations'] for r in results) else 0)
+
+    # list of (name, mercury) tuples
+    if args.simulate:
+        from mercurygui.simulator import SimulatedMercuryITC
+        instruments = [('Simulated %s' % (i + 1), SimulatedMercuryITC(
+            'SIM::MERCURYITC%s' % (i + 1), latency=args.sim_latency,
+            dropout_rate=args.sim_dropout)) for i in range(args.sim_count)]
+    else:
+        from mercuryitc import MercuryITC
+
+        instruments = [(item['name'], MercuryITC(item['VISA_ADDRESS'], item.get('VISA_LIBRARY', '')))
+                       for item in CONF.get('Instruments', 'instruments')]
+        if not instruments:
+            mercury_address = CONF.get('Connection', 'VISA_ADDRESS')
+            visa_library = CONF.get('Connection', 'VISA_LIBRARY')
+            instruments = [('MercuryiTC', MercuryITC(mercury_address, visa_library))]
+
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
     app.aboutToQuit.connect(app.deleteLater)
 
-    feed = MercuryFeed(mercury)
-    mercury_gui = MercuryMonitorApp(feed)
+    feed_kwargs = dict(refresh=args.refresh,
+                       periods=CONF.get('MercuryFeed', 'periods'),
+                       delta=CONF.get('MercuryFeed', 'delta'),
+                       deadbands=CONF.get('MercuryFeed', 'deadbands'),
+                       keyframe_interval=CONF.get('MercuryFeed', 'keyframe_interval'),
+                       reconnect=CONF.get('MercuryFeed', 'reconnect'),
+                       connect_timeout=CONF.get('MercuryFeed', 'connect_timeout'),
+                       max_backoff=CONF.get('MercuryFeed', 'max_backoff'),
+                       rules=CONF.get('Alarms', 'rules'))
+
+    if len(instruments) == 1:
+        feed = MercuryFeed(instruments[0][1], **feed_kwargs)
+        mercury_gui = MercuryMonitorApp(feed)
+    else:
+        manager = MercuryFeedManager(instruments, **feed_kwargs)
+        mercury_gui = MercuryMultiMonitorApp(manager)
     mercury_gui.show()
 
     app.exec_()
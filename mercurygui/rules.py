@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+Alarm and interlock rules which are evaluated in the acquisition thread
+right after each poll cycle, see :class:`mercurygui.collector.DataCollector`.
+Safety actions therefore do not depend on how busy the GUI is.
+
+Rules are declared as dicts, for instance in the 'Alarms' section of the
+config file, and compiled once by :class:`RuleEngine`:
+
+    >>> rules = [
+    ...     {'name': 'Over temperature',
+    ...      'when': [{'key': 'Temp', 'op': '>', 'value': 310, 'hysteresis': 1}],
+    ...      'actions': ['heater_off', 'notify']},
+    ...     {'name': 'Heater saturated',
+    ...      'when': [{'key': 'HeaterPercent', 'op': '>', 'value': 80},
+    ...               {'key': 'Temp', 'rate': '<', 'value': 0, 'window': 60}],
+    ...      'for': 300, 'actions': ['notify']},
+    ... ]
+
+A rule has the entries:
+
+- 'name': Name of the rule.
+- 'when': List of conditions which must all hold.
+- 'for': Time in sec for which the conditions must hold before the rule
+  triggers, 0 by default.
+- 'actions': List of 'heater_off', 'notify' or dicts of settings, e.g.
+  ``{'FlowSetpoint': 20}``. Settings are written ahead of all other commands
+  and enforced while the rule is active. With 'notify', listeners are
+  notified when the rule triggers and when it clears.
+- 'message': Text of notifications, the name if not given.
+
+A condition compares the reading `key` with `value` by `op`, one of '>',
+'>=', '<', '<=', '==' and '!='. With `rate` instead of `op`, the rate of
+change of the reading per minute over the last `window` sec is compared
+instead. Once a condition holds, it only clears when the reading is past
+`value` by `hysteresis`, so that noise does not toggle the alarm.
+
+All conditions are evaluated in constant time per sample, amortized for
+rates.
+
+Note: Leave this file free of Qt related imports, so that it can be used
+without a GUI.
+"""
+from __future__ import division, absolute_import
+import operator
+import collections
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+# actions which enforce settings while a rule is active
+ACTIONS = {
+    'heater_off': {'HeaterAuto': 'OFF', 'HeaterPercent': 0},
+}
+
+NOTIFY = 'notify'
+
+
+class Condition(object):
+    """
+    Compiled condition of a rule, see :mod:`mercurygui.rules`.
+
+    :param str key: Key of the reading.
+    :param str op: Comparison operator, see :data:`OPERATORS`.
+    :param value: Threshold.
+    :param float hysteresis: Distance from the threshold at which the
+        condition clears once it holds.
+    :param bool rate: Compare the rate of change per minute.
+    :param float window: Time in sec over which the rate is computed.
+    """
+
+    def __init__(self, key, op, value, hysteresis=0, rate=False, window=60):
+        if op not in OPERATORS:
+            raise ValueError('Unknown operator %r, must be one of %s.' % (op, sorted(OPERATORS)))
+        if hysteresis and op not in ('>', '>=', '<', '<='):
+            raise ValueError('Hysteresis requires a comparison by <, <=, > or >=.')
+
+        self.key = key
+        self.op = op
+        self.value = value
+        self.rate = rate
+        self.window = float(window)
+        self.holds = False
+
+        self._compare = OPERATORS[op]
+        # threshold while the condition holds
+        if op in ('>', '>='):
+            self._hold_value = value - hysteresis
+        elif op in ('<', '<='):
+            self._hold_value = value + hysteresis
+        else:
+            self._hold_value = value
+
+        # samples of (time, value) over the window, for rates
+        self._samples = collections.deque()
+
+    def __repr__(self):
+        name = 'rate(%s)' % self.key if self.rate else self.key
+        return '<%s(%s %s %r)>' % (type(self).__name__, name, self.op, self.value)
+
+    def update(self, readings):
+        """
+        Evaluates the condition for the latest full readings.
+
+        :param dict readings: Readings including their 'Timestamps'.
+        :returns: Whether the condition holds.
+        """
+        try:
+            x = readings[self.key]
+            if self.rate:
+                x = self._rate(x, readings['Timestamps'][self.key])
+            threshold = self._hold_value if self.holds else self.value
+            self.holds = x is not None and bool(self._compare(x, threshold))
+        except (KeyError, TypeError):
+            # not read yet or not comparable
+            self.holds = False
+        return self.holds
+
+    def _rate(self, x, t):
+        samples = self._samples
+        if not samples or t > samples[-1][0]:
+            samples.append((t, x))
+            # keep the newest sample which is at least `window` old
+            while len(samples) > 2 and t - samples[1][0] >= self.window:
+                samples.popleft()
+        if len(samples) < 2:
+            return None
+        (t0, x0), (t1, x1) = samples[0], samples[-1]
+        return (x1 - x0) / (t1 - t0) * 60
+
+
+class Rule(object):
+    """
+    Compiled rule, see :mod:`mercurygui.rules`. Use :func:`compile_rule` to
+    create it from a dict.
+
+    :param str name: Name of the rule.
+    :param conditions: List of :class:`Condition` which must all hold.
+    :param float duration: Time in sec for which the conditions must hold.
+    :param dict settings: Settings to enforce while active.
+    :param bool notify: Notify when the rule triggers or clears.
+    :param str message: Text of notifications.
+    """
+
+    def __init__(self, name, conditions, duration=0, settings=None, notify=False, message=None):
+        self.name = name
+        self.conditions = list(conditions)
+        self.duration = float(duration)
+        self.settings = dict(settings or {})
+        self.notify = notify
+        self.message = message or name
+        self.active = False
+        self._since = None
+
+    def __repr__(self):
+        return '<%s(%r)>' % (type(self).__name__, self.name)
+
+    def check_settings(self, settings):
+        """
+        Checks that the rule only changes the given settings.
+
+        :param settings: Names of the settings which actions may change.
+        :raises: :class:`ValueError` otherwise.
+        """
+        unknown = [key for key in self.settings if key not in settings]
+        if unknown:
+            raise ValueError('Rule %r cannot change %s.' % (self.name, ', '.join(sorted(unknown))))
+
+    def update(self, readings, now):
+        """
+        Evaluates the rule for the latest full readings.
+
+        :param dict readings: Readings including their 'Timestamps'.
+        :param float now: Current time in sec, on a monotonic clock.
+        :returns: True if the rule triggered, False if it cleared and None
+            otherwise.
+        """
+        holds = True
+        for condition in self.conditions:
+            # update all conditions, so that rates see every sample
+            holds = condition.update(readings) and holds
+
+        if not holds:
+            self._since = None
+            if self.active:
+                self.active = False
+                return False
+            return None
+
+        if self._since is None:
+            self._since = now
+        if not self.active and now - self._since >= self.duration:
+            self.active = True
+            return True
+        return None
+
+
+def compile_rule(spec, settings=None):
+    """
+    Compiles a rule declared as dict, see :mod:`mercurygui.rules`.
+
+    :param dict spec: Declaration of the rule.
+    :param settings: Names of the settings which actions may change, any if
+        None.
+    :returns: :class:`Rule`.
+    :raises: :class:`ValueError` for invalid rules.
+    """
+    spec = dict(spec)
+    try:
+        name = spec.pop('name')
+        when = spec.pop('when')
+    except KeyError as e:
+        raise ValueError('Rule %r requires the entry %s.' % (spec, e))
+    duration = spec.pop('for', 0)
+    actions = spec.pop('actions', ())
+    message = spec.pop('message', None)
+    if spec:
+        raise ValueError('Unknown entries %s of rule %r.' % (sorted(spec), name))
+    if not when:
+        raise ValueError('Rule %r has no conditions.' % name)
+
+    conditions = []
+    for c in when:
+        c = dict(c)
+        if 'rate' in c:
+            c['op'] = c.pop('rate')
+            c['rate'] = True
+        try:
+            conditions.append(Condition(**c))
+        except TypeError:
+            raise ValueError('Invalid condition %r of rule %r.' % (c, name))
+
+    enforced = {}
+    notify = False
+    for action in actions:
+        if action == NOTIFY:
+            notify = True
+        elif isinstance(action, dict):
+            enforced.update(action)
+        elif action in ACTIONS:
+            enforced.update(ACTIONS[action])
+        else:
+            raise ValueError('Unknown action %r of rule %r.' % (action, name))
+
+    rule = Rule(name, conditions, duration, enforced, notify, message)
+    if settings is not None:
+        rule.check_settings(settings)
+    return rule
+
+
+class RuleEngine(object):
+    """
+    Evaluates compiled rules for every new set of readings.
+
+    :param rules: List of rules declared as dicts, see :mod:`mercurygui.rules`.
+    :param settings: Names of the settings which actions may change, any if
+        None.
+    :raises: :class:`ValueError` for invalid rules.
+    """
+
+    def __init__(self, rules=(), settings=None):
+        self.rules = [compile_rule(spec, settings) for spec in rules]
+        names = [rule.name for rule in self.rules]
+        if len(set(names)) < len(names):
+            raise ValueError('Rule names must be unique.')
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __repr__(self):
+        return '<%s(%s)>' % (type(self).__name__, ', '.join(r.name for r in self.rules))
+
+    @property
+    def active(self):
+        """Names of the active rules."""
+        return [rule.name for rule in self.rules if rule.active]
+
+    def check_settings(self, settings):
+        """
+        Checks that the rules only change the given settings, see
+        :meth:`Rule.check_settings`.
+        """
+        for rule in self.rules:
+            rule.check_settings(settings)
+
+    def evaluate(self, readings, now):
+        """
+        Evaluates all rules for the latest full readings.
+
+        :param dict readings: Readings including their 'Timestamps'.
+        :param float now: Current time in sec, on a monotonic clock.
+        :returns: List of (rule, active) of the rules which triggered or
+            cleared.
+        """
+        changes = []
+        for rule in self.rules:
+            change = rule.update(readings, now)
+            if change is not None:
+                changes.append((rule, change))
+        return changes
+
+    def enforced(self, readings, convert=None):
+        """
+        Returns the settings of active rules which differ from `readings`,
+        as dict of key and value.
+
+        :param dict readings: Latest full readings.
+        :param convert: Function of key and value which returns the value as
+            it is read back, e.g. 'OFF' for False. Values are compared as
+            given if None.
+        """
+        settings = {}
+        for rule in self.rules:
+            if rule.active:
+                for key, value in rule.settings.items():
+                    if convert is not None:
+                        value = convert(key, value)
+                    if readings.get(key) != value:
+                        settings[key] = value
+        return settings
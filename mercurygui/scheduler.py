@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Drift-free periodic scheduling on a monotonic clock.
+
+Note: Leave this file free of Qt related imports, so that it can be used
+without a GUI.
+"""
+from __future__ import division, absolute_import
+import math
+import random
+import time
+import threading
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    monotonic = time.monotonic
+except AttributeError:  # Python 2
+    monotonic = time.time
+
+
+class Scheduler(object):
+    """
+    Schedules periodic tasks on a fixed grid of deadlines, spaced by `period`
+    on a monotonic clock. Since deadlines do not depend on when the previous
+    task finished, the time spent on the task is compensated for and the
+    sample period does not drift.
+
+    If a task overruns by one or more periods, the deadlines which have
+    passed are counted as missed and skipped, the next task runs at the
+    following deadline on the grid.
+
+    Achieved sample rate and jitter are computed over the last `window`
+    tasks, see :meth:`stats`.
+
+    :param float period: Period in sec, millisecond resolution is supported.
+    :param int window: Number of tasks to compute statistics over.
+    """
+
+    def __init__(self, period, window=100):
+        self._period = float(period)
+        self._deadline = None
+        self._interrupt = threading.Event()
+
+        self.missed = 0
+        self._starts = collections.deque(maxlen=window)
+        self._lateness = collections.deque(maxlen=window)
+
+    @property
+    def period(self):
+        return self._period
+
+    @period.setter
+    def period(self, value):
+        self._period = float(value)
+        # start a new grid with the next task
+        self._deadline = None
+
+    def reset(self):
+        """Starts a new grid of deadlines and clears all statistics."""
+        self._deadline = None
+        self.missed = 0
+        self._starts.clear()
+        self._lateness.clear()
+
+    def wait(self):
+        """
+        Blocks until the next deadline. The first call after creation or
+        :meth:`reset` returns immediately and starts the grid.
+
+        :returns: True when the deadline is reached, False if interrupted by
+            :meth:`interrupt`.
+        """
+        now = monotonic()
+        if self._deadline is None:
+            self._deadline = now
+        elif now < self._deadline:
+            if self.sleep(self._deadline - now):
+                return False
+            now = monotonic()
+
+        # skip deadlines which have passed while the last task overran
+        skipped = int(math.floor((now - self._deadline) / self._period))
+        if skipped > 0:
+            self.missed += skipped
+            self._deadline += skipped * self._period
+            logger.debug('Missed %s deadline(s) of %s sec.', skipped, self._period)
+
+        self._starts.append(now)
+        self._lateness.append(now - self._deadline)
+        self._deadline += self._period
+        return True
+
+    def sleep(self, duration):
+        """
+        Sleeps for `duration` sec or until interrupted.
+
+        :returns: True if interrupted, False otherwise.
+        """
+        interrupted = self._interrupt.wait(max(duration, 0))
+        self._interrupt.clear()
+        return interrupted
+
+    def interrupt(self):
+        """Interrupts a pending :meth:`wait` or :meth:`sleep` call."""
+        self._interrupt.set()
+
+    def stats(self):
+        """
+        Returns timing statistics of the recent tasks as dict with entries:
+
+        - 'period': scheduled period in sec
+        - 'rate': achieved sample rate in Hz
+        - 'jitter': standard deviation of the intervals between tasks in sec
+        - 'max_lateness': maximum delay of a task after its deadline in sec
+        - 'missed': number of missed deadlines since the last reset
+        """
+        starts = list(self._starts)
+        lateness = list(self._lateness)
+        intervals = [t1 - t0 for t0, t1 in zip(starts[:-1], starts[1:])]
+
+        rate = jitter = float('nan')
+        if intervals:
+            mean = sum(intervals) / len(intervals)
+            rate = 1 / mean if mean > 0 else float('inf')
+            jitter = math.sqrt(sum((i - mean)**2 for i in intervals) / len(intervals))
+
+        return {
+            'period': self._period,
+            'rate': rate,
+            'jitter': jitter,
+            'max_lateness': max(lateness) if lateness else float('nan'),
+            'missed': self.missed,
+        }
+
+
+class Backoff(object):
+    """
+    Exponentially growing delays between retries, e.g. of reconnection
+    attempts. Every delay is randomised by up to `jitter` times its value, so
+    that several clients which lost their connection at the same time do not
+    retry in lockstep.
+
+    :param float initial: First delay in sec.
+    :param float maximum: Maximum delay in sec.
+    :param float factor: Growth factor of the delay after every attempt.
+    :param float jitter: Relative random spread of the delays, between 0 and 1.
+    """
+
+    def __init__(self, initial=0.5, maximum=30.0, factor=2.0, jitter=0.5, seed=None):
+        self.initial = float(initial)
+        self.maximum = float(maximum)
+        self.factor = float(factor)
+        self.jitter = float(jitter)
+        self._random = random.Random(seed)
+        self.attempts = 0
+
+    def reset(self):
+        """Restarts with the initial delay."""
+        self.attempts = 0
+
+    def next_delay(self):
+        """Returns the delay before the next attempt and counts the attempt."""
+        # limit the exponent, the delay is capped at maximum anyway
+        delay = min(self.initial * self.factor**min(self.attempts, 64), self.maximum)
+        self.attempts += 1
+        # spread delays in [delay * (1 - jitter), delay]
+        return delay * (1 - self.jitter * self._random.random())
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Binary columnar segment format for temperature logs.
+
+A segment file starts with a header block of :data:`HEADER_SIZE` bytes:
+
+- 8 bytes magic string :data:`MAGIC`
+- little-endian uint64: number of valid rows
+- little-endian uint32: length of the JSON header
+- JSON header with the field names, units, data type, capacity in rows,
+  heater voltage limit and creation time, padded with zeros
+
+The header block is followed by one fixed-width column per field, each
+holding `capacity` little-endian float64 values. Columns can therefore be
+mapped into memory with :class:`numpy.memmap` and read without parsing or
+copying. Rows are appended by writing to the end of each column and then
+updating the row count, so that a partially written batch is never read.
+
+Note: Leave this file free of Qt related imports, so that it can be used
+without a GUI.
+"""
+from __future__ import division, absolute_import
+import os
+import json
+import struct
+import time
+import numpy as np
+
+MAGIC = b'MERCSEG1'
+HEADER_SIZE = 4096
+EXTENSION = '.mseg'
+
+FIELDS = ('time', 'temp', 'heater', 'gasflow')
+UNITS = ('s', 'K', 'fraction of heater vlim', 'fraction of max flow')
+DTYPE = '<f8'
+
+_NROWS = struct.Struct('<Q')
+_JSON_LEN = struct.Struct('<I')
+_NROWS_OFFSET = len(MAGIC)
+_JSON_OFFSET = _NROWS_OFFSET + _NROWS.size + _JSON_LEN.size
+
+
+def read_header(f):
+    """
+    Reads the header of an open segment file.
+
+    :returns: Tuple of the number of valid rows and the JSON header as dict.
+    :raises: :class:`ValueError` if the file is not a segment file.
+    """
+    f.seek(0)
+    block = f.read(HEADER_SIZE)
+    if len(block) < HEADER_SIZE or not block.startswith(MAGIC):
+        raise ValueError('Not a temperature log segment.')
+
+    nrows, = _NROWS.unpack_from(block, _NROWS_OFFSET)
+    json_len, = _JSON_LEN.unpack_from(block, _NROWS_OFFSET + _NROWS.size)
+    header = json.loads(block[_JSON_OFFSET:_JSON_OFFSET + json_len].decode('utf-8'))
+    return nrows, header
+
+
+class SegmentWriter(object):
+    """
+    Creates a new segment file with room for `capacity` rows and appends rows
+    to it.
+
+    :param str path: Path of the new segment file.
+    :param int capacity: Maximum number of rows.
+    :param float heater_vlim: Heater voltage limit in V, stored in the header.
+    :param fields: Names of the columns.
+    :param units: Units of the columns.
+    """
+
+    def __init__(self, path, capacity=86400, heater_vlim=None, fields=FIELDS,
+                 units=UNITS):
+        self.path = path
+        self.capacity = int(capacity)
+        self.fields = tuple(fields)
+        self.nrows = 0
+
+        header = {'fields': self.fields, 'units': tuple(units), 'dtype': DTYPE,
+                  'capacity': self.capacity, 'heater_vlim': heater_vlim,
+                  'created': time.time()}
+        header = json.dumps(header).encode('utf-8')
+        if _JSON_OFFSET + len(header) > HEADER_SIZE:
+            raise ValueError('Segment header too large.')
+
+        block = bytearray(HEADER_SIZE)
+        block[:len(MAGIC)] = MAGIC
+        _NROWS.pack_into(block, _NROWS_OFFSET, 0)
+        _JSON_LEN.pack_into(block, _NROWS_OFFSET + _NROWS.size, len(header))
+        block[_JSON_OFFSET:_JSON_OFFSET + len(header)] = header
+
+        with open(self.path, 'wb') as f:
+            f.write(block)
+            # reserve space for all columns
+            f.truncate(HEADER_SIZE + len(self.fields) * self.capacity * 8)
+
+    @property
+    def full(self):
+        return self.nrows >= self.capacity
+
+    def append(self, rows):
+        """
+        Appends rows of time, temperature, heater and gas flow readings.
+
+        :param rows: Array-like of shape ``(n, len(fields))``.
+        :returns: Number of rows written. This is less than `n` if the
+            segment is full.
+        """
+        rows = np.asarray(rows, dtype=DTYPE).reshape(-1, len(self.fields))
+        n = min(rows.shape[0], self.capacity - self.nrows)
+        if n == 0:
+            return 0
+
+        with open(self.path, 'r+b') as f:
+            for i in range(len(self.fields)):
+                f.seek(HEADER_SIZE + (i * self.capacity + self.nrows) * 8)
+                f.write(np.ascontiguousarray(rows[:n, i]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+            # commit rows only after data has been written
+            self.nrows += n
+            f.seek(_NROWS_OFFSET)
+            f.write(_NROWS.pack(self.nrows))
+            f.flush()
+            os.fsync(f.fileno())
+
+        return n
+
+
+class Segment(object):
+    """
+    Read-only view of a segment file. Columns are memory-mapped, no data is
+    read until it is accessed.
+
+    :param str path: Path of the segment file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.nrows, self.header = read_header(f)
+
+        self.fields = tuple(self.header['fields'])
+        self.units = tuple(self.header['units'])
+        self.heater_vlim = self.header['heater_vlim']
+        capacity = self.header['capacity']
+
+        if capacity == 0 or self.nrows == 0:
+            self.columns = np.zeros((len(self.fields), 0), dtype=self.header['dtype'])
+        else:
+            data = np.memmap(path, dtype=self.header['dtype'], mode='r',
+                             offset=HEADER_SIZE, shape=(len(self.fields), capacity))
+            self.columns = data[:, :self.nrows]
+
+    def __len__(self):
+        return self.nrows
+
+    def field(self, name):
+        """Returns a memory-mapped view of the column `name`."""
+        return self.columns[self.fields.index(name)]
+
+
+def save_text(path, columns, header):
+    """
+    Exports columns of readings as a tab-separated text file.
+
+    :param str path: Path of the text file.
+    :param columns: Array of shape ``(len(FIELDS), n)``.
+    :param str header: File header, see :func:`mercurygui.log_writer.text_header`.
+    """
+    # noinspection PyTypeChecker
+    np.savetxt(path, np.asarray(columns).T, delimiter='\t', header=header)
+
+
+def save_segment(path, columns, heater_vlim=None):
+    """
+    Exports columns of readings as a single binary segment.
+
+    :param str path: Path of the segment file.
+    :param columns: Array of shape ``(len(FIELDS), n)``.
+    :param float heater_vlim: Heater voltage limit in V.
+    """
+    columns = np.asarray(columns)
+    writer = SegmentWriter(path, capacity=columns.shape[1], heater_vlim=heater_vlim)
+    writer.append(columns.T)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Dialog to select the temperature, gas flow and heater modules of the data
+feed, see :class:`mercurygui.feed.MercuryFeed`.
+"""
+from __future__ import division, absolute_import
+from qtpy import QtCore, QtWidgets
+
+from mercurygui.config.main import get_instrument_option, set_instrument_option
+from mercurygui.collector import find_modules
+from mercurygui.utils.uiloader import load_ui
+
+
+class SensorDialog(QtWidgets.QDialog):
+    """
+    Provides a user dialog to select the modules for the feed.
+
+    :param mercury_modules: Modules of the MercuryiTC.
+    :param str name: Name of the instrument if several are monitored. The
+        selection is stored for this instrument only.
+    """
+
+    accepted = QtCore.Signal(object)
+
+    def __init__(self, mercury_modules, name=None):
+        super(self.__class__, self).__init__()
+        load_ui('module_dialog', self)
+
+        self.name = name
+
+        found = find_modules(mercury_modules)
+        self.temp_modules = [i for i, _ in found['temperature']]
+        self.gas_modules = [i for i, _ in found['gasflow']]
+        self.heat_modules = [i for i, _ in found['heater']]
+        temp_modules_nick = [nick for _, nick in found['temperature']]
+        gas_modules_nick = [nick for _, nick in found['gasflow']]
+        heat_modules_nick = [nick for _, nick in found['heater']]
+
+        self.modNumbers = {}
+
+        self.comboBox.addItems(temp_modules_nick)
+        self.comboBox_2.addItems(gas_modules_nick)
+        self.comboBox_3.addItems(heat_modules_nick)
+
+        # get default modules
+        self.comboBox.setCurrentIndex(get_instrument_option('MercuryFeed', 'temperature_module', name))
+        self.comboBox_2.setCurrentIndex(get_instrument_option('MercuryFeed', 'gasflow_module', name))
+        self.comboBox_3.setCurrentIndex(get_instrument_option('MercuryFeed', 'heater_module', name))
+
+        self.modNumbers['temperature'] = self.temp_modules[self.comboBox.currentIndex()]
+        self.modNumbers['gasflow'] = self.gas_modules[self.comboBox_2.currentIndex()]
+        self.modNumbers['heater'] = self.heat_modules[self.comboBox_3.currentIndex()]
+
+        self.buttonBox.accepted.connect(self._on_accept)
+
+    def _on_accept(self):
+        self.modNumbers['temperature'] = self.temp_modules[self.comboBox.currentIndex()]
+        self.modNumbers['gasflow'] = self.gas_modules[self.comboBox_2.currentIndex()]
+        self.modNumbers['heater'] = self.heat_modules[self.comboBox_3.currentIndex()]
+
+        # update default modules
+        set_instrument_option('MercuryFeed', 'temperature_module', self.comboBox.currentIndex(),
+                              self.name)
+        set_instrument_option('MercuryFeed', 'gasflow_module', self.comboBox_2.currentIndex(),
+                              self.name)
+        set_instrument_option('MercuryFeed', 'heater_module', self.comboBox_3.currentIndex(),
+                              self.name)
+
+        self.accepted.emit(self.modNumbers)
@@ -0,0 +1,649 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated MercuryiTC for offline development, benchmarking and testing.
+
+:class:`SimulatedInstrument` implements the SCPI dialect of the MercuryiTC
+for temperature, heater and auxiliary (gas flow) modules and a simple thermal
+model of a single cryostat stage. It can be used in two ways:
+
+- :class:`SimulatedMercuryITC` is a drop-in replacement for
+  :class:`mercuryitc.MercuryITC` which talks to the simulated instrument
+  in-process:
+
+    >>> from mercurygui.simulator import SimulatedMercuryITC
+    >>> from mercurygui import MercuryFeed
+    >>> m = SimulatedMercuryITC(latency=0.005)
+    >>> feed = MercuryFeed(m)
+
+- :class:`SimulatorServer` serves the simulated instrument over a local TCP
+  socket, so that the real driver can connect to it with a VISA address such
+  as 'TCPIP0::127.0.0.1::7020::SOCKET'. Run ``python -m mercurygui.simulator``
+  to start a standalone server.
+
+Both support injecting network latency and dropped responses.
+
+Note: Leave this file free of Qt related imports, so that it can be used
+without a GUI.
+"""
+from __future__ import division, print_function, absolute_import
+import time
+import random
+import threading
+import collections
+import logging
+
+try:
+    import socketserver
+except ImportError:  # Python 2
+    import SocketServer as socketserver
+
+from mercurygui.utils.scpi import to_float, to_signal
+
+logger = logging.getLogger(__name__)
+
+try:
+    monotonic = time.monotonic
+except AttributeError:  # Python 2
+    monotonic = time.time
+
+# module layout as list of (type, uid, nick), every TEMP module also gets a
+# control loop which is listed right after it in `modules` of the simulated
+# MercuryITC
+DEFAULT_LAYOUT = (
+    ('AUX', 'DB5.A1', 'Needle valve'),
+    ('HTR', 'DB6.H1', 'Heater'),
+    ('TEMP', 'DB6.T1', 'Sample'),
+)
+
+
+# =============================================================================
+# Thermal model
+# =============================================================================
+
+class ThermalModel(object):
+    """
+    Lumped thermal model of a cryostat stage with a heater, cooled by a gas
+    flow through a needle valve and warmed by a heat leak from the
+    environment. The control loop emulates the automatic heater (PI control)
+    and gas flow modes of the MercuryiTC, including setpoint ramps.
+
+    The model is advanced in real time, scaled by `time_scale`.
+    """
+
+    def __init__(self, temp=295.0, heat_capacity=20.0, heater_power=10.0,
+                 flow_conductance=1.0, leak_conductance=0.02, base_temp=4.2,
+                 env_temp=300.0, time_scale=1.0, noise=0.002, seed=None):
+        self.heat_capacity = heat_capacity  # J/K
+        self.heater_power = heater_power  # W at 100 %
+        self.flow_conductance = flow_conductance  # W/K at 100 % flow
+        self.leak_conductance = leak_conductance  # W/K
+        self.base_temp = base_temp
+        self.env_temp = env_temp
+        self.time_scale = time_scale
+        self.noise = noise
+
+        self.temp = temp
+        self.target = temp  # setpoint including ramp
+
+        # control loop settings
+        self.t_setpoint = temp
+        self.ramp = 1.0  # K/min
+        self.ramp_enable = 'OFF'
+        self.heater_auto = 'ON'
+        self.heater = 0.0  # percent
+        self.flow_auto = 'ON'
+        self.flow = 5.0  # percent
+        self.gmin = 1.0  # percent
+
+        self.p_gain = 20.0  # percent / K
+        self.i_gain = 0.2  # percent / (K s)
+        self._integral = 0.0
+
+        self._random = random.Random(seed)
+        self._t_last = monotonic()
+
+    def advance(self):
+        """Integrates the model up to the current time."""
+        now = monotonic()
+        dt = (now - self._t_last) * self.time_scale
+        self._t_last = now
+
+        step = max(0.5, dt / 1000)
+        while dt > 0:
+            self._step(min(step, dt))
+            dt -= step
+
+    def _step(self, dt):
+        # move target towards setpoint
+        if self.ramp_enable == 'ON':
+            max_change = abs(self.ramp) / 60 * dt
+            delta = self.t_setpoint - self.target
+            self.target += max(-max_change, min(delta, max_change))
+        else:
+            self.target = self.t_setpoint
+
+        error = self.target - self.temp
+
+        if self.heater_auto == 'ON':
+            self._integral += error * dt
+            # prevent integral windup
+            i_max = 100 / self.i_gain
+            self._integral = max(0.0, min(self._integral, i_max))
+            self.heater = self.p_gain * error + self.i_gain * self._integral
+            self.heater = max(0.0, min(self.heater, 100.0))
+
+        if self.flow_auto == 'ON':
+            # open needle valve further when above target
+            self.flow = self.gmin + 2.0 + max(0.0, -error) * 10.0
+            self.flow = max(self.gmin, min(self.flow, 100.0))
+
+        power = (self.heater_power * self.heater / 100 -
+                 self.flow_conductance * self.flow / 100 * (self.temp - self.base_temp) +
+                 self.leak_conductance * (self.env_temp - self.temp))
+
+        self.temp += power / self.heat_capacity * dt
+        self.temp = max(self.temp, self.base_temp)
+
+    def read_temp(self):
+        return self.temp + self._random.gauss(0, self.noise)
+
+    @property
+    def slope(self):
+        """Rate of change of the target temperature in K/min."""
+        if self.ramp_enable == 'ON' and self.target != self.t_setpoint:
+            return abs(self.ramp) if self.t_setpoint > self.target else -abs(self.ramp)
+        return 0.0
+
+
+# =============================================================================
+# Simulated instrument
+# =============================================================================
+
+class SimulatedInstrument(object):
+    """
+    Simulated MercuryiTC which handles SCPI commands such as
+    'READ:DEV:DB6.T1:TEMP:SIG:TEMP' and returns the same responses as the
+    real instrument, e.g., 'STAT:DEV:DB6.T1:TEMP:SIG:TEMP:295.1234K'.
+
+    Reading a branch, for instance 'READ:DEV:DB6.T1:TEMP:LOOP', returns all
+    values below it in a single response.
+
+    :param layout: List of modules as tuples of (type, uid, nick) where type
+        is 'TEMP', 'HTR' or 'AUX'. All temperature sensors read the same
+        stage, which is controlled by the loop of the first one.
+    :param kwargs: Parameters of the :class:`ThermalModel`.
+    """
+
+    LOOP_NOUNS = ('LOOP:TSET', 'LOOP:ENAB', 'LOOP:HSET', 'LOOP:FAUT',
+                  'LOOP:FSET', 'LOOP:RSET', 'LOOP:RENA', 'LOOP:HTR', 'LOOP:AUX')
+
+    def __init__(self, layout=DEFAULT_LAYOUT, **kwargs):
+        self.model = ThermalModel(**kwargs)
+        self.layout = tuple(layout)
+        self._lock = threading.RLock()
+
+        # values of settings per module address
+        self._settings = collections.OrderedDict()
+        htr = [uid for type_, uid, _ in self.layout if type_ == 'HTR']
+        aux = [uid for type_, uid, _ in self.layout if type_ == 'AUX']
+        for type_, uid, nick in self.layout:
+            settings = {'NICK': nick}
+            if type_ == 'HTR':
+                settings['VLIM'] = 10.0
+                settings['RES'] = 50.0
+            elif type_ == 'AUX':
+                settings['GMIN'] = self.model.gmin
+            elif type_ == 'TEMP':
+                settings['LOOP:HTR'] = htr[0] if htr else 'None'
+                settings['LOOP:AUX'] = aux[0] if aux else 'None'
+            self._settings['DEV:%s:%s' % (uid, type_)] = settings
+
+        self.control_address = next((a for a in self._settings if a.endswith(':TEMP')), None)
+
+    @property
+    def catalogue(self):
+        return ':'.join(self._settings)
+
+    def alarms(self):
+        """Returns active alarms as dict of module uid and message."""
+        if self.model.temp > 320:
+            return dict((a.split(':')[1], 'Temperature above limit')
+                        for a in self._settings if a.endswith(':TEMP'))
+        return {}
+
+    def handle(self, command):
+        """Handles a single SCPI command and returns the response."""
+        command = command.strip()
+        with self._lock:
+            self.model.advance()
+            try:
+                if command.startswith('READ:'):
+                    return self._read(command[len('READ:'):])
+                elif command.startswith('SET:'):
+                    return self._set(command[len('SET:'):])
+                elif command == '*IDN?':
+                    return 'IDN:OXFORD INSTRUMENTS:MERCURY ITC:SIMULATED:0.0'
+            except (KeyError, ValueError, IndexError):
+                pass
+            return 'STAT:%s:INVALID' % command.split(':', 1)[-1]
+
+    def _split(self, path):
+        """Splits 'DEV:DB6.T1:TEMP:SIG:TEMP' into address and noun."""
+        parts = path.split(':')
+        return ':'.join(parts[:3]), ':'.join(parts[3:])
+
+    def _read(self, path):
+        if path == 'SYS:CAT':
+            return 'STAT:SYS:CAT:%s' % self.catalogue
+        if path == 'SYS:ALRM':
+            alarms = ';'.join('%s\t%s' % item for item in self.alarms().items())
+            return 'STAT:SYS:ALRM:%s' % alarms
+
+        address, noun = self._split(path)
+        values = self._values(address)
+
+        if noun in values:
+            return 'STAT:%s:%s:%s' % (address, noun, values[noun])
+
+        # read a branch
+        prefix = noun + ':'
+        items = ['%s:%s' % (key[len(prefix):], value)
+                 for key, value in values.items() if key.startswith(prefix)]
+        if not items:
+            raise KeyError(noun)
+        return 'STAT:%s:%s:%s' % (address, noun, ':'.join(items))
+
+    def _values(self, address):
+        """Returns all readable values of the module at `address` as strings."""
+        settings = self._settings[address]
+        type_ = address.split(':')[-1]
+        m = self.model
+
+        values = collections.OrderedDict()
+        values['NICK'] = settings['NICK']
+
+        if type_ == 'HTR':
+            volt = settings['VLIM'] * (m.heater / 100) ** 0.5
+            values['VLIM'] = '%.4f' % settings['VLIM']
+            values['RES'] = '%.4f' % settings['RES']
+            values['SIG:VOLT'] = '%.4fV' % volt
+            values['SIG:CURR'] = '%.4fA' % (volt / settings['RES'])
+            values['SIG:POWR'] = '%.4fW' % (volt ** 2 / settings['RES'])
+        elif type_ == 'AUX':
+            values['GMIN'] = '%.4f' % m.gmin
+            values['SIG:PERC'] = '%.4f%%' % m.flow
+        elif type_ == 'TEMP':
+            values['SIG:TEMP'] = '%.4fK' % m.read_temp()
+            values['SIG:SLOP'] = '%.4fK/m' % m.slope
+            if address == self.control_address:
+                values['LOOP:TSET'] = '%.4fK' % m.t_setpoint
+                values['LOOP:ENAB'] = m.heater_auto
+                values['LOOP:HSET'] = '%.4f' % m.heater
+                values['LOOP:FAUT'] = m.flow_auto
+                values['LOOP:FSET'] = '%.4f' % m.flow
+                values['LOOP:RSET'] = '%.4fK/m' % m.ramp
+                values['LOOP:RENA'] = m.ramp_enable
+            else:
+                for noun in self.LOOP_NOUNS[:-2]:
+                    values[noun] = settings.get(noun, 'OFF' if noun in (
+                        'LOOP:ENAB', 'LOOP:FAUT', 'LOOP:RENA') else '0.0000')
+            values['LOOP:HTR'] = settings['LOOP:HTR']
+            values['LOOP:AUX'] = settings['LOOP:AUX']
+
+        return values
+
+    def _set(self, path):
+        parts = path.split(':')
+        address, noun, value = ':'.join(parts[:3]), ':'.join(parts[3:-1]), parts[-1]
+        settings = self._settings[address]
+        type_ = address.split(':')[-1]
+        m = self.model
+
+        on_off = ('ON', 'OFF')
+
+        if noun == 'NICK':
+            settings['NICK'] = value
+        elif type_ == 'HTR' and noun == 'VLIM' and 0 <= to_float(value) <= 40:
+            settings['VLIM'] = to_float(value)
+        elif type_ == 'AUX' and noun == 'GMIN' and 0 <= to_float(value) <= 20:
+            m.gmin = to_float(value)
+        elif type_ == 'TEMP' and noun.startswith('LOOP:') and address != self.control_address:
+            settings[noun] = value
+        elif noun == 'LOOP:TSET' and 0 <= to_float(value) <= 2000:
+            m.t_setpoint = to_float(value)
+        elif noun == 'LOOP:ENAB' and value in on_off:
+            m.heater_auto = value
+        elif noun == 'LOOP:HSET' and 0 <= to_float(value) <= 100:
+            m.heater = to_float(value)
+        elif noun == 'LOOP:FAUT' and value in on_off:
+            m.flow_auto = value
+        elif noun == 'LOOP:FSET' and 0 <= to_float(value) <= 100:
+            m.flow = to_float(value)
+        elif noun == 'LOOP:RSET' and 0 <= to_float(value) <= 100:
+            m.ramp = to_float(value)
+        elif noun == 'LOOP:RENA' and value in on_off:
+            m.ramp_enable = value
+        else:
+            return 'STAT:SET:%s:%s:%s:INVALID' % (address, noun, value)
+
+        return 'STAT:SET:%s:%s:%s:VALID' % (address, noun, value)
+
+
+# =============================================================================
+# Drop-in replacement for mercuryitc.MercuryITC
+# =============================================================================
+
+class _Property(object):
+    """
+    Module property which is read from and written to the instrument with
+    SCPI commands. Cached properties are only read once, as in the driver.
+    """
+
+    def __init__(self, noun, convert=to_float, settable=False, cached=False):
+        self.noun = noun
+        self.convert = convert
+        self.settable = settable
+        self.cached = cached
+
+    def __get__(self, module, owner):
+        if module is None:
+            return self
+        if self.cached and self.noun in module._cache:
+            return module._cache[self.noun]
+
+        resp = module.query('READ:%s:%s' % (module.address, self.noun))
+        prefix = 'STAT:%s:%s:' % (module.address, self.noun)
+        if not resp.startswith(prefix):
+            raise ValueError(resp)
+        value = self.convert(resp[len(prefix):])
+
+        if self.cached:
+            module._cache[self.noun] = value
+        return value
+
+    def __set__(self, module, value):
+        if not self.settable:
+            raise AttributeError("can't set attribute")
+        if self.convert is to_float:
+            value = '%f' % value
+        resp = module.query('SET:%s:%s:%s' % (module.address, self.noun, value))
+        if not resp.endswith(':VALID'):
+            raise ValueError(resp)
+        module._cache.pop(self.noun, None)
+
+
+class SimulatedModule(object):
+
+    nick = _Property('NICK', str, settable=True, cached=True)
+
+    def __init__(self, address, parent):
+        self.address = address
+        self._parent = parent
+        self._cache = {}
+
+    def __repr__(self):
+        return '<%s(%s, %s)>' % (type(self).__name__, self.nick, self._parent)
+
+    def read(self):
+        return self._parent.read()
+
+    def write(self, q):
+        self._parent.write(q)
+
+    def query(self, q):
+        return self._parent.query(q)
+
+    def clear_cache(self):
+        self._cache.clear()
+
+
+class SimulatedHTR(SimulatedModule):
+    vlim = _Property('VLIM', settable=True, cached=True)
+    res = _Property('RES', cached=True)
+    volt = _Property('SIG:VOLT', to_signal)
+    curr = _Property('SIG:CURR', to_signal)
+    powr = _Property('SIG:POWR', to_signal)
+
+
+class SimulatedAUX(SimulatedModule):
+    gmin = _Property('GMIN', settable=True, cached=True)
+    perc = _Property('SIG:PERC', to_signal)
+
+
+class SimulatedTEMP(SimulatedModule):
+    temp = _Property('SIG:TEMP', to_signal)
+    slop = _Property('SIG:SLOP', to_signal)
+
+
+class SimulatedLOOP(SimulatedModule):
+    """Control loop of a temperature module at 'DEV:<uid>:TEMP:LOOP'."""
+    nick = 'LOOP'
+    t_setpoint = _Property('TSET', settable=True)
+    heater_auto = _Property('ENAB', str, settable=True)
+    heater = _Property('HSET', settable=True)
+    flow_auto = _Property('FAUT', str, settable=True)
+    flow = _Property('FSET', settable=True)
+    ramp = _Property('RSET', settable=True)
+    ramp_enable = _Property('RENA', str, settable=True)
+
+
+class _SimulatedResourceManager(object):
+
+    def __init__(self, mercury):
+        self._mercury = mercury
+
+    def list_resources(self):
+        return (self._mercury.visa_address, )
+
+    def close(self):
+        pass
+
+
+class SimulatedMercuryITC(object):
+    """
+    Drop-in replacement for :class:`mercuryitc.MercuryITC` which talks to a
+    :class:`SimulatedInstrument` in-process.
+
+    Every response becomes available `latency` sec after its command was
+    written, so that pipelined commands cost a single round trip as over a
+    real network link. A fraction `dropout_rate` of responses is dropped:
+    reading them raises an :class:`IOError` after `timeout` sec.
+
+    :param instrument: :class:`SimulatedInstrument` to connect to. A new one
+        is created with `kwargs` if not given.
+    """
+
+    def __init__(self, visa_address='SIM::MERCURYITC', visa_library='',
+                 instrument=None, latency=0.0, dropout_rate=0.0, timeout=1.0,
+                 seed=None, **kwargs):
+        self.visa_address = visa_address
+        self.visa_library = visa_library
+        self.instrument = instrument or SimulatedInstrument(seed=seed, **kwargs)
+        self.latency = latency
+        self.dropout_rate = dropout_rate
+        self.timeout = timeout
+
+        # set to False to simulate a broken link
+        self.online = True
+
+        self.rm = _SimulatedResourceManager(self)
+        self.modules = []
+        self.connected = False
+
+        self._responses = collections.deque()
+        self._lock = threading.RLock()
+        self._random = random.Random(seed)
+
+        self.connect()
+
+    def __repr__(self):
+        return '<%s(%s)>' % (type(self).__name__, self.visa_address)
+
+    def connect(self, open_timeout=None):
+        with self._lock:
+            self._responses.clear()
+            if not self.online:
+                # open_timeout in ms as for pyvisa
+                timeout = self.timeout if open_timeout is None else min(self.timeout, open_timeout / 1000)
+                time.sleep(timeout)
+                logger.warning('Could not connect to %s.', self.visa_address)
+                self.connected = False
+                return
+
+            self.connected = True
+            self._init_modules()
+
+    def disconnect(self):
+        with self._lock:
+            self.connected = False
+            self._responses.clear()
+
+    def _init_modules(self):
+        self.modules = []
+        cat = self.query('READ:SYS:CAT')
+        for module in cat.split(':DEV:')[1:]:
+            type_ = module.split(':')[1]
+            address = 'DEV:' + module
+            if type_ == 'TEMP':
+                self.modules.append(SimulatedTEMP(address, self))
+                self.modules.append(SimulatedLOOP(address + ':LOOP', self))
+            elif type_ == 'HTR':
+                self.modules.append(SimulatedHTR(address, self))
+            elif type_ == 'AUX':
+                self.modules.append(SimulatedAUX(address, self))
+
+    def write(self, q):
+        with self._lock:
+            if not self.connected:
+                raise IOError('Not connected to %s.' % self.visa_address)
+            ready = monotonic() + self.latency
+            if not self.online or self._random.random() < self.dropout_rate:
+                self._responses.append((ready, None))
+            else:
+                self._responses.append((ready, self.instrument.handle(q)))
+
+    def read(self):
+        with self._lock:
+            if not self._responses:
+                time.sleep(self.timeout)
+                raise IOError('Timeout reading from %s.' % self.visa_address)
+            ready, resp = self._responses.popleft()
+            if resp is None:
+                time.sleep(self.timeout)
+                raise IOError('Timeout reading from %s.' % self.visa_address)
+            delay = ready - monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            return resp
+
+    def query(self, q):
+        with self._lock:
+            self.write(q)
+            return self.read()
+
+    @property
+    def alarms(self):
+        resp = self.query('READ:SYS:ALRM')
+        value = resp[len('STAT:SYS:ALRM:'):]
+        return dict(s.split('\t') for s in value.split(';') if s)
+
+    def clear_cache(self):
+        for module in self.modules:
+            module.clear_cache()
+
+
+# =============================================================================
+# TCP server
+# =============================================================================
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    """TCP server which can be restarted right away on the same port."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class SimulatorServer(object):
+    """
+    Serves a :class:`SimulatedInstrument` over TCP with newline terminated
+    SCPI commands and responses, like the Ethernet interface of the
+    MercuryiTC.
+
+    :param instrument: Instrument to serve, a new one is created if not given.
+    :param str host: Host to bind to.
+    :param int port: Port to listen on, 0 selects a free port.
+    :param float latency: Delay of each response in sec.
+    :param float dropout_rate: Fraction of commands which are not answered.
+    """
+
+    def __init__(self, instrument=None, host='127.0.0.1', port=7020,
+                 latency=0.0, dropout_rate=0.0, seed=None):
+        self.instrument = instrument or SimulatedInstrument(seed=seed)
+        self.latency = latency
+        self.dropout_rate = dropout_rate
+        self._random = random.Random(seed)
+
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    received = monotonic()
+                    command = line.decode('ascii', 'replace').strip()
+                    if not command:
+                        continue
+                    if server._random.random() < server.dropout_rate:
+                        continue
+                    resp = server.instrument.handle(command)
+                    delay = received + server.latency - monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    self.wfile.write((resp + '\n').encode('ascii'))
+
+        self._server = ThreadingTCPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def visa_address(self):
+        host, port = self._server.server_address[:2]
+        return 'TCPIP0::%s::%s::SOCKET' % (host, port)
+
+    def start(self):
+        """Starts serving in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='SimulatorServer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def run():
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Simulated MercuryiTC.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7020)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='response delay in sec')
+    parser.add_argument('--dropout', type=float, default=0.0,
+                        help='fraction of commands which are not answered')
+    args = parser.parse_args()
+
+    server = SimulatorServer(host=args.host, port=args.port,
+                             latency=args.latency, dropout_rate=args.dropout)
+    print('Serving simulated MercuryiTC at %s' % server.visa_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    run()
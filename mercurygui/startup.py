@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Import time profile of mercurygui.
+
+Every module of :data:`STAGES` is imported in a fresh interpreter, so that
+results do not depend on what is already loaded. The import time is checked
+against :data:`BUDGET` and headless modules must not pull in the GUI stack,
+see :data:`FORBIDDEN`. Print a report with:
+
+    $ mercurygui --profile-startup
+
+The benchmarks in `benchmarks/benchmark.py` check the same budget.
+
+Note: Leave this file free of Qt related imports, so that it can be used
+without a GUI.
+"""
+from __future__ import division, print_function, absolute_import
+import os
+import sys
+import json
+import subprocess
+
+# entry points as (stage, module)
+STAGES = (
+    ('config', 'mercurygui.config.main'),
+    ('headless', 'mercurygui.stream'),
+    ('daemon', 'mercurygui.daemon'),
+    ('feed', 'mercurygui.feed'),
+    ('gui', 'mercurygui.main'),
+)
+
+# heavy dependencies which are reported when imported by a stage
+HEAVY = ('numpy', 'matplotlib', 'qtpy.QtWidgets', 'qtpy.QtCore', 'pyvisa',
+         'mercuryitc', 'pkg_resources', 'distutils')
+
+# maximum import time of each stage in sec
+BUDGET = {
+    'config': 0.1,
+    'headless': 0.15,
+    'daemon': 0.2,
+    'feed': 0.4,
+    'gui': 2.0,
+}
+
+# dependencies which must not be imported by a stage
+FORBIDDEN = {
+    'config': HEAVY,
+    'headless': HEAVY,
+    'daemon': HEAVY,
+    'feed': ('numpy', 'matplotlib', 'qtpy.QtWidgets', 'pyvisa', 'pkg_resources'),
+}
+
+_SCRIPT = """
+import sys, json, timeit
+t0 = timeit.default_timer()
+import %s
+t = timeit.default_timer() - t0
+print(json.dumps({'time': t, 'heavy': [m for m in %r if m in sys.modules]}))
+"""
+
+
+def _env():
+    # make sure the child imports this copy of mercurygui
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([root] + [p for p in [env.get('PYTHONPATH')] if p])
+    return env
+
+
+def measure_import(module, repeat=3):
+    """
+    Imports `module` in `repeat` fresh interpreters.
+
+    :returns: Tuple of the fastest import time in sec and the list of
+        :data:`HEAVY` dependencies which were imported.
+    """
+    times = []
+    heavy = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', _SCRIPT % (module, HEAVY)],
+                                         env=_env())
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        times.append(result['time'])
+        heavy = result['heavy']
+    return min(times), heavy
+
+
+def slowest_imports(module, n=10):
+    """
+    Returns the `n` imports with the largest own import time when importing
+    `module`, as list of (module, time in sec). Requires Python 3.7.
+    """
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                            stderr=subprocess.PIPE, env=_env())
+    _, stderr = proc.communicate()
+
+    imports = []
+    for line in stderr.decode().splitlines():
+        # lines of 'import time: self [us] | cumulative | imported package'
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        try:
+            imports.append((parts[2].strip(), int(parts[0]) / 1e6))
+        except (ValueError, IndexError):
+            continue  # header
+    imports.sort(key=lambda x: x[1], reverse=True)
+    return imports[:n]
+
+
+def profile(repeat=3):
+    """
+    Measures the import time of all :data:`STAGES`.
+
+    :returns: List of dicts with entries 'stage', 'module', 'time', 'budget',
+        'heavy' and 'violations'.
+    """
+    results = []
+    for stage, module in STAGES:
+        t, heavy = measure_import(module, repeat)
+        violations = []
+        if t > BUDGET[stage]:
+            violations.append('import time %.0f ms exceeds budget of %.0f ms' % (
+                t * 1000, BUDGET[stage] * 1000))
+        forbidden = [m for m in heavy if m in FORBIDDEN.get(stage, ())]
+        if forbidden:
+            violations.append('imports %s' % ', '.join(forbidden))
+        results.append({'stage': stage, 'module': module, 'time': t,
+                        'budget': BUDGET[stage], 'heavy': heavy,
+                        'violations': violations})
+    return results
+
+
+def report(results=None, n_slowest=10):
+    """
+    Returns a text report of import times, see :func:`profile`.
+    """
+    results = profile() if results is None else results
+
+    lines = ['Import time in a fresh interpreter (budget):']
+    for r in results:
+        lines.append('  %-9s %-24s %7.1f ms (%4.0f ms)  %s' % (
+            r['stage'], r['module'], r['time'] * 1000, r['budget'] * 1000,
+            ', '.join(r['heavy'])))
+
+    if sys.version_info >= (3, 7) and n_slowest:
+        lines.append('')
+        lines.append('Slowest imports of %s:' % STAGES[-1][1])
+        for name, t in slowest_imports(STAGES[-1][1], n_slowest):
+            lines.append('  %-40s %7.1f ms' % (name, t * 1000))
+
+    violations = ['%s: %s' % (r['stage'], v) for r in results for v in r['violations']]
+    lines.append('')
+    if violations:
+        lines.append('Budget exceeded:')
+        lines.extend('  ' + v for v in violations)
+    else:
+        lines.append('All stages within budget.')
+    return '\n'.join(lines)
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Consume readings of a data feed without a Qt event loop.
+
+:class:`HeadlessFeed` runs a :class:`mercurygui.collector.DataCollector` in a
+background thread without any Qt dependency. Readings of a
+:class:`HeadlessFeed` or a :class:`mercurygui.feed.MercuryFeed` can be
+consumed with a blocking iterator:
+
+    >>> from mercurygui.stream import HeadlessFeed
+    >>> feed = HeadlessFeed(mercury, refresh=0.25)
+    >>> for readings in feed.iter():
+    ...     print(readings['Temp'])
+
+or with asyncio on Python 3:
+
+    >>> async for readings in feed.aiter():
+    ...     print(readings['Temp'])
+    >>> readings = await feed.next_reading()
+
+All consumers share the acquisition of the feed. Each iterator has its own
+bounded queue: if a consumer falls behind, the oldest readings are dropped.
+
+Note: Leave this file free of Qt related imports, so that it can be used
+without a GUI.
+"""
+from __future__ import division, absolute_import
+import math
+import threading
+import collections
+import logging
+
+try:
+    from queue import Empty
+except ImportError:  # Python 2
+    from Queue import Empty
+
+from mercurygui.collector import DataCollector, select_modules, merge_readings, WRITE
+from mercurygui.scheduler import monotonic
+
+logger = logging.getLogger(__name__)
+
+
+class FeedClosedError(Exception):
+    """Raised when waiting for readings from a closed feed or queue."""
+
+
+class ReadingsQueue(object):
+    """
+    Thread-safe bounded queue of readings which can be iterated over.
+    Iteration blocks until new readings arrive and stops when the queue is
+    closed. When full, the oldest readings are dropped.
+
+    :param int maxsize: Maximum number of queued readings.
+    :param on_close: Callback when the queue is closed.
+    """
+
+    def __init__(self, maxsize=100, on_close=None):
+        self._queue = collections.deque(maxlen=max(int(maxsize), 1))
+        self._cond = threading.Condition()
+        self._on_close = on_close
+        self.closed = False
+        self.dropped = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self.get()
+        except FeedClosedError:
+            raise StopIteration
+
+    next = __next__  # Python 2
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, readings):
+        """Adds readings to the queue, never blocks."""
+        with self._cond:
+            if self.closed:
+                return
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(readings)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Returns the oldest queued readings, waits for new readings if empty.
+
+        :param float timeout: Maximum time to wait in sec, forever if None.
+        :raises: :class:`queue.Empty` on timeout, :class:`FeedClosedError` if
+            the queue is closed and empty.
+        """
+        end = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            while not self._queue:
+                if self.closed:
+                    raise FeedClosedError('Readings queue is closed.')
+                remaining = None if end is None else end - monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise Empty()
+                self._cond.wait(remaining)
+            return self._queue.popleft()
+
+    def close(self):
+        """Stops receiving readings, queued readings can still be read."""
+        with self._cond:
+            if self.closed:
+                return
+            self.closed = True
+            self._cond.notify_all()
+        if self._on_close:
+            self._on_close(self)
+
+
+class ReadingsPublisher(object):
+    """
+    Mixin which distributes readings to blocking and asyncio consumers. The
+    data feed calls :meth:`_publish` with new readings from its acquisition
+    thread.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ReadingsPublisher, self).__init__(*args, **kwargs)
+        self._consumers = []
+        self._consumers_lock = threading.Lock()
+
+    def iter(self, maxsize=100):
+        """
+        Returns a :class:`ReadingsQueue` which receives all new readings and
+        can be iterated over. Close it when done.
+
+        :param int maxsize: Number of readings to buffer.
+        """
+        queue = ReadingsQueue(maxsize, on_close=self._remove_consumer)
+        self._add_consumer(queue)
+        return queue
+
+    def aiter(self, maxsize=100):
+        """
+        Returns an asynchronous iterator over new readings, see
+        :class:`mercurygui.aio.AsyncReadingsQueue`. Readings are handed over
+        to the event loop which is running when this is called, or else to
+        the loop which first awaits the iterator.
+
+        :param int maxsize: Number of readings to buffer.
+        """
+        from mercurygui.aio import AsyncReadingsQueue
+        queue = AsyncReadingsQueue(maxsize, on_close=self._remove_consumer)
+        self._add_consumer(queue)
+        return queue
+
+    def next_reading(self, timeout=None):
+        """
+        Returns an awaitable of the next readings.
+
+        :param float timeout: Maximum time to wait in sec, forever if None.
+        """
+        from mercurygui.aio import next_reading
+        return next_reading(self, timeout)
+
+    def _add_consumer(self, queue):
+        with self._consumers_lock:
+            self._consumers.append(queue)
+
+    def _remove_consumer(self, queue):
+        with self._consumers_lock:
+            if queue in self._consumers:
+                self._consumers.remove(queue)
+
+    def _publish(self, readings):
+        with self._consumers_lock:
+            consumers = list(self._consumers)
+        for queue in consumers:
+            queue.put(readings)
+
+    def _close_consumers(self):
+        with self._consumers_lock:
+            consumers = list(self._consumers)
+        for queue in consumers:
+            queue.close()
+
+
+class HeadlessFeed(ReadingsPublisher):
+    """
+    Data feed from the MercuryiTC which does not require Qt. Readings are
+    collected in a background thread by a
+    :class:`mercurygui.collector.DataCollector` and can be consumed with
+    :meth:`iter`, :meth:`aiter` and :meth:`next_reading`. The latest full
+    readings are available from :attr:`readings`, earlier temperature, heater
+    and gas flow readings from :attr:`history`, see
+    :class:`mercurygui.history.FeedHistory`.
+
+    :param mercury: Instance of :class:`mercuryitc.MercuryITC`.
+    :param float refresh: Refresh interval in sec.
+    :param dict mod_numbers: Indices of the 'temperature', 'gasflow' and
+        'heater' modules in `mercury.modules`. If not given, the modules are
+        selected as in the GUI, from the 'MercuryFeed' config section.
+    :param str log_directory: Directory of log files from which
+        :attr:`history` reads readings before the start of the feed.
+    :param kwargs: Further arguments of
+        :class:`mercurygui.collector.DataCollector`, for instance `rules`
+        for alarms and interlocks, see :mod:`mercurygui.rules`. Register
+        for alarms with :meth:`add_alarm_listener`.
+    """
+
+    def __init__(self, mercury, refresh=1, mod_numbers=None, log_directory=None,
+                 **kwargs):
+        super(HeadlessFeed, self).__init__()
+        from mercurygui.history import FeedHistory
+
+        self.mercury = mercury
+        self.visa_address = mercury.visa_address
+
+        if mod_numbers is None:
+            from mercurygui.config.main import CONF
+            mod_numbers = select_modules(
+                mercury.modules,
+                CONF.get('MercuryFeed', 'temperature_module'),
+                CONF.get('MercuryFeed', 'gasflow_module'),
+                CONF.get('MercuryFeed', 'heater_module'))
+
+        self.readings = {}
+        self._readings_lock = threading.Lock()
+        # keep at least 24 h in memory
+        self.history = FeedHistory(int(math.ceil(86400 / min(refresh, 1))), log_directory)
+
+        self.worker = DataCollector(refresh, mercury, mod_numbers, **kwargs)
+        self.worker.add_listener(self._on_readings)
+
+        self.thread = threading.Thread(target=self.worker.run, name='HeadlessFeed')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __repr__(self):
+        return '<%s(%s)>' % (type(self).__name__, self.visa_address)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def timing(self):
+        """
+        Timing statistics of the data collection, see
+        :meth:`mercurygui.scheduler.Scheduler.stats`.
+        """
+        return self.worker.scheduler.stats()
+
+    @property
+    def command_latency(self):
+        """
+        Latency of recent commands by priority, see
+        :meth:`mercurygui.collector.DataCollector.command_stats`.
+        """
+        return self.worker.command_stats()
+
+    def add_alarm_listener(self, callback):
+        """
+        Registers a callback for alarms, see
+        :meth:`mercurygui.collector.DataCollector.add_alarm_listener`.
+        """
+        self.worker.add_alarm_listener(callback)
+
+    def request_update(self, keys=None):
+        """Reads the given fields in the next cycle."""
+        self.worker.request_update(keys)
+
+    def submit(self, key, value, priority=WRITE, callback=None):
+        """
+        Changes a setting from the acquisition thread, ahead of polling, see
+        :meth:`mercurygui.collector.DataCollector.submit`.
+        """
+        self.worker.submit(key, value, priority, callback)
+
+    def snapshot(self):
+        """Returns a copy of the latest full readings."""
+        with self._readings_lock:
+            readings = dict(self.readings)
+            readings['Timestamps'] = dict(self.readings.get('Timestamps', {}))
+        return readings
+
+    def close(self):
+        """
+        Stops data collection, ends all iterators and disconnects. Returns
+        once the query in progress has completed.
+        """
+        self.worker.stop()
+        self.thread.join()
+        self._close_consumers()
+
+        if self.mercury.connected:
+            self.mercury.disconnect()
+
+    def _on_readings(self, readings):
+        with self._readings_lock:
+            merge_readings(self.readings, readings)
+            self.history.record(readings, self.readings)
+        self._publish(readings)
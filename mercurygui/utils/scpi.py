@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Conversion of SCPI values of the MercuryiTC.
+
+Note: Leave this file free of Qt related imports, so that it can be used
+without a GUI.
+"""
+from __future__ import division, absolute_import
+import re
+
+_FLOAT_RE = re.compile(r'^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?')
+
+
+def to_float(value):
+    """Converts a SCPI value such as '295.1000K' to a float, ignoring units."""
+    match = _FLOAT_RE.match(value)
+    if match is None:
+        raise ValueError('Could not convert %r to float.' % value)
+    return float(match.group(0))
+
+
+def to_signal(value):
+    """Converts a SCPI signal such as '295.1000K' to a tuple (295.1, 'K')."""
+    match = _FLOAT_RE.match(value)
+    if match is None:
+        raise ValueError('Could not convert %r to signal.' % value)
+    return float(match.group(0)), value[match.end():]
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Sets up widgets from the Qt Designer files of mercurygui.
+
+The '.ui' files are compiled to Python modules in :mod:`mercurygui.compiled_ui`
+at build time, see :func:`compile_ui`, which saves parsing the XML each time a
+window is created. If a compiled module is missing or out of date, for
+instance in a development checkout, the '.ui' file is loaded at runtime with
+:func:`qtpy.uic.loadUi` instead. To compile the modules in place, run:
+
+    $ python -m mercurygui.utils.uiloader
+"""
+from __future__ import division, print_function, absolute_import
+import os
+import io
+import re
+import hashlib
+import importlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+UI_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+COMPILED_DIR = os.path.join(UI_DIR, 'compiled_ui')
+COMPILED_PACKAGE = 'mercurygui.compiled_ui'
+
+# Qt Designer files in UI_DIR, without extension
+UI_NAMES = ('main', 'connection_dialog', 'module_dialog')
+
+
+def _digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def load_ui(name, widget):
+    """
+    Sets up `widget` from the Qt Designer file `name`.ui, like
+    :func:`qtpy.uic.loadUi`.
+
+    :param str name: Name of the '.ui' file in the mercurygui package,
+        without extension.
+    :param widget: Widget to set up.
+    """
+    path = os.path.join(UI_DIR, name + '.ui')
+
+    try:
+        module = importlib.import_module('%s.%s_ui' % (COMPILED_PACKAGE, name))
+        # the '.ui' file may not be installed if compiled
+        up_to_date = not os.path.exists(path) or module.UI_DIGEST == _digest(path)
+    except ImportError:
+        module, up_to_date = None, False
+
+    if up_to_date:
+        ui = module.Ui()
+        ui.setupUi(widget)
+        # child widgets become attributes of widget, as with loadUi
+        widget.__dict__.update(ui.__dict__)
+    else:
+        from qtpy import uic
+
+        if module:
+            logger.debug('Compiled %s is out of date, loading %s.', module.__name__, path)
+        uic.loadUi(path, widget)
+
+
+def compile_ui(names=UI_NAMES, force=False):
+    """
+    Compiles Qt Designer files to modules in :mod:`mercurygui.compiled_ui`
+    if they changed since they were last compiled. Requires PyQt5.
+
+    :param names: Names of the '.ui' files, without extension.
+    :param bool force: Compile even if up to date.
+    :returns: List of paths of the compiled modules.
+    """
+    from PyQt5 import uic as pyqt_uic
+
+    compiled = []
+    for name in names:
+        path = os.path.join(UI_DIR, name + '.ui')
+        target = os.path.join(COMPILED_DIR, name + '_ui.py')
+        digest = _digest(path)
+
+        if not force and os.path.exists(target):
+            with io.open(target, encoding='utf-8') as f:
+                if "UI_DIGEST = '%s'" % digest in f.read():
+                    continue
+
+        source = io.StringIO()
+        pyqt_uic.compileUi(path, source)
+        code = source.getvalue().replace(path, os.path.basename(path))
+        # use the Qt binding selected by qtpy at runtime
+        code = code.replace('from PyQt5 import', 'from qtpy import')
+        cls = re.search(r'^class (Ui_\w+)', code, re.MULTILINE).group(1)
+        code += "\n\nUi = %s\n\nUI_DIGEST = '%s'\n" % (cls, digest)
+
+        with io.open(target, 'w', encoding='utf-8') as f:
+            f.write(code)
+        compiled.append(target)
+        logger.info('Compiled %s to %s.', path, target)
+
+    return compiled
+
+
+if __name__ == '__main__':
+    for p in compile_ui(force=True):
+        print('Compiled %s' % p)
@@ -1,4 +1,18 @@
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
+
+
+class BuildPyWithUi(build_py):
+    """Compiles the Qt Designer files before building."""
+
+    def run(self):
+        try:
+            from mercurygui.utils.uiloader import compile_ui
+            compile_ui()
+        except ImportError as e:  # PyQt5 is required to compile
+            self.warn('Cannot compile .ui files, they will be loaded at runtime: %s' % e)
+        build_py.run(self)
+
 
 setup(
     name='mercurygui',
@@ -16,7 +30,8 @@ setup(
     },
     entry_points={
         'console_scripts': [
-            'mercurygui=mercurygui.main:run'
+            'mercurygui=mercurygui.main:run',
+            'mercurygui-feed=mercurygui.daemon:run',
         ],
         'gui_scripts': [
             'mercurygui=mercurygui.main:run'
@@ -31,6 +46,7 @@ setup(
         'repr',
         'setuptools',
     ],
+    cmdclass={'build_py': BuildPyWithUi},
     zip_safe=False,
     keywords='mercurygui',
     classifiers=[
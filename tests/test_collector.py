@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from __future__ import division, absolute_import
+import unittest
+
+from mercurygui.collector import (CommandQueue, SAFETY, WRITE, QUERY,
+                                  merge_readings)
+
+
+def drain(queue):
+    """Returns the results of all queued commands in the order executed."""
+    results = []
+    command = queue.get()
+    while command is not None:
+        results.append(command.func())
+        command = queue.get()
+    return results
+
+
+class TestCommandQueue(unittest.TestCase):
+
+    def test_empty(self):
+        queue = CommandQueue()
+        self.assertEqual(len(queue), 0)
+        self.assertIsNone(queue.get())
+
+    def test_priority_order(self):
+        queue = CommandQueue()
+        queue.put(lambda: 'query', priority=QUERY)
+        queue.put(lambda: 'write', priority=WRITE)
+        queue.put(lambda: 'safety', priority=SAFETY)
+        self.assertEqual(drain(queue), ['safety', 'write', 'query'])
+
+    def test_submission_order_within_priority(self):
+        queue = CommandQueue()
+        for i in range(5):
+            queue.put(lambda i=i: i)
+        self.assertEqual(drain(queue), [0, 1, 2, 3, 4])
+
+    def test_coalesce_keeps_place(self):
+        queue = CommandQueue()
+        queue.put(lambda: 'a1', key='a')
+        queue.put(lambda: 'b', key='b')
+        queue.put(lambda: 'a2', key='a')
+
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.coalesced, 1)
+        self.assertEqual(drain(queue), ['a2', 'b'])
+
+    def test_coalesce_moves_up(self):
+        queue = CommandQueue()
+        queue.put(lambda: 'b', key='b')
+        queue.put(lambda: 'a1', key='a')
+        queue.put(lambda: 'a2', key='a', priority=SAFETY)
+
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(drain(queue), ['a2', 'b'])
+
+    def test_coalesce_keeps_higher_priority(self):
+        queue = CommandQueue()
+        queue.put(lambda: 'b', key='b', priority=WRITE)
+        queue.put(lambda: 'a1', key='a', priority=SAFETY)
+        queue.put(lambda: 'a2', key='a', priority=QUERY)
+        self.assertEqual(drain(queue), ['a2', 'b'])
+
+    def test_coalesce_keeps_callbacks(self):
+        queue = CommandQueue()
+        first, second = object(), object()
+        queue.put(lambda: None, key='a', callback=first)
+        queue.put(lambda: None, key='a', callback=second)
+        self.assertEqual(queue.get().callbacks, [first, second])
+
+    def test_no_coalescing_after_get(self):
+        queue = CommandQueue()
+        queue.put(lambda: 'a1', key='a')
+        self.assertEqual(queue.get().func(), 'a1')
+        queue.put(lambda: 'a2', key='a')
+        self.assertEqual(queue.coalesced, 0)
+        self.assertEqual(drain(queue), ['a2'])
+
+    def test_commands_without_key_are_not_coalesced(self):
+        queue = CommandQueue()
+        queue.put(lambda: 1)
+        queue.put(lambda: 2)
+        self.assertEqual(drain(queue), [1, 2])
+
+
+class TestMergeReadings(unittest.TestCase):
+
+    def test_merge_delta(self):
+        state = {'Temp': 10.0, 'HeaterPercent': 1.0,
+                 'Timestamps': {'Temp': 1.0, 'HeaterPercent': 1.0}}
+        update = {'Temp': 11.0, 'Keyframe': False, 'Timestamps': {'Temp': 2.0}}
+
+        merge_readings(state, update)
+
+        self.assertEqual(state['Temp'], 11.0)
+        self.assertEqual(state['HeaterPercent'], 1.0)
+        self.assertEqual(state['Timestamps'], {'Temp': 2.0, 'HeaterPercent': 1.0})
+        self.assertNotIn('Keyframe', state)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import division, absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+from mercurygui.config.user import UserConfig
+
+DEFAULTS = [('Window', {'x': 0, 'name': 'main'}),
+            ('Feed', {'refresh': 1.0, 'periods': {'Temp': 5.0}, 'delta': False})]
+
+
+class TestUserConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp(prefix='mercurygui-test-')
+        self._environ = dict(os.environ)
+        os.environ['HOME'] = os.environ['USERPROFILE'] = self.home
+        self.configs = []
+
+    def tearDown(self):
+        # pending changes must not be written to the real home at exit
+        for config in self.configs:
+            config.flush()
+        os.environ.clear()
+        os.environ.update(self._environ)
+        shutil.rmtree(self.home)
+
+    def config(self, save_delay=0):
+        config = UserConfig('test', defaults=DEFAULTS, load=True, version='1.0.0',
+                            subfolder='.mercurygui-test', raw_mode=True,
+                            save_delay=save_delay)
+        self.configs.append(config)
+        return config
+
+    def test_defaults(self):
+        config = self.config()
+        self.assertEqual(config.get('Window', 'x'), 0)
+        self.assertEqual(config.get('Window', 'name'), 'main')
+        self.assertEqual(config.get('Feed', 'refresh'), 1.0)
+        self.assertEqual(config.get('Feed', 'periods'), {'Temp': 5.0})
+        self.assertIs(config.get('Feed', 'delta'), False)
+
+    def test_cached_values_are_copies(self):
+        config = self.config()
+        config.get('Feed', 'periods')['Temp'] = 1.0
+        self.assertEqual(config.get('Feed', 'periods'), {'Temp': 5.0})
+
+    def test_set_and_reload(self):
+        config = self.config()
+        config.set('Window', 'x', 42)
+        config.set('Feed', 'periods', {'Temp': 2.0})
+        self.assertEqual(config.get('Window', 'x'), 42)
+        self.assertEqual(config.get('Feed', 'periods'), {'Temp': 2.0})
+        config.flush()
+
+        config = self.config()
+        self.assertEqual(config.get('Window', 'x'), 42)
+        self.assertEqual(config.get('Feed', 'periods'), {'Temp': 2.0})
+
+    def test_writes_are_delayed(self):
+        config = self.config(save_delay=60)
+        config.set('Window', 'x', 1)
+        config.set('Window', 'x', 2)
+        self.assertFalse(os.path.exists(config.filename()))
+
+        config.flush()
+        with open(config.filename()) as f:
+            self.assertIn('x = 2', f.read())
+
+    def test_option_without_default(self):
+        config = self.config()
+        self.assertEqual(config.get('Other', 'value', 3), 3)
+        config.set('Other', 'value', 4)
+        config.flush()
+        self.assertEqual(self.config().get('Other', 'value'), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+from __future__ import division, absolute_import
+import unittest
+import numpy as np
+
+from mercurygui.history import RingBuffer, TemperatureHistory, FeedHistory, downsample
+
+
+def samples(t):
+    """Returns columns of readings at times `t`."""
+    t = np.asarray(t, dtype=float)
+    return np.vstack([t, 100 + np.sin(t / 10), (t % 7) / 7, (t % 11) / 11])
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def test_append_wraps_around(self):
+        ring = RingBuffer(1, 4)
+        for i in range(10):
+            ring.append([i])
+        self.assertEqual(len(ring), 4)
+        self.assertEqual(ring.last().tolist(), [[6, 7, 8, 9]])
+        self.assertEqual(ring.last(2).tolist(), [[8, 9]])
+
+    def test_last_is_contiguous_view(self):
+        ring = RingBuffer(2, 5)
+        for i in range(7):
+            ring.append([i, -i])
+        view = ring.last()
+        self.assertTrue(np.shares_memory(view, ring._data))
+        self.assertEqual(view.tolist(), [[2, 3, 4, 5, 6], [-2, -3, -4, -5, -6]])
+
+    def test_extend_equals_append(self):
+        a, b = RingBuffer(1, 5), RingBuffer(1, 5)
+        a.append([0])
+        b.append([0])
+        values = np.arange(1, 8)[np.newaxis]
+        for v in values[0]:
+            a.append([v])
+        b.extend(values)
+        self.assertEqual(a.last().tolist(), b.last().tolist())
+
+    def test_extend_beyond_capacity(self):
+        ring = RingBuffer(1, 3)
+        ring.append([-1])
+        ring.extend(np.arange(10)[np.newaxis])
+        self.assertEqual(ring.last().tolist(), [[7, 8, 9]])
+
+    def test_prepend_wraps_around(self):
+        ring = RingBuffer(1, 5)
+        ring.extend([[3, 4]])
+        self.assertEqual(ring.prepend([[0, 1, 2]]), 3)
+        self.assertEqual(ring.last().tolist(), [[0, 1, 2, 3, 4]])
+        ring.append([5])
+        self.assertEqual(ring.last().tolist(), [[1, 2, 3, 4, 5]])
+
+    def test_prepend_drops_oldest(self):
+        ring = RingBuffer(1, 4)
+        ring.extend([[5, 6]])
+        self.assertEqual(ring.prepend([[1, 2, 3, 4]]), 2)
+        self.assertEqual(ring.last().tolist(), [[3, 4, 5, 6]])
+        self.assertEqual(ring.prepend([[0]]), 0)
+
+    def test_clear(self):
+        ring = RingBuffer(1, 3)
+        ring.extend([[1, 2]])
+        ring.clear()
+        self.assertEqual(len(ring), 0)
+        self.assertEqual(ring.last().shape, (1, 0))
+
+
+class TestTemperatureHistory(unittest.TestCase):
+
+    def test_extend_equals_append(self):
+        columns = samples(np.arange(1000))
+        a, b = TemperatureHistory(256), TemperatureHistory(256)
+        for column in columns.T:
+            a.append(*column)
+        b.extend(columns[:, :500])
+        b.extend(columns[:, 500:])
+
+        np.testing.assert_array_equal(a.last(), b.last())
+        np.testing.assert_allclose(a.decimated_window(1000, 20), b.decimated_window(1000, 20))
+
+    def test_decimation_keeps_extremes(self):
+        history = TemperatureHistory(10000)
+        columns = samples(np.arange(10000))
+        columns[1, 1234] = 1000.0
+        columns[1, 5678] = -1000.0
+        history.extend(columns)
+
+        data = history.decimated_window(10000, 100)
+        self.assertLessEqual(data.shape[1], 2 * 100 + 2)
+        self.assertEqual(data[1].max(), 1000.0)
+        self.assertEqual(data[1].min(), -1000.0)
+
+    def test_window(self):
+        history = TemperatureHistory(100)
+        history.extend(samples(np.arange(50)))
+        self.assertEqual(history.window(10)[0].tolist(), list(range(39, 50)))
+        self.assertEqual(history.earliest_time, 0)
+        self.assertEqual(history.latest_time, 49)
+
+    def test_prepend_equals_extend(self):
+        columns = samples(np.arange(1000))
+        a, b = TemperatureHistory(1000), TemperatureHistory(1000)
+        a.extend(columns)
+        b.extend(columns[:, 700:])
+        for end in (700, 400, 100):
+            b.prepend(columns[:, end - 300:end])
+        b.prepend(columns[:, :100])
+
+        np.testing.assert_array_equal(a.last(), b.last())
+        for n in (10, 50, 200):
+            data_a, data_b = a.decimated_window(1000, n), b.decimated_window(1000, n)
+            np.testing.assert_array_equal(data_a[1:].min(axis=1), data_b[1:].min(axis=1))
+            np.testing.assert_array_equal(data_a[1:].max(axis=1), data_b[1:].max(axis=1))
+
+    def test_prepend_drops_later_samples(self):
+        history = TemperatureHistory(100)
+        history.extend(samples(np.arange(10, 20)))
+        self.assertEqual(history.prepend(samples(np.arange(5, 15))), 5)
+        self.assertEqual(history.earliest_time, 5)
+
+
+class TestFeedHistory(unittest.TestCase):
+
+    def test_record_uses_timestamps(self):
+        history = FeedHistory(100)
+        readings = {'Temp': 10.0, 'HeaterPercent': 50.0, 'FlowPercent': 20.0,
+                    'Timestamps': {'Temp': 5.0, 'HeaterPercent': 6.0, 'FlowPercent': 4.0}}
+        self.assertEqual(history.record(readings), (6.0, 10.0, 0.5, 0.2))
+        # nothing new was read
+        self.assertIsNone(history.record(readings))
+
+        update = {'Temp': 11.0, 'Timestamps': {'Temp': 7.0}}
+        full = dict(readings, Temp=11.0)
+        self.assertEqual(history.record(update, full), (7.0, 11.0, 0.5, 0.2))
+        self.assertEqual(len(history), 2)
+
+    def test_record_without_readings(self):
+        history = FeedHistory(100)
+        self.assertIsNone(history.record({'TempSetpoint': 10.0}))
+
+    def test_query_memory(self):
+        history = FeedHistory(1000)
+        history.extend(samples(np.arange(600)))
+
+        self.assertEqual(history.query(100, 200).shape, (4, 100))
+        self.assertEqual(history.query(t1=0).shape, (4, 0))
+        columns = history.query(fields=('time', 'temp'), resolution=60)
+        self.assertEqual(columns.shape, (2, 10))
+        self.assertEqual(columns[0].tolist(), list(range(0, 600, 60)))
+        self.assertLessEqual(history.query(max_points=20).shape[1], 20)
+
+    def test_query_unknown_field(self):
+        self.assertRaises(ValueError, FeedHistory(10).query, fields=('pressure',))
+
+
+class TestDownsample(unittest.TestCase):
+
+    def test_weighted_means(self):
+        columns = np.array([[0.0, 1.0, 2.0, 3.0], [1.0, 3.0, 5.0, 7.0]])
+        result, counts = downsample(columns, 2, weights=[1, 3, 1, 1])
+        self.assertEqual(result.tolist(), [[0.0, 2.0], [2.5, 6.0]])
+        self.assertEqual(counts.tolist(), [4, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
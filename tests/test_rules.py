@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from __future__ import division, absolute_import
+import unittest
+
+from mercurygui.rules import RuleEngine, Condition, compile_rule
+
+
+def readings(t, **values):
+    """Returns readings which were all read at time `t`."""
+    values['Timestamps'] = dict((key, t) for key in values)
+    return values
+
+
+class TestCondition(unittest.TestCase):
+
+    def test_hysteresis(self):
+        condition = Condition('Temp', '>', 300, hysteresis=2)
+        states = [condition.update({'Temp': temp}) for temp in (299, 301, 299, 298.5, 297, 300.5)]
+        self.assertEqual(states, [False, True, True, True, False, True])
+
+    def test_missing_reading(self):
+        condition = Condition('Temp', '>', 300)
+        self.assertFalse(condition.update({}))
+        self.assertFalse(condition.update({'Temp': None}))
+
+    def test_rate(self):
+        condition = Condition('Temp', '<', 0, rate=True, window=60)
+        # falling by 1 K per minute
+        states = [condition.update(readings(t, Temp=100 - t / 60)) for t in range(0, 300, 10)]
+        self.assertFalse(states[0])
+        self.assertTrue(all(states[1:]))
+        # flat for a window
+        states = [condition.update(readings(t, Temp=95)) for t in range(300, 400, 10)]
+        self.assertFalse(states[-1])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, Condition, 'Temp', '~', 1)
+        self.assertRaises(ValueError, Condition, 'Temp', '==', 1, hysteresis=1)
+
+
+class TestRule(unittest.TestCase):
+
+    def test_duration(self):
+        rule = compile_rule({'name': 'hot', 'for': 30,
+                             'when': [{'key': 'Temp', 'op': '>', 'value': 300}]})
+        self.assertIsNone(rule.update({'Temp': 301}, 0))
+        self.assertIsNone(rule.update({'Temp': 301}, 20))
+        self.assertTrue(rule.update({'Temp': 301}, 30))
+        self.assertIsNone(rule.update({'Temp': 301}, 40))
+        self.assertFalse(rule.update({'Temp': 299}, 50))
+        # the duration restarts
+        self.assertIsNone(rule.update({'Temp': 301}, 60))
+        self.assertIsNone(rule.update({'Temp': 301}, 80))
+
+    def test_all_conditions(self):
+        rule = compile_rule({'name': 'saturated', 'when': [
+            {'key': 'Temp', 'op': '>', 'value': 300},
+            {'key': 'HeaterPercent', 'op': '>=', 'value': 80}]})
+        self.assertIsNone(rule.update({'Temp': 301, 'HeaterPercent': 50}, 0))
+        self.assertTrue(rule.update({'Temp': 301, 'HeaterPercent': 80}, 1))
+
+    def test_invalid(self):
+        when = [{'key': 'Temp', 'op': '>', 'value': 300}]
+        self.assertRaises(ValueError, compile_rule, {'when': when})
+        self.assertRaises(ValueError, compile_rule, {'name': 'x', 'when': []})
+        self.assertRaises(ValueError, compile_rule, {'name': 'x', 'when': when, 'actions': ['boom']})
+        self.assertRaises(ValueError, compile_rule, {'name': 'x', 'when': when, 'unknown': 1})
+        self.assertRaises(ValueError, compile_rule,
+                          {'name': 'x', 'when': when, 'actions': [{'Pressure': 1}]},
+                          ['HeaterAuto'])
+
+
+class TestRuleEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = RuleEngine([
+            {'name': 'hot', 'when': [{'key': 'Temp', 'op': '>', 'value': 300, 'hysteresis': 1}],
+             'actions': ['heater_off', 'notify']},
+        ], settings=('HeaterAuto', 'HeaterPercent'))
+
+    def test_evaluate(self):
+        self.assertEqual(self.engine.evaluate({'Temp': 299}, 0), [])
+        changes = self.engine.evaluate({'Temp': 301}, 1)
+        self.assertEqual([(rule.name, active) for rule, active in changes], [('hot', True)])
+        self.assertEqual(self.engine.active, ['hot'])
+        changes = self.engine.evaluate({'Temp': 298}, 2)
+        self.assertEqual([(rule.name, active) for rule, active in changes], [('hot', False)])
+        self.assertEqual(self.engine.active, [])
+
+    def test_enforced(self):
+        self.engine.evaluate({'Temp': 301}, 0)
+        state = {'Temp': 301, 'HeaterAuto': 'ON', 'HeaterPercent': 0.0}
+        self.assertEqual(self.engine.enforced(state), {'HeaterAuto': 'OFF'})
+        state['HeaterAuto'] = 'OFF'
+        self.assertEqual(self.engine.enforced(state), {})
+
+    def test_enforced_convert(self):
+        engine = RuleEngine([{'name': 'off', 'when': [{'key': 'Temp', 'op': '>', 'value': 0}],
+                              'actions': [{'FlowAuto': False}]}])
+        engine.evaluate({'Temp': 1}, 0)
+
+        def convert(key, value):
+            return 'ON' if value else 'OFF'
+
+        self.assertEqual(engine.enforced({'FlowAuto': 'OFF'}, convert), {})
+        self.assertEqual(engine.rules[0].settings, {'FlowAuto': False})
+
+    def test_check_settings(self):
+        self.engine.check_settings(['HeaterAuto', 'HeaterPercent'])
+        self.assertRaises(ValueError, self.engine.check_settings, ['HeaterAuto'])
+
+    def test_unique_names(self):
+        rule = {'name': 'x', 'when': [{'key': 'Temp', 'op': '>', 'value': 1}]}
+        self.assertRaises(ValueError, RuleEngine, [rule, rule])
+
+
+if __name__ == '__main__':
+    unittest.main()
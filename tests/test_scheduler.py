@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import division, absolute_import
+import unittest
+
+from mercurygui.scheduler import Backoff
+
+
+class TestBackoff(unittest.TestCase):
+
+    def test_growth_and_maximum(self):
+        backoff = Backoff(initial=0.5, maximum=4.0, factor=2.0, jitter=0)
+        delays = [backoff.next_delay() for _ in range(6)]
+        self.assertEqual(delays, [0.5, 1.0, 2.0, 4.0, 4.0, 4.0])
+        self.assertEqual(backoff.attempts, 6)
+
+    def test_reset(self):
+        backoff = Backoff(initial=1.0, jitter=0)
+        backoff.next_delay()
+        backoff.next_delay()
+        backoff.reset()
+        self.assertEqual(backoff.next_delay(), 1.0)
+
+    def test_jitter(self):
+        backoff = Backoff(initial=10.0, maximum=10.0, jitter=0.5, seed=0)
+        delays = [backoff.next_delay() for _ in range(100)]
+        self.assertTrue(all(5.0 <= delay <= 10.0 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_many_attempts(self):
+        backoff = Backoff(maximum=30.0, jitter=0)
+        for _ in range(2000):
+            delay = backoff.next_delay()
+        self.assertEqual(delay, 30.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+from __future__ import division, absolute_import
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from mercurygui import segment
+from mercurygui.log_reader import find_logs, read_log
+from mercurygui.log_writer import (SegmentLog, TextLog, text_header, compress_log,
+                                   write_rollup, LogLock, log_in_use)
+
+
+def rows(t0, n):
+    """Returns `n` rows of readings, one per sec from `t0`."""
+    t = t0 + np.arange(n, dtype=float)
+    return np.column_stack([t, 100 + np.sin(t / 60), (t % 7) / 7, (t % 11) / 11])
+
+
+class TempDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='mercurygui-test-')
+        # a day ago, so that all rows are in the past
+        self.t0 = float(int(time.time()) - 86400)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class TestSegment(TempDirTestCase):
+
+    def test_round_trip(self):
+        path = os.path.join(self.directory, 'test.mseg')
+        data = rows(self.t0, 100)
+
+        writer = segment.SegmentWriter(path, capacity=200, heater_vlim=12.5)
+        self.assertEqual(writer.append(data[:40]), 40)
+        self.assertEqual(writer.append(data[40:]), 60)
+
+        seg = segment.Segment(path)
+        self.assertEqual(len(seg), 100)
+        self.assertEqual(seg.fields, segment.FIELDS)
+        self.assertEqual(seg.heater_vlim, 12.5)
+        np.testing.assert_array_equal(seg.columns, data.T)
+        np.testing.assert_array_equal(seg.field('temp'), data[:, 1])
+
+    def test_full(self):
+        path = os.path.join(self.directory, 'test.mseg')
+        writer = segment.SegmentWriter(path, capacity=10)
+        self.assertEqual(writer.append(rows(self.t0, 15)), 10)
+        self.assertTrue(writer.full)
+        self.assertEqual(writer.append(rows(self.t0, 1)), 0)
+        self.assertEqual(len(segment.Segment(path)), 10)
+
+    def test_empty(self):
+        path = os.path.join(self.directory, 'test.mseg')
+        segment.SegmentWriter(path, capacity=10)
+        self.assertEqual(segment.Segment(path).columns.shape, (4, 0))
+
+    def test_not_a_segment(self):
+        path = os.path.join(self.directory, 'test.mseg')
+        with open(path, 'wb') as f:
+            f.write(b'0' * segment.HEADER_SIZE)
+        self.assertRaises(ValueError, segment.Segment, path)
+
+
+class TestLogs(TempDirTestCase):
+
+    def test_segment_log_round_trip(self):
+        data = rows(self.t0, 250)
+        log = SegmentLog(self.directory, capacity=100)
+        log.write(data[:150])
+        log.write(data[150:])
+        self.assertEqual(len(log.paths), 3)
+
+        logs = find_logs(self.directory)
+        self.assertEqual([path for _, path in logs], log.paths)
+        columns = np.concatenate([read_log(path) for _, path in logs], axis=1)
+        np.testing.assert_array_equal(columns, data.T)
+
+    def test_text_log_round_trip(self):
+        data = rows(self.t0, 100)
+        name = 'temperature_log %s.txt' % time.strftime('%Y-%m-%d_%H-%M-%S',
+                                                        time.localtime(self.t0))
+        path = os.path.join(self.directory, name)
+        log = TextLog(path, text_header(10))
+        log.write(data[:30])
+        log.write(data[30:])
+
+        np.testing.assert_allclose(read_log(path), data.T)
+        np.testing.assert_allclose(read_log(path, self.t0 + 10, self.t0 + 20), data[10:20].T)
+
+    def test_compressed_round_trip(self):
+        data = rows(self.t0, 1000)
+        for ext in ('.mseg', '.txt'):
+            if ext == '.txt':
+                path = os.path.join(self.directory, 'temperature_log %s.txt' % time.strftime(
+                    '%Y-%m-%d_%H-%M-%S', time.localtime(self.t0)))
+                TextLog(path, text_header(10)).write(data)
+            else:
+                log = SegmentLog(self.directory, capacity=1000)
+                log.write(data)
+                path = log.paths[0]
+
+            target = compress_log(path, block_rows=128)
+            self.assertFalse(os.path.exists(path))
+            np.testing.assert_allclose(read_log(target), data.T)
+            np.testing.assert_allclose(read_log(target, self.t0 + 300, self.t0 + 700),
+                                       data[300:700].T)
+            os.remove(target)
+
+    def test_rollup(self):
+        data = rows(self.t0 - self.t0 % 60, 600)
+        log = SegmentLog(self.directory, capacity=600)
+        log.write(data)
+
+        columns = segment.Segment(write_rollup(log.paths[0])).columns
+        self.assertEqual(columns.shape[1], 10)
+        np.testing.assert_allclose(columns[1], data[:, 1].reshape(10, 60).mean(axis=1))
+
+
+class TestLogLock(TempDirTestCase):
+
+    def test_lock(self):
+        path = os.path.join(self.directory, 'test.txt')
+        lock = LogLock(path)
+        self.assertFalse(log_in_use(path))
+        self.assertTrue(lock.acquire())
+        self.assertTrue(lock.locked)
+        lock.release()
+        self.assertFalse(lock.locked)
+        self.assertFalse(log_in_use(path))
+
+
+if __name__ == '__main__':
+    unittest.main()